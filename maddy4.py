@@ -8,6 +8,7 @@ from guizero import (App, Text, Picture,
 import os
 
 from observations import Observations, Observation, Image
+from observations.scanner import get_image_filenames
 
 IMAGE_WIDTH = 1024
 IMAGE_HEIGHT = 768
@@ -164,17 +165,6 @@ def show_file(file_pointer):
     # return the file_pointer
     return file_pointer
 
-def get_image_filenames(imagepath):
-    """get_image_filenames(imagepath) - return a list of image filenames"""
-    image_files = []
-    valid_extensions = ['jpg','jpeg','png']
-    for fn in os.listdir(imagepath):
-        parts = fn.split('.')
-        for ext in valid_extensions:
-            if parts[-1].lower() == ext:
-                image_files.append(fn)
-    return image_files
-    
 def mark_function():
     """initates marking operation"""
     global files
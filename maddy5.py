@@ -6,19 +6,46 @@ import tkinter
 # GUIZero is a simplified wrapper on Tkinter
 from guizero import (App, Text, Picture,
                      MenuBar, TextBox, Window,
-                     PushButton, warn, info, askstring,
-                     Drawing)
+                     PushButton, warn, info, error, askstring,
+                     Drawing, Combo)
 
 import os
 
-from observations import Observations, Observation, Image
+from observations import Observations, Observation, Image, OBSERVATION_FIELDS, NATIVE, image_registry
+from observations.scanner import get_image_filenames, FolderScanner
+from observations.storage import SQLiteStorage, RESTORED, REPAIRED
+from observations.prefetch import DisplayCache, Prefetcher
+from observations.previews import PreviewStore
+from observations.instrument import recorder, timed, LatencyOverlay
+from observations.render import MarkerLayer
+from observations.background import IOWorker
+from observations.shared import log_pathname
+from observations.vocabulary import Vocabulary, vocabulary_pathname
+from observations.picker import SpeciesDialog
+from observations.events import EventQueue
+from observations.triage import Triage
+from observations.sequences import Sequences, DEFAULT_GAP
 
 IMAGE_WIDTH = 1024
 IMAGE_HEIGHT = 768
-RIGHT_ARROW = 38
-RIGHT_ARROW_OSX = 8189699
-LEFT_ARROW = 39
-LEFT_ARROW_OSX = 8124162
+APP_TITLE = "Madeleine Ward Marker Prototype"
+# a key action returns RETRY to be run again a little later (see handle_input)
+RETRY = 'retry'
+# key names (see key_name) of Ctrl+Z and Ctrl+Y
+CONTROL = 'Control-'
+UNDO_KEY = CONTROL + 'z'
+REDO_KEY = CONTROL + 'y'
+# Tk event state bit of the Ctrl key
+CONTROL_MASK = 0x4
+# milliseconds between checkpoints (journal folded into annotations.csv)
+CHECKPOINT_INTERVAL = 5 * 60 * 1000
+# milliseconds between looks at other annotators' logs in a shared folder
+REFRESH_INTERVAL = 3000
+# milliseconds each frame is shown by the triage slideshow, and frames decoded ahead of it
+SLIDESHOW_INTERVAL = 700
+SLIDESHOW_AHEAD = 5
+# milliseconds before markers held up by a background save are drawn again (see show_file)
+MARKERS_RETRY = 50
 
 # note we can import Tkinter widget
 from tkinter import filedialog, messagebox, simpledialog
@@ -26,75 +53,568 @@ from tkinter import filedialog, messagebox, simpledialog
 # set a default folder and files
 folder_selected = '.'
 files = []
+file_pathnames = []
 file_pointer = 0
-DEBUG = False
+# timings of show_file, saves, EXIF reads, decoding and marker drawing are
+# recorded when MADDY_TRACE=1 is set or the timing overlay is turned on (Help menu)
     
 # ANNOTATIONS FOR THE IMAGE DATA are stored in a local CSV file
 annotations_filename = 'annotations.csv'
-observations = Observations(annotations_filename, folder_selected)
+# the folder's species (species.csv): canonical names, aliases and hotkeys
+vocabulary = Vocabulary.load(vocabulary_pathname(folder_selected))
+# (lazy: rows are only made into observations when their image is shown)
+observations = Observations(annotations_filename, folder_selected, journal=True, lazy=True, columnar=True,
+                            vocabulary=vocabulary)
 current_observation_indices = []
-print("Loaded {} observations".format(len(observations.items)))
+print("Opened {}".format(observations.pathname))
 current_image = None
+
+# in project mode all folders share one SQLite database (see open_project)
+project = None
+# when marking a folder together with others, this annotator's name (see mark_together)
+annotator = None
+# rapid marking: clicks mark rapid_species straight away (see set_rapid)
+rapid = False
+rapid_species = None
+# reviewed/empty flags of the files (see mark_function), and the triage slideshow
+triage = None
+slideshow = False
+slideshow_interval = SLIDESHOW_INTERVAL
+# bumped when the slideshow starts, so a stale timer from an earlier run stops
+slideshow_run = 0
+# bursts: files are sorted by EXIF datetime and grouped into trigger events (see mark_function)
+sequences = None
+sequence_gap = DEFAULT_GAP
+# lists folders by EXIF datetime, only used on the I/O thread (see datetime_order)
+datetime_scanner = FolderScanner(sort='datetime')
+
+# decoded, display-size images; neighbours of the current file are decoded
+# in the background so arrow key navigation doesn't wait on JPEG decoding
+display_cache = DisplayCache(width=IMAGE_WIDTH, height=IMAGE_HEIGHT)
+prefetcher = Prefetcher(display_cache, ahead=3)
+
+# loads and saves run on this thread so the window never waits on the disk,
+# results come back through io_worker.poll (see app.repeat below)
+io_worker = IOWorker()
     
+def key_name(keysym, state=0):
+    """key_name(keysym, state=0) - the KEY_BINDINGS name of a key press
+    keys go by Tk keysym, which is the same on every platform (on macOS the
+    arrows type a private character), letters in lower case so Caps Lock and
+    Shift don't matter, with CONTROL in front while Ctrl is held
+    """
+    if len(keysym) == 1:
+        keysym = keysym.lower()
+    if state & CONTROL_MASK:
+        return CONTROL + keysym
+    return keysym
+
+
 def keypress_hook(event_data):
-    """if a key is pressed in the app, do corresponding function"""
-    # it is not state aware yet, I will want to change that later.
+    """queue a key press, handle_input does the work (the key name, see key_name,
+    and the character typed for the species hotkeys)
+    """
+    tk_event = event_data._tk_event
+    input_queue.put('key', key_name(tk_event.keysym, tk_event.state), event_data.key)
+
+
+def next_file():
+    """save and move to the next picture"""
+    go_to(file_pointer + 1)
+
+
+def previous_file():
+    """save and move back one picture"""
+    go_to(file_pointer - 1)
+
+
+def go_to(position):
+    """save, flag the picture on screen as reviewed and show files[position]"""
     global file_pointer
-    keycode = event_data._tk_event.keycode
-    if DEBUG: print('keypressed:', keycode, '=', event_data.key)
-    if keycode == RIGHT_ARROW or keycode == RIGHT_ARROW_OSX:
-        # RIGHT arrow
-        observations.save()
-        file_pointer += 1
-        file_pointer = show_file(file_pointer)
-    if keycode == LEFT_ARROW or keycode == LEFT_ARROW_OSX:
-        # LEFT arrow
-        observations.save()
-        file_pointer -= 1
-        file_pointer = show_file(file_pointer)
+    leave_file()
+    io_worker.save(observations)
+    file_pointer = show_file(position)
+
+
+def leave_file():
+    """the picture on screen has been looked at, flag it reviewed (and empty if it has no marks)"""
+    if triage is not None and current_image is not None:
+        position = triage.positions.get(current_image.fname)
+        if position is not None:
+            triage.set_reviewed(position, empty=not triage.marked[position])
+
+
+def save_if_due():
+    """sync a batch of journaled changes on the I/O thread (clicks never wait on an fsync)"""
+    if observations.sync_due:
+        io_worker.save(observations)
+
+
+def marks_changed(fname):
+    """keep the triage flags of fname in step after marks were added or removed"""
+    save_if_due()
+    if triage is not None:
+        position = triage.positions.get(fname)
+        if position is not None:
+            triage.set_marked(position, len(observations.get_by_filename(fname)) > 0)
+
+
+def next_sequence():
+    """flag the rest of the burst on screen reviewed and show the first frame of the next one"""
+    if sequences is None:
+        return
+    review_sequence()
+    go_to(sequences.next_sequence(file_pointer))
+
+
+def previous_sequence():
+    """show the first frame of the burst before the one on screen"""
+    if sequences is not None:
+        go_to(sequences.previous_sequence(file_pointer))
+
+
+def review_sequence():
+    """the burst on screen has been looked at, flag all its frames reviewed (empty if they have no marks)"""
+    if triage is not None and sequences is not None:
+        for position in sequences.frames(file_pointer):
+            triage.set_reviewed(position, empty=not triage.marked[position])
+
+
+def copy_to_burst():
+    """copy the marks of the picture on screen onto the other frames of its burst (one undo)
+    returns RETRY while the observations are loading or saving
+    """
+    if sequences is None or current_image is None:
+        return
+    if not observations.ready or not observations.lock.acquire(blocking=False):
+        return RETRY
+    try:
+        targets = [files[position] for position in sequences.frames(file_pointer)]
+        copies = observations.copy_marks(current_image.fname, targets)
+    finally:
+        observations.lock.release()
+    for fname in set(copy.image.fname for copy in copies):
+        marks_changed(fname)
+    io_worker.save(observations)
+
+
+def set_sequence_gap():
+    """ask for the seconds between frames of one burst and group the files again"""
+    global sequences, sequence_gap
+    answer = askstring("Burst Gap", "Seconds between the frames of one burst",
+                       initialvalue=str(sequence_gap))
+    if not answer:
+        return
+    try:
+        gap = float(answer)
+        if gap < 0:
+            raise ValueError
+    except ValueError:
+        warn("Burst Gap", "The gap is a number of seconds")
+        return
+    sequence_gap = gap
+    # before the files are in datetime order datetime_ordered groups them
+    if files and sequences is not None:
+        sequences = Sequences.for_folder(folder_selected, files, gap=sequence_gap)
+        update_title()
+
+
+def update_title():
+    """window title: rapid marking and where the picture on screen is in its burst"""
+    parts = [APP_TITLE]
+    if sequences is not None and 0 <= file_pointer < len(files):
+        frames = sequences.frames(file_pointer)
+        parts.append("burst {}/{}, frame {}/{}".format(sequences.sequence(file_pointer) + 1, len(sequences),
+                                                      file_pointer - frames.start + 1, len(frames)))
+    if rapid and rapid_species:
+        parts.append("rapid marking {} (Esc stops)".format(rapid_species))
+    elif rapid:
+        parts.append("rapid marking, pick a species with a number key")
+    app.title = " - ".join(parts)
+
+
+def next_unreviewed():
+    """show the next picture nobody has reviewed yet"""
+    if triage is None:
+        return
+    position = triage.next_unreviewed(file_pointer)
+    if position is None:
+        leave_file()
+        reviewed, empty, total = triage.counts()
+        info("Triage", "All {} pictures are reviewed, {} of them empty".format(total, empty))
+    else:
+        go_to(position)
+
+
+def next_marked():
+    """show the next picture with marks"""
+    if triage is None:
+        return
+    position = triage.next_marked(file_pointer)
+    if position is not None:
+        go_to(position)
+
+
+def toggle_slideshow():
+    """start or stop showing the unreviewed pictures one after another"""
+    global slideshow, slideshow_run
+    slideshow = not slideshow
+    if slideshow and triage is not None:
+        slideshow_run += 1
+        run = slideshow_run
+        app.after(slideshow_interval, lambda: slideshow_step(run))
+    else:
+        slideshow = False
+        save_triage()
+
+
+def slideshow_step(run):
+    """show the next unreviewed picture, decode the ones after it, and come back"""
+    global slideshow
+    if not slideshow or run != slideshow_run:
+        return
+    if triage.next_unreviewed(file_pointer) is None:
+        slideshow = False
+        save_triage()
+    next_unreviewed()
+    if slideshow:
+        for position in triage.upcoming(file_pointer, SLIDESHOW_AHEAD):
+            prefetcher.submit(file_pathnames[position])
+        app.after(slideshow_interval, lambda: slideshow_step(run))
+
+
+def slideshow_speed(factor):
+    """show pictures for factor times as long"""
+    global slideshow_interval
+    slideshow_interval = max(100, int(slideshow_interval * factor))
+
+
+def save_triage():
+    """write the triage flags in the background if they changed"""
+    if triage is not None and triage.dirty:
+        io_worker.submit(triage.save)
+
+
+def checkpoint():
+    """fold the journal into annotations.csv and save the triage flags (every few minutes)"""
+    io_worker.submit(observations.checkpoint)
+    save_triage()
+
+
+def toggle_rapid():
+    """turn rapid marking on or off"""
+    set_rapid(not rapid)
+
+
+def set_rapid(on, species=None):
+    """rapid marking: every left click marks the current species, no dialog"""
+    global rapid, rapid_species
+    rapid = on
+    if species is not None:
+        rapid_species = species
+    update_title()
+
+
+def undo_mark():
+    """undo the last mark, removal or species change (Ctrl+Z)"""
+    return undo_or_redo(observations.undo)
+
+
+def redo_mark():
+    """redo what undo_mark undid (Ctrl+Y)"""
+    return undo_or_redo(observations.redo)
+
+
+def undo_or_redo(action):
+    """run observations.undo or redo and redraw the markers of the image it changed
+    returns RETRY while the observations are loading or saving
+    """
+    if not observations.ready or not observations.lock.acquire(blocking=False):
+        return RETRY
+    try:
+        command = action()
+    finally:
+        observations.lock.release()
+    if command is not None:
+        for fname in command.fnames:
+            marks_changed(fname)
+        if current_image is not None and current_image.fname in command.fnames:
+            layer.draw_markers(observations.get_by_filename(current_image.fname))
+
+
+def pick_rapid_species(key, char):
+    """a species hotkey makes that species current and turns rapid marking on
+    hotkeys are the character typed (in lower case too, e.g. with Caps Lock on)
+    """
+    if not char or key.startswith(CONTROL):
+        return False
+    species_id = vocabulary.by_hotkey(char)
+    if species_id is None:
+        species_id = vocabulary.by_hotkey(char.lower())
+    if species_id is None:
+        return False
+    set_rapid(True, vocabulary[species_id])
+    return True
+
+
+# keys (by key_name) -> what they do
+KEY_BINDINGS = {
+    'Right': next_file,
+    'Left': previous_file,
+    'F12': lambda: toggle_overlay(),
+    'r': toggle_rapid,
+    'Escape': lambda: set_rapid(False),
+    UNDO_KEY: undo_mark,
+    REDO_KEY: redo_mark,
+    'n': next_unreviewed,
+    'm': next_marked,
+    'space': toggle_slideshow,
+    'plus': lambda: slideshow_speed(0.8),
+    'equal': lambda: slideshow_speed(0.8),
+    'KP_Add': lambda: slideshow_speed(0.8),
+    'minus': lambda: slideshow_speed(1.25),
+    'KP_Subtract': lambda: slideshow_speed(1.25),
+    'Next': next_sequence,
+    'Prior': previous_sequence,
+    'bracketright': next_sequence,
+    'bracketleft': previous_sequence,
+    'c': copy_to_burst,
+}
+
+
+def handle_input(event):
+    """run one queued input event (see EventQueue)
+    returns False to try again later while the observations are loading or saving
+    """
+    kind = event[0]
+    if kind == 'key':
+        key, char = event[1:]
+        if pick_rapid_species(key, char):
+            return True
+        action = KEY_BINDINGS.get(key)
+        if action is not None:
+            # RETRY means not now, the key is tried again
+            return action() is not RETRY
+        return True
+    image, x, y = event[1:]
+    if image is None:
+        return True
+    if slideshow:
+        # stop on the picture to mark it
+        toggle_slideshow()
+    # don't wait for the I/O thread, come back when it is done with the observations
+    if not observations.ready or not observations.lock.acquire(blocking=False):
+        return False
+    try:
+        if kind == 'click' and rapid and rapid_species:
+            add_mark(image, x, y, rapid_species)
+            return True
+        if kind == 'right click' and rapid:
+            remove_nearest_mark(image, x, y)
+            return True
+        if image is not current_image:
+            return True
+        found = observations.find_by_display_location(image.fname, x, y)
+    finally:
+        observations.lock.release()
+    # the dialogs wait for the user, so they are shown without holding the lock
+    # (saves carry on meanwhile, the mark is changed after the dialog)
+    if found is not None:
+        edit_mark(found)
+    elif kind == 'click':
+        mark_with_dialog(image, x, y)
+    return True
 
 
 def pick_directory():
     """allows a user to pick the directory of images on which to work"""
     global folder_selected, annotations_filename, observations
-    if DEBUG: print("Pick a Directory of Images")
     user_selected = filedialog.askdirectory()
     if user_selected:
         folder_selected = user_selected
         messagebox.showinfo("Information","You picked: {}".format(folder_selected))
         # load observations if these exist
-        observations = Observations(filename=annotations_filename, path=folder_selected)
+        observations = open_observations(folder_selected)
     else:
         info("Information", "You cancelled folder selection")
         
     
+def open_observations(folder):
+    """close the current observations and open the ones for folder
+    from the project database in project mode, else from the folder annotations.csv
+    closing and reading happen in the background, observations_loaded is called when done
+    """
+    global vocabulary
+    io_worker.submit(observations.close)
+    vocabulary = Vocabulary.load(vocabulary_pathname(folder))
+    if project is None:
+        opened = Observations(annotations_filename, folder, journal=True, lazy=True, columnar=True,
+                              annotator=annotator, vocabulary=vocabulary)
+    else:
+        csv_pathname = os.path.join(folder, annotations_filename)
+        io_worker.submit(import_folder, project, folder, csv_pathname)
+        opened = Observations(annotations_filename, folder, storage=project, lazy=True, columnar=True,
+                              vocabulary=vocabulary)
+    io_worker.load(opened, on_done=observations_loaded)
+    io_worker.submit(assign_hotkeys, opened, vocabulary, folder)
+    return opened
+
+
+def assign_hotkeys(opened, vocabulary, folder):
+    """put the folder's most common species on the number keys if it has no hotkeys yet (I/O thread)"""
+    if not vocabulary.hotkeys:
+        counts = opened.summarize().table(by=('species',))
+        counts.sort(key=lambda item: -item[1])
+        vocabulary.assign_hotkeys([vocabulary.code(key[0]) for key, count in counts if key[0]])
+    if vocabulary.dirty:
+        vocabulary.save(vocabulary_pathname(folder))
+
+
+def import_folder(project, folder, csv_pathname):
+    """bring a folder's annotations.csv into the project on the first visit (I/O thread)"""
+    if not project.imported(folder) and os.path.exists(csv_pathname):
+        project.import_csv(csv_pathname, folder)
+
+
+def observations_loaded(loaded):
+    """annotations finished loading, draw the markers of the image on screen"""
+    if loaded is observations and triage is not None:
+        triage.update_marks(observations.marked_filenames())
+    if loaded is observations and current_image is not None:
+        layer.draw_markers(observations.get_by_filename(current_image.fname))
+        overlay.draw()
+    if loaded.recovered == RESTORED:
+        info("Recovered", "annotations.csv was lost in a crash, it was restored from annotations.csv.bak")
+    elif loaded.recovered == REPAIRED:
+        info("Recovered", "The last line of annotations.csv was cut off in a crash and was dropped "
+                          "(the damaged file is kept as annotations.csv.damaged)")
+
+
+def mark_together():
+    """share the folder with other annotators, each one's marks show up for the others"""
+    global annotator, observations
+    name = askstring("Mark Together", "Your name (letters, digits, - and _)")
+    if not name:
+        return
+    if project is not None:
+        warn("Mark Together", "Project databases are already shared, close the project first")
+        return
+    try:
+        log_pathname(annotations_filename, name.strip())
+    except ValueError as e:
+        warn("Mark Together", str(e))
+        return
+    annotator = name.strip()
+    observations = open_observations(folder_selected)
+
+
+def refresh_shared():
+    """pick up other annotators' marks (in the background) when the folder is shared"""
+    if observations.annotator is None or io_worker.pending:
+        return
+    refreshing = observations
+
+    def refreshed(changed):
+        if refreshing is observations and triage is not None:
+            if changed is True:
+                triage.update_marks(observations.marked_filenames())
+            else:
+                for fname in changed:
+                    marks_changed(fname)
+        if refreshing is observations and current_image is not None:
+            if changed is True or current_image.fname in changed:
+                layer.draw_markers(observations.get_by_filename(current_image.fname))
+    io_worker.submit(refreshing.refresh, on_done=refreshed)
+
+
+def report_error(e):
+    """show an error from the background I/O thread"""
+    warn("Error", "Reading or writing annotations failed: {}".format(e))
+
+
+def open_project():
+    """open (or create) a project database which holds annotations for many folders"""
+    global project, observations
+    pathname = filedialog.asksaveasfilename(title="Open or create a project",
+                                            defaultextension=".sqlite",
+                                            filetypes=[("Project database", "*.sqlite")],
+                                            confirmoverwrite=False)
+    if not pathname:
+        info("Information", "You cancelled project selection")
+        return
+    previous = project
+    project = SQLiteStorage(pathname, OBSERVATION_FIELDS)
+    observations = open_observations(folder_selected)
+    if previous is not None:
+        # after the observations using it are closed
+        io_worker.submit(previous.close)
+    info("Project", "Project {} has {} observations in {} folders".format(
+        pathname, project.count(), len(project.folders())))
+
+
+def export_observations():
+    """export the current folder's observations (Parquet, Arrow, NPZ or COCO JSON)"""
+    pathname = filedialog.asksaveasfilename(title="Export observations",
+                                            defaultextension=".parquet",
+                                            filetypes=[("Parquet", "*.parquet"),
+                                                       ("Arrow", "*.arrow"),
+                                                       ("NumPy", "*.npz"),
+                                                       ("COCO JSON", "*.json")])
+    if not pathname:
+        return
+    try:
+        pathname, rows = observations.export(pathname)
+    except ValueError as e:
+        error("Export", str(e))
+        return
+    info("Export", "Wrote {} observations to {}".format(rows, pathname))
+
+
+# groupings offered in the summary window
+SUMMARY_GROUPINGS = {
+    "Species": ("species",),
+    "Species by camera": ("species", "camera"),
+    "Species by date": ("species", "date"),
+    "Species by hour": ("species", "hour"),
+    "Camera by date": ("camera", "date"),
+}
+
+
+def show_summary():
+    """show detection counts of the current folder (or project) in a window"""
+    summary = observations.summarize()
+    window = Window(app, title="Summary", width=640, height=480)
+    grouping = Combo(window, options=list(SUMMARY_GROUPINGS), align="top")
+    table = TextBox(window, multiline=True, width="fill", height="fill", scrollbar=True)
+    table.font = "Courier"
+
+    def show_table():
+        table.value = summary.format_table(SUMMARY_GROUPINGS[grouping.value])
+
+    grouping.update_command(show_table)
+    show_table()
+
+
 def file_function():
     """file function stub"""
-    if DEBUG: print("File function selected.")
     messagebox.showinfo("File Function", "File function selected!")
 
 
-def attempt_remove_mark(x,y):
-    """attempt to remove a mark at x,y if it exists
-    return True if an image was found
-    return False if nothing was nearby
+def edit_mark(observation):
+    """ask whether to keep, change the species of or delete a mark (the observations are not locked)
+    nothing happens if the mark is gone by then (e.g. removed by another annotator)
     """
-    global canvas, observations, current_image
-    found_index = observations.find_by_filename_location(current_image.fname, x, y)
-    if found_index >= 0:
-        # found the observation!
-        current_observation = observations.items[found_index]
-        species = askstring("Observation",
-                            "Click OK to KEEP marker/species, CANCEL to delete",
-                            initialvalue=current_observation.species)
-        if (species is None) or (species == ''):
-            # user wants to DELETE the observation
-            observations.remove_at_index(found_index)
-            current_image.show(canvas)
-            observations.show_markers_by_filename(canvas, current_image.fname)
-        return True
-    else:
-        return False
+    species = askstring("Observation",
+                        "Click OK to KEEP marker/species (or change the species), CANCEL to delete",
+                        initialvalue=observation.species)
+    if (species is None) or not species.strip():
+        # user wants to DELETE the observation
+        if observations.remove(observation):
+            layer.remove_marker(observation)
+            marks_changed(observation.image.fname)
+    elif species.strip() != observation.species:
+        observations.edit(observation, species=species.strip())
+        save_if_due()
     
     
 def canvas_right_click(event_data):
@@ -102,41 +622,60 @@ def canvas_right_click(event_data):
 action - the canvas right-click event will reset NEAREST
 observation mark
 """
-    # click data
-    x = event_data._tk_event.x
-    y = event_data._tk_event.y
-    attempt_remove_mark(x,y)   
+    input_queue.put('right click', current_image, event_data._tk_event.x, event_data._tk_event.y)   
     
 def canvas_left_click(event_data):
     """canvas_left_click event handler
     action - the left click imposes a red line in the canvas which should
     scale up to the actual resolution.
+    (queued with the image it was made on, see handle_input)
     """
-    global canvas, observations
-    size = 10
-    x = event_data._tk_event.x
-    y = event_data._tk_event.y
-
-    # attempt to remove the mark is NEAR to an existing mark
-    if attempt_remove_mark(x,y):
-        # just exit if this returns True
-        return None
+    input_queue.put('click', current_image, event_data._tk_event.x, event_data._tk_event.y)
+
 
+def mark_with_dialog(image, x, y):
+    """ask for the species of a new mark at x,y (the observations are not locked)"""
     # make a temporary mark
-    mark_id = canvas.oval(x-size,y,x+size,y+size,color="red")
-    canvas.show()
+    mark_id = layer.add_pending(x, y)
     
-    # ask user what species they saw
-    species = askstring("Species", "Species name")
+    # ask user what species they saw (hotkeys and completion from the vocabulary)
+    species = SpeciesDialog(app.tk, vocabulary).result
+    layer.remove_item(mark_id)
     
     if (species is None) or (species == ''):
         # they hit cancel or blank species
-        canvas.delete(mark_id)
+        return None
+    add_mark(image, x, y, species)
+
+
+def add_mark(image, x, y, species):
+    """record a mark at display x,y of image, in the image's own pixels"""
+    transform = image.display_transform()
+    if transform.known:
+        native_x, native_y = transform.to_native(x, y)
+        observation = Observation(image, species, native_x, native_y, space=NATIVE)
     else:
-        # record as an observation!
-        observation = Observation(current_image, species, x, y)
-        observations.append(observation)
+        # size unknown (no EXIF), the mark stays in (and is saved as) display pixels
+        observation = Observation(image, species, x, y)
+    observation = observations.append(observation)
+    if image is current_image:
+        layer.add_marker(observation)
+    marks_changed(image.fname)
+    if vocabulary.dirty:
+        # a new species
+        io_worker.submit(vocabulary.save, vocabulary_pathname(folder_selected))
+
+
+def remove_nearest_mark(image, x, y):
+    """remove the mark near display x,y of image without asking (rapid marking)"""
+    observation = observations.find_by_display_location(image.fname, x, y)
+    if observation is not None:
+        observations.remove(observation)
+        layer.remove_marker(observation)
+        marks_changed(image.fname)
+
     
+@timed('show_file')
 def show_file(file_pointer):
     """show_file(file_pointer) shows a file in the global file list"""
     global canvas, current_image
@@ -155,10 +694,24 @@ def show_file(file_pointer):
     pathname = os.path.join(folder_selected, fname)
     try:
         # try to show a picture and associated observations
-        if DEBUG:
-            print("displaying {}".format(pathname))
-        
-        current_image = observations.show_image_observations_by_filename(canvas, fname)
+        # (never waiting for the I/O thread, it only holds the lock for a moment)
+        if observations.ready and observations.lock.acquire(blocking=False):
+            try:
+                current_image = layer.show(observations, fname, display_cache)
+            finally:
+                observations.lock.release()
+        else:
+            # annotations are still loading (markers follow in observations_loaded)
+            # or busy for a moment (markers follow in draw_markers_later)
+            current_image = image_registry.get(fname, folder_selected)
+            layer.show_image(current_image, display_cache)
+            layer.clear_markers()
+            if observations.ready:
+                draw_markers_later(current_image)
+        # get the neighbours ready for the next arrow press
+        prefetcher.prefetch(file_pathnames, file_pointer)
+        overlay.draw()
+        update_title()
         
     except Exception as e:
         # in case of an error, flag it and show user
@@ -168,42 +721,116 @@ def show_file(file_pointer):
     # return the file_pointer
     return file_pointer
 
-def get_image_filenames(imagepath):
-    """get_image_filenames(imagepath) - return a list of image filenames"""
-    image_files = []
-    valid_extensions = ['jpg','jpeg','png']
-    for fn in os.listdir(imagepath):
-        if fn[0]=='.':
-            # skip Mac thumbs
-            continue
-        parts = fn.split('.')
-        for ext in valid_extensions:
-            if parts[-1].lower() == ext:
-                image_files.append(fn)
-    return image_files
-    
+def draw_markers_later(image):
+    """draw_markers_later(image) draws the markers of image once the observations lock is free
+    (nothing is drawn if another picture is on screen by then)
+    """
+    if image is not current_image:
+        return
+    if not observations.lock.acquire(blocking=False):
+        app.after(MARKERS_RETRY, lambda: draw_markers_later(image))
+        return
+    try:
+        layer.draw_markers(observations.get_by_filename(image.fname))
+    finally:
+        observations.lock.release()
+    overlay.draw()
+
+
 def mark_function():
     """initates marking operation"""
-    global files
+    global files, file_pathnames
     global filename
     global file_pointer
     global observations
-    if DEBUG: print("Mark Images")
+    global triage, sequences
     try: 
-        # get files from current directory
+        # get files from current directory by name, datetime_ordered puts them in the
+        # order they were taken once the I/O thread has read their EXIF
         files = get_image_filenames(folder_selected)
+        file_pathnames = [os.path.join(folder_selected, fn) for fn in files]
+        sequences = None
+        # reviewed/empty flags, marked flags follow when the observations are loaded
+        save_triage()
+        triage = Triage.load(folder_selected, files)
+        # display from the preview store, and fill it in the background
+        previews = PreviewStore(folder_selected)
+        display_cache.clear()
+        display_cache.loader = previews.load_display
+        previews.build_in_background(files)
                 
         if len(files) == 0:
             warn("Error", "This folder contains no image files.\nPick another folder.")
         else:
             file_pointer = 0
             # get observations!
-            observations = Observations(annotations_filename, folder_selected)
+            observations = open_observations(folder_selected)
             show_file(file_pointer)
+            io_worker.submit(datetime_order, folder_selected, sequence_gap, on_done=datetime_ordered)
             
     except Exception as e:
         warn("Exception thrown", "Invalid folder.  Please select valid folder.")
 
+
+def datetime_order(folder, gap):
+    """list folder in the order its pictures were taken (undated ones last) and group the
+    bursts, on the I/O thread since new pictures have their EXIF parsed
+    """
+    names = datetime_scanner.scan(folder)
+    return folder, names, gap, Sequences.for_folder(folder, names, gap=gap)
+
+
+def datetime_ordered(result):
+    """show the files in the order they were taken, the picture on screen stays on screen"""
+    global files, file_pathnames, file_pointer, triage, sequences
+    folder, names, gap, bursts = result
+    if folder != folder_selected or set(names) != set(files):
+        # another folder was picked meanwhile (or pictures arrived, the next Mark Images has them)
+        return
+    if names != files:
+        fname = files[file_pointer] if 0 <= file_pointer < len(files) else None
+        files = names
+        file_pathnames = [os.path.join(folder_selected, fn) for fn in files]
+        if triage is not None:
+            triage = triage.reorder(files)
+        if fname is not None:
+            file_pointer = files.index(fname)
+    if gap != sequence_gap:
+        # the gap was changed meanwhile, the EXIF is cached by now
+        bursts = Sequences.for_folder(folder_selected, files, gap=sequence_gap)
+    sequences = bursts
+    update_title()
+
+def close_app():
+    """compact the annotation journal into annotations.csv before exit"""
+    try:
+        # finish queued saves and loads first
+        io_worker.shutdown()
+        observations.close()
+        if triage is not None and triage.dirty:
+            triage.save()
+        if project is not None:
+            project.close()
+        prefetcher.shutdown()
+        if recorder.enabled and recorder.recorded:
+            # keep the session's timings for later collection
+            recorder.dump()
+    finally:
+        app.destroy()
+
+def toggle_overlay():
+    """show or hide the p50/p95 timing overlay (F12), showing it starts recording"""
+    overlay.toggle()
+
+
+def save_trace():
+    """write the recorded timings to a trace file"""
+    if not recorder.recorded:
+        info("Trace", "Nothing recorded yet, turn on the timing overlay (F12) first")
+        return
+    info("Trace", "Saved trace to {}".format(recorder.dump()))
+
+
 def show_help():
     msg = """1. To select a Directory choose File->Pick Directory menu.
 
@@ -215,34 +842,78 @@ LEFT KEYBOARD ARROW moves back one picture in the directory.
 
 LEFT MOUSE CLICK allows marking the species location.
 LEFT MOUSE CLICK on existing mark allows you to EDIT the mark.
+
+RAPID MARKING (for herds): a species number key (1, 2, ...) makes that species current,
+then every LEFT MOUSE CLICK marks it straight away and RIGHT MOUSE CLICK removes the nearest mark.
+R turns rapid marking on and off, ESC stops it.
+
+CTRL+Z undoes the last mark, removal or species change, CTRL+Y redoes it.
+
+TRIAGE: pictures you move away from are flagged reviewed (empty if they have no marks).
+N shows the next unreviewed picture, M the next picture with marks.
+SPACE starts or stops a slideshow of the unreviewed pictures (+ and - change its speed),
+clicking stops it so you can mark the picture.
+
+BURSTS: pictures are shown in the order they were taken, grouped into bursts (one trigger of the camera).
+PAGE DOWN or ] flags the burst reviewed and shows the next one, PAGE UP or [ the previous one.
+C copies the marks of the picture onto the other frames of its burst (CTRL+Z undoes the copy).
+
+F12 shows or hides the timing overlay.
 """
     info("Welcome", msg)
 
-# declare our main app    
-app = App(
-    title="Madeleine Ward Marker Prototype",
-    width=IMAGE_WIDTH,
-    height=IMAGE_HEIGHT,
-)
-
-# CANVAS contains an image with lines that indicate species present
-canvas = Drawing(app, width=IMAGE_WIDTH, height=IMAGE_HEIGHT)
-
-# hook the events to the canvas object
-canvas.when_left_button_pressed = canvas_left_click
-canvas.when_right_button_pressed = canvas_right_click
-
-# define the menu bar
-menubar = MenuBar(app,
-                  toplevel=["File", "Mark Images","Help"],
-                  options=[
-                      [ ["Pick Directory", pick_directory] ],
-                      [ ["Mark Images", mark_function]],
-                      [ ["Help", show_help]]
-                  ])
-
-# hook the arrow keys (for now, might want to change this to local hook if permitted)
-app.when_key_pressed = keypress_hook
-show_help()
-
-app.display()
+if __name__ == '__main__':
+    # declare our main app
+    app = App(
+        title=APP_TITLE,
+        width=IMAGE_WIDTH,
+        height=IMAGE_HEIGHT,
+    )
+
+    # CANVAS contains an image with lines that indicate species present
+    canvas = Drawing(app, width=IMAGE_WIDTH, height=IMAGE_HEIGHT)
+
+    # hook the events to the canvas object
+    canvas.when_left_button_pressed = canvas_left_click
+    canvas.when_right_button_pressed = canvas_right_click
+    # the image with its markers, markers are updated one at a time
+    layer = MarkerLayer(canvas)
+    # live latencies, refreshed every second while shown
+    overlay = LatencyOverlay(canvas)
+    app.repeat(1000, overlay.draw)
+    # run callbacks of finished background loads and saves
+    io_worker.on_error = report_error
+    app.repeat(50, io_worker.poll)
+    # arrow keys only sync the journal, fold it into annotations.csv every few minutes
+    app.repeat(CHECKPOINT_INTERVAL, checkpoint)
+    # other annotators' marks in a shared folder
+    app.repeat(REFRESH_INTERVAL, refresh_shared)
+
+    # define the menu bar
+    menubar = MenuBar(app,
+                      toplevel=["File", "Mark Images","Help"],
+                      options=[
+                          [ ["Pick Directory", pick_directory], ["Open Project", open_project],
+                            ["Mark Together", mark_together], ["Export", export_observations] ],
+                          [ ["Mark Images", mark_function], ["Rapid Marking", toggle_rapid],
+                            ["Slideshow", lambda: input_queue.put('key', 'space', '')],
+                            ["Next Unreviewed", lambda: input_queue.put('key', 'n', '')],
+                            ["Next With Marks", lambda: input_queue.put('key', 'm', '')],
+                            ["Next Burst", lambda: input_queue.put('key', 'bracketright', '')],
+                            ["Previous Burst", lambda: input_queue.put('key', 'bracketleft', '')],
+                            ["Copy Marks to Burst", lambda: input_queue.put('key', 'c', '')],
+                            ["Burst Gap", set_sequence_gap],
+                            ["Undo", lambda: input_queue.put('key', UNDO_KEY, '')],
+                            ["Redo", lambda: input_queue.put('key', REDO_KEY, '')] ],
+                          [ ["Help", show_help], ["Summary", show_summary],
+                            ["Timing Overlay", toggle_overlay], ["Save Trace", save_trace] ]
+                      ])
+
+    # clicks and keys wait here until they can be handled, in order
+    input_queue = EventQueue(handle_input, app.after)
+    # hook the arrow keys (for now, might want to change this to local hook if permitted)
+    app.when_key_pressed = keypress_hook
+    app.when_closed = close_app
+    show_help()
+
+    app.display()
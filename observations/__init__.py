@@ -1,16 +1,38 @@
+import functools
 import math
 import os
-import exifread
+import threading
 
 # special pure-Python CSV wrapper written by jeff for
 # annotation quasi-data structure
-import csvdata
+from . import csvdata
+from .exifcache import ExifCache, read_exif, file_signature
+from .spatial import GridIndex, native_cell_size
+from .ids import new_id, legacy_id
+from .storage import CSVStorage, SQLiteStorage, ObservationRow
+from .journal import APPEND, finish_sync
+from .history import History, Add, Remove, Edit, Batch
+from .columnar import ObservationStore, RowList, RowPositions
+from .instrument import timed, recorder
+from .transform import (DisplayTransform, rows_to_native, STRETCH, LETTERBOX,
+                        LEGACY_FIT, DISPLAY, NATIVE)
 
 IMAGE_WIDTH = 1024
 IMAGE_HEIGHT = 768
+# marker ovals are 2*MARKER_SIZE wide and MARKER_SIZE high, below the click point
+MARKER_SIZE = 10
+MARKER_COLOR = "red"
+# how images are fitted to the canvas, STRETCH or LETTERBOX (keeps the aspect ratio)
+DISPLAY_FIT = STRETCH
+
+# columns of a serialized observation (CSV and journal layout)
+# space is DISPLAY (canvas pixels, older annotations) or NATIVE (image pixels)
+# id is the stable observation ID (see ids.py)
+OBSERVATION_FIELDS = ['species', 'x', 'y', 'fname', 'path', 'pathname',
+                      'datetime', 'width', 'height', 'camera', 'space', 'id']
 
 class Image:
-    def __init__(self, fname, path):
+    def __init__(self, fname, path, metadata=None):
         self.fname = fname
         self.path = path
         self.pathname = os.path.join(path, fname)
@@ -18,34 +40,123 @@ class Image:
         self.width = -1
         self.height = -1
         self.camera = ''
-        self.getEXIF()
+        if metadata is None:
+            self.getEXIF()
+        else:
+            self.set_metadata(metadata)
     
     def getEXIF(self):
         # EXIF reading
-        f = open(self.pathname, 'rb') 
-        tags = exifread.process_file(f)
-        self.datetime = tags.get('EXIF DateTimeOriginal')
-        self.width = int(str(tags.get('EXIF ExifImageWidth','0')))
-        self.height = int(str(tags.get('EXIF ExifImageLength','0')))
+        self.set_metadata(read_exif(self.pathname))
+
+    def set_metadata(self, metadata):
+        """set_metadata(self, metadata) - apply a metadata dictionary (see exifcache)"""
+        self.datetime = metadata['datetime']
+        self.width = metadata['width']
+        self.height = metadata['height']
         # fix this for Madeleine's camera IDs
-        usercomment = str(tags.get('EXIF UserComment'))
-        parts = usercomment.split(',')
-        if '\\' in self.path:
-            # for PCs
-            camera_id = self.path.split('\\')[-1]
-        else:
-            # for Linux and Mac
-            camera_id = self.path.split('/')[-1]
-        for part in parts:
-            if 'ID=' in part:
-                camera_id=part.replace('ID=','').strip()
+        camera_id = metadata['camera_id']
+        if not camera_id:
+            if '\\' in self.path:
+                # for PCs
+                camera_id = self.path.split('\\')[-1]
+            else:
+                # for Linux and Mac
+                camera_id = self.path.split('/')[-1]
         self.camera = camera_id
+
+    def display_transform(self, fit=None):
+        """display_transform(self, fit=None) - DisplayTransform between the canvas and
+        this image's native (EXIF) resolution, fit defaults to DISPLAY_FIT
+        """
+        if fit is None:
+            fit = DISPLAY_FIT
+        return DisplayTransform(self.width, self.height, IMAGE_WIDTH, IMAGE_HEIGHT, fit)
         
-    def show(self, canvas):
+    @timed('image.show')
+    def show(self, canvas, display_cache=None):
+        """show(self, canvas, display_cache=None) - clear the canvas and draw the image on it
+        a display_cache (prefetch.DisplayCache) supplies an already decoded and
+        downscaled image, otherwise the canvas loads it from the pathname
+        """
         canvas.clear()
-        canvas.image(0, 0, self.pathname, width=IMAGE_WIDTH, height=IMAGE_HEIGHT)
+        self.draw(canvas, display_cache)
         canvas.show()
+
+    def draw(self, canvas, display_cache=None):
+        """draw(self, canvas, display_cache=None) - add the image to the canvas without clearing it
+        returns the canvas item ids, bottom first (see render.MarkerLayer)
+        """
+        source = None
+        if display_cache is not None:
+            source = display_cache.get(self.pathname)
+        if source is not None:
+            # already fitted to the canvas
+            return [canvas.image(0, 0, source, width=IMAGE_WIDTH, height=IMAGE_HEIGHT)]
+        items = []
+        left, top, width, height = self.display_transform().box()
+        if (width, height) != (IMAGE_WIDTH, IMAGE_HEIGHT):
+            items.append(canvas.rectangle(0, 0, IMAGE_WIDTH, IMAGE_HEIGHT, color="black"))
+        items.append(canvas.image(left, top, self.pathname, width=width, height=height))
+        return items
         
+class ImageRegistry:
+    """ImageRegistry shares one Image object per image file
+
+    Images are keyed by (path, fname, mtime, size) so every observation on the
+    same file points at the same Image, and EXIF is parsed at most once per file.
+    EXIF metadata is persisted per folder (see exifcache.ExifCache) so reopening
+    a folder skips parsing files that haven't changed.
+    """
+    def __init__(self):
+        self.images = {}
+        self.caches = {}
+        # the registry is shared with the background I/O thread (see background.py)
+        self.lock = threading.RLock()
+
+    def cache_for(self, path):
+        """cache_for(self, path) - return the ExifCache for a folder"""
+        with self.lock:
+            cache = self.caches.get(path)
+            if cache is None:
+                cache = ExifCache(path)
+                self.caches[path] = cache
+            return cache
+
+    def get(self, fname, path):
+        """get(self, fname, path) - return the shared Image for path/fname"""
+        signature = file_signature(os.path.join(path, fname))
+        key = (path, fname) + signature
+        image = self.images.get(key)
+        if image is None:
+            with self.lock:
+                image = self.images.get(key)
+                if image is None:
+                    signature, metadata = self.cache_for(path).lookup(fname, signature)
+                    image = Image(fname, path, metadata)
+                    self.images[key] = image
+        return image
+
+    def save(self, path=None):
+        """save(self, path=None) - persist EXIF sidecar(s), all folders if path is None"""
+        with self.lock:
+            if path is None:
+                caches = list(self.caches.values())
+            else:
+                caches = [self.caches[path]] if path in self.caches else []
+            for cache in caches:
+                cache.save()
+
+    def clear(self):
+        """clear(self) - forget all shared Images (sidecar data is kept on disk)"""
+        with self.lock:
+            self.images.clear()
+            self.caches.clear()
+
+# module-wide registry, shared by all Observations
+image_registry = ImageRegistry()
+
+
 class Observation:
     """Observation is a class object that represents a single observation
     The __init__ method allows instatiation from image, species, x, y
@@ -53,15 +164,19 @@ class Observation:
     
     This method allows maximum flexibility to redefine the Observation Object below
     """
-    def __init__(self, image=None, species=None, x=None, y=None, serial=None):
-        """__init__(self, image=<Image obj>, species=<string>, x=<numeric>, y=<numeric>"""
+    def __init__(self, image=None, species=None, x=None, y=None, serial=None, space=DISPLAY):
+        """__init__(self, image=<Image obj>, species=<string>, x=<numeric>, y=<numeric>, space=DISPLAY|NATIVE"""
         if serial:
             # initialize from a serial object
-            self.image = Image(serial['fname'], serial['path'])
+            self.image = image_registry.get(serial['fname'], serial['path'])
             self.species = serial['species']
             # coerce to int
             self.x = int(serial['x'])
             self.y = int(serial['y'])
+            # rows from before coordinate spaces have no space, they are display coordinates
+            self.space = serial.get('space') or DISPLAY
+            # rows from before IDs get one made from their contents
+            self.id = serial.get('id') or legacy_id(serial['fname'], self.species, self.x, self.y)
         else:
             # initialize from parameters
             if (image is None) or (species is None) or (x is None) or (y is None):
@@ -75,6 +190,8 @@ class Observation:
             # corece to int
             self.x = int(x)
             self.y = int(y)
+            self.space = space
+            self.id = new_id()
         
     def serialize(self):
         """serialize Observation"""
@@ -88,16 +205,136 @@ class Observation:
     def distance(self, x, y):
         """distance(self, x, y) - returns distance of current observation to (x,y)"""
         return math.sqrt((self.x-x)**2 + (self.y-y)**2)
+
+    def to_native(self):
+        """to_native(self) - convert display coordinates to native ones (in place)
+        returns True if the observation was converted
+        """
+        if self.space == NATIVE:
+            return False
+        transform = self.image.display_transform(LEGACY_FIT)
+        if not transform.known:
+            # size unknown, leave as display coordinates
+            return False
+        self.x, self.y = transform.to_native(self.x, self.y)
+        self.space = NATIVE
+        return True
+
+    def display_xy(self, fit=None):
+        """display_xy(self, fit=None) - (x, y) of the observation on the canvas"""
+        if self.space == NATIVE:
+            return self.image.display_transform(fit).to_display(self.x, self.y)
+        if fit is None:
+            fit = DISPLAY_FIT
+        if fit == LEGACY_FIT:
+            return self.x, self.y
+        # display coordinates of the old (stretched) display, go through native
+        x, y = self.image.display_transform(LEGACY_FIT).to_native(self.x, self.y)
+        return self.image.display_transform(fit).to_display(x, y)
         
+    def draw_marker(self, canvas):
+        """draw_marker(self, canvas) - add the marker to the canvas, returns its item id"""
+        size = MARKER_SIZE
+        x, y = self.display_xy()
+        return canvas.oval(x-size,y,
+                           x+size,y+size,
+                           color=MARKER_COLOR)
+
     def show_marker(self, canvas):
         """show_marker(self, canvas) the current marker on the specified canvas"""
-        size = 10
-        mark_id = canvas.oval(self.x-size,self.y,
-                              self.x+size,self.y+size,
-                              color="red")
+        self.draw_marker(canvas)
         canvas.show()
-        
-        
+
+
+class ObservationProxy:
+    """ObservationProxy is a light Observation stand-in for one row of an ObservationStore
+
+    it has no __dict__ and holds no strings of its own, values live in the
+    store columns.  It behaves like an Observation (image, species, x, y,
+    serialize, distance, show_marker).
+    """
+    __slots__ = ('store', 'row')
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+
+    def __eq__(self, other):
+        return (isinstance(other, ObservationProxy)
+                and other.store is self.store and other.row == self.row)
+
+    def __hash__(self):
+        return hash((id(self.store), self.row))
+
+    @property
+    def image(self):
+        """the shared Image, made (from the registry) the first time it is needed"""
+        store = self.store
+        image_row = store.image[self.row]
+        image = store.image_objects[image_row]
+        if image is None:
+            image = image_registry.get(store.fname(self.row), store.path(self.row))
+            store.image_objects[image_row] = image
+        return image
+
+    @property
+    def species(self):
+        return self.store.species_table[self.store.species[self.row]]
+
+    @species.setter
+    def species(self, value):
+        self.store.species[self.row] = self.store.species_table.code(value)
+
+    @property
+    def space(self):
+        return NATIVE if self.store.space[self.row] else DISPLAY
+
+    @space.setter
+    def space(self, value):
+        self.store.space[self.row] = 1 if value == NATIVE else 0
+
+    @property
+    def id(self):
+        return self.store.observation_id(self.row)
+
+    @property
+    def x(self):
+        return self.store.x[self.row]
+
+    @x.setter
+    def x(self, value):
+        self.store.x[self.row] = int(value)
+
+    @property
+    def y(self):
+        return self.store.y[self.row]
+
+    @y.setter
+    def y(self, value):
+        self.store.y[self.row] = int(value)
+
+    def serialize(self):
+        """serialize ObservationProxy (same layout as Observation.serialize)"""
+        return self.store.serialize(self.row)
+
+    distance = Observation.distance
+    to_native = Observation.to_native
+    display_xy = Observation.display_xy
+    draw_marker = Observation.draw_marker
+    show_marker = Observation.show_marker
+
+
+def locked(method):
+    """locked(method) - decorator, run an Observations method holding its lock
+    (the background I/O thread loads and saves the same Observations)
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class Observations:
     """Observations is a class to encapsulate a list of Observation datapoints for
     a folder
@@ -105,37 +342,319 @@ class Observations:
     it is expected that...
     filename = "annotations.csv" (default?)
     path = selected folder where images reside
+
+    journal=True turns on write-ahead journal mode: append/remove are written
+    to "annotations.csv.journal" as they happen, save() only syncs the journal
+    and the annotations file is rewritten by compact() (e.g. on exit).
+
+    storage can replace the CSV layout with another backend (see storage.py),
+    e.g. a project-wide SQLiteStorage shared by many folders.
+
+    lazy=True reads nothing up front: the first lookup streams compact rows
+    (storage.ObservationRow, no Image/EXIF) grouped by filename, and Observation
+    objects are only made for the images that are actually looked at.
+    In lazy mode self.items only holds the observations materialized so far.
+
+    columnar=True keeps loaded observations in an ObservationStore (typed
+    columns and string code tables) and hands out ObservationProxy objects,
+    which takes much less memory for large annotation sets.
+
+    annotator="name" shares the folder with other annotators (see shared.py):
+    changes go to the annotator's own log, the other annotators' changes are
+    merged by observation ID on load and picked up by refresh().
+
+    vocabulary (a vocabulary.Vocabulary) makes species canonical: aliases and
+    other spellings are stored under the species' name, and in columnar mode
+    observations keep the species ID.
     """
-    def __init__(self, filename, path):
-        """__init__(self, filename, path) initializes observations object and loads if it can"""
+    def __init__(self, filename, path, journal=False, storage=None, lazy=False, columnar=False,
+                 annotator=None, vocabulary=None):
+        """__init__(self, filename, path, journal=False, storage=None, lazy=False, columnar=False, annotator=None, vocabulary=None) initializes observations object and loads if it can"""
         self.filename = filename
         self.path = path
         self.pathname = os.path.join(path, filename)
-        self.items = []
-        self.load(self.pathname)
+        self.vocabulary = vocabulary
+        self.store = ObservationStore(ObservationProxy, vocabulary) if columnar else None
+        self.items = self.new_list()
+        # index of each observation in self.items (see index_of)
+        self.positions = self.new_positions()
+        # index of observations by image filename (fname -> list of observations)
+        self.by_filename = {}
+        # spatial index for hit-testing (fname -> GridIndex), built on first use per image
+        self.grids = {}
+        # dirty is True when there are changes which are not saved
+        self.dirty = False
+        # held while observations change or load (see locked)
+        self.lock = threading.RLock()
+        # held while storage is written (save, compact, refresh, close), always taken before
+        # self.lock, which is only held to take a snapshot so lookups don't wait for the disk
+        self.save_lock = threading.RLock()
+        # detection counts (summary.Summary), made by summarize()
+        self.summary = None
+        # undo/redo of append, remove and edit (history.History)
+        self.history = History()
+        # a storage passed in (e.g. a project database) is shared, don't close it
+        self.owns_storage = storage is None
+        self.annotator = annotator
+        if storage is None:
+            if annotator is not None:
+                from .shared import SharedStorage
+                storage = SharedStorage(self.pathname, OBSERVATION_FIELDS, annotator)
+            else:
+                storage = CSVStorage(self.pathname, OBSERVATION_FIELDS, journal=journal)
+        self.storage = storage
+        self.lazy = lazy
+        # lazy mode: rows not made into Observations yet (fname -> list of ObservationRow)
+        # None until the storage has been read
+        self.unloaded = None
+        if not lazy:
+            self.load()
         if self.items is None:
             self.items = []
-        
+
+    def new_list(self):
+        """new_list(self) - an empty observation list (a RowList in columnar mode)"""
+        if self.store is not None:
+            return RowList(self.store)
+        return []
+
+    def new_positions(self):
+        """new_positions(self) - an empty observation -> index map (a RowPositions in columnar mode)"""
+        if self.store is not None:
+            return RowPositions(self.store)
+        return {}
+
+    @locked
     def append(self, observation):
-        """append(self, observation) - appends a new observation onto observation list"""
+        """append(self, observation) - appends a new observation onto observation list
+        returns the observation as stored (in columnar mode that is a new ObservationProxy)
+        """
+        if self.vocabulary is not None and observation.species:
+            observation.species = self.vocabulary.canonical(observation.species)
+        # lazy mode, read the stored rows first so the new one is not counted twice
+        self.materialize(observation.image.fname)
+        if self.store is not None and not (isinstance(observation, ObservationProxy)
+                                           and observation.store is self.store):
+            observation = self.make_observation(observation.serialize())
+        # new marks are always stored in native image pixels
+        observation.to_native()
+        self._insert(observation)
+        serial = observation.serialize()
+        self.added(serial)
+        self.history.record(Add(serial))
+        return observation
+
+    def added(self, serial):
+        """added(self, serial) - an observation was inserted, record it in storage and the summary"""
+        self.dirty = True
+        if self.storage.incremental:
+            self.storage.append(serial)
+        if self.summary is not None:
+            self.summary.add_serial(serial)
+
+    def removed(self, serial):
+        """removed(self, serial) - an observation was deleted, record it in storage and the summary"""
+        self.dirty = True
+        if self.storage.incremental:
+            self.storage.remove(serial)
+        if self.summary is not None:
+            self.summary.remove_serial(serial)
+
+    def _insert(self, observation):
+        """_insert(self, observation) - add observation to the list and indices"""
+        self.positions[observation] = len(self.items)
         self.items.append(observation)
+        fname = observation.image.fname
+        same_file = self.by_filename.get(fname)
+        if same_file is None:
+            same_file = self.new_list()
+            self.by_filename[fname] = same_file
+        same_file.append(observation)
+        grid = self.grids.get(fname)
+        if grid is not None:
+            grid.insert(observation)
+        
+    @locked
+    def remove(self, observation):
+        """remove(self, observation) - purges an observation (found by identity)"""
+        try:
+            index = self.index_of(observation)
+        except ValueError:
+            return False
+        self.remove_at_index(index)
+        return True
         
+    @locked
     def remove_at_index(self, index):
         """remove_at_index(self, index) - purges an observation
         BE CAREFUL - since once the item at the index is removed any "remembered"
-        indices might be wrong!!
+        indices might be wrong!! (prefer remove(observation))
         """
-        del self.items[index]
-        
+        observation = self._delete(index)
+        serial = observation.serialize()
+        self.removed(serial)
+        self.history.record(Remove(serial))
+
+    def index_of(self, observation):
+        """index_of(self, observation) - index of observation in self.items (ValueError if it isn't there)
+        O(1), every observation's index is kept in self.positions
+        """
+        index = self.positions.get(observation)
+        if index is None:
+            raise ValueError("observation is not in the list")
+        return index
+
+    @locked
+    def edit(self, observation, **changes):
+        """edit(self, observation, species=..., x=..., y=...) - change an observation (undoable)
+        x and y are in the observation's own space, returns the observation
+        (None, and nothing to undo, if it is gone e.g. removed by another annotator)
+        """
+        before = observation.serialize()
+        observation = self.change_id(before['id'], observation.image.fname, changes)
+        if observation is None:
+            return None
+        self.history.record(Edit(before, observation.serialize()))
+        return observation
+
+    @locked
+    def copy_marks(self, filename, targets, pixel_tolerance=15):
+        """copy_marks(self, filename, targets, pixel_tolerance=15) - copy the marks of filename onto
+        the images in targets (e.g. the other frames of a burst) as one undoable change.
+        A mark isn't copied where the image already has the same species within
+        pixel_tolerance (display pixels, like a click, converted to each image's
+        native pixels), so copying twice adds nothing. Returns the copies.
+        """
+        sources = self.get_by_filename(filename)
+        commands = []
+        copies = []
+        for target in targets:
+            if target == filename:
+                continue
+            image = self.image_for(target)
+            tolerance = image.display_transform().native_tolerance(pixel_tolerance)
+            for source in sources:
+                observation = Observation(image, source.species, source.x, source.y, space=source.space)
+                observation.to_native()
+                nearest = self.find_by_location(target, observation.x, observation.y, tolerance)
+                if nearest is not None and nearest.species == observation.species:
+                    continue
+                if self.store is not None:
+                    observation = self.make_observation(observation.serialize())
+                self._insert(observation)
+                serial = observation.serialize()
+                self.added(serial)
+                commands.append(Add(serial))
+                copies.append(observation)
+        if commands:
+            self.history.record(Batch(commands))
+        return copies
+
+    @locked
+    def undo(self):
+        """undo(self) - undo the last append, remove or edit
+        returns the command undone (its fnames are the images changed), None if there was nothing to undo
+        """
+        return self.history.undo(self)
+
+    @locked
+    def redo(self):
+        """redo(self) - redo the last undone change, returns its command or None"""
+        return self.history.redo(self)
+
+    @locked
+    def add_serial(self, serial):
+        """add_serial(self, serial) - put back an observation (undo/redo), by its serialized form"""
+        self.materialize(serial['fname'])
+        if self.find_by_id(serial['id'], serial['fname']) is not None:
+            return None
+        observation = self.make_observation(dict(serial))
+        self._insert(observation)
+        self.added(observation.serialize())
+        return observation
+
+    @locked
+    def remove_id(self, observation_id, filename):
+        """remove_id(self, observation_id, filename) - delete an observation by ID (undo/redo)
+        returns the observation, None if it is already gone
+        """
+        observation = self.find_by_id(observation_id, filename)
+        if observation is None:
+            return None
+        self._delete(self.index_of(observation))
+        self.removed(observation.serialize())
+        return observation
+
+    @locked
+    def change_id(self, observation_id, filename, values):
+        """change_id(self, observation_id, filename, values) - set species, x and y of an observation by ID
+        (values is a dictionary e.g. a serialized observation), returns it or None if it is gone
+        """
+        observation = self.find_by_id(observation_id, filename)
+        if observation is None:
+            return None
+        before = observation.serialize()
+        grid = self.grids.get(filename)
+        moved = int(values.get('x', observation.x)) != observation.x or \
+                int(values.get('y', observation.y)) != observation.y
+        if grid is not None and moved:
+            grid.remove(observation)
+        if 'species' in values:
+            species = values['species']
+            if self.vocabulary is not None and species:
+                species = self.vocabulary.canonical(species)
+            observation.species = species
+        if 'x' in values:
+            observation.x = int(values['x'])
+        if 'y' in values:
+            observation.y = int(values['y'])
+        if grid is not None and moved:
+            grid.insert(observation)
+        # the journal has no change record, a change is the old row out and the new one in
+        self.removed(before)
+        self.added(observation.serialize())
+        return observation
+
+    def _delete(self, index):
+        """_delete(self, index) - remove observation at index from the list and indices
+        the last observation is moved into the hole, so nothing has to shift (O(1))
+        """
+        observation = self.items[index]
+        last = self.items.pop()
+        self.positions.pop(observation, None)
+        if index < len(self.items):
+            self.items[index] = last
+            self.positions[last] = index
+        same_file = self.by_filename.get(observation.image.fname, [])
+        for position, item in enumerate(same_file):
+            if item == observation:
+                del same_file[position]
+                break
+        if not same_file:
+            self.by_filename.pop(observation.image.fname, None)
+        grid = self.grids.get(observation.image.fname)
+        if grid is not None:
+            grid.remove(observation)
+            if not grid:
+                del self.grids[observation.image.fname]
+        return observation
+
+    @locked
     def load(self, pathname=None):
-        """load(self, pathname=None) - loads observation objects from a CSV file
+        """load(self, pathname=None) - loads observation objects from storage
+        or from a CSV file if pathname is given
         Note, pathname is COMPLETE pathname not just a filename in the local directory
         (following convention consistency)
         """
-        if pathname is None:
-            pathname = self.pathname
-            
-        items = csvdata.read_csv(pathname)
+        if pathname is None or pathname == self.pathname:
+            items = self.storage.load(self.path)
+            # changes journaled but not compacted yet are not saved in the annotations file
+            self.dirty = self.dirty or bool(self.storage.pending)
+        else:
+            items = csvdata.read_csv(pathname)
+        # older annotations are in display pixels, convert them all in one batch
+        if rows_to_native(items, IMAGE_WIDTH, IMAGE_HEIGHT, LEGACY_FIT):
+            self.dirty = True
         for item in items:
             # Go through all observations and serialize into self (items)
             # (FIX THIS) a "brittle" way to do this, because the definition of observation
@@ -143,91 +662,440 @@ class Observations:
             #image = Image(item['fname'], item['path'])
             #observation = Observation(image, item['species'], int(item['x']), int(item['y']))
             # make observation from serialized object
-            observation = Observation(serial=item)
-            self.append(observation)
+            observation = self.make_observation(item)
+            self._insert(observation)
+        # remember EXIF for next time this folder is opened
+        image_registry.save()
         return self.items
+
     
+    def make_observation(self, serial):
+        """make_observation(self, serial) - make an Observation (or a proxy in columnar mode)"""
+        if self.vocabulary is not None and serial['species']:
+            serial['species'] = self.vocabulary.canonical(serial['species'])
+        if self.store is not None:
+            return ObservationProxy(self.store, self.store.add(serial))
+        return Observation(serial=serial)
+
+    @property
+    def ready(self):
+        """True once lookups won't have to read storage first (lazy mode reads it on first use)"""
+        return not self.lazy or self.unloaded is not None
+
+    @locked
+    def read_index(self):
+        """read_index(self) - lazy mode, stream compact rows from storage grouped by filename"""
+        if self.unloaded is None:
+            unloaded = {}
+            species = set()
+            for row in self.storage.iter_compact(self.path):
+                unloaded.setdefault(row.fname, []).append(row)
+                species.add(row.species)
+            self.unloaded = unloaded
+            if self.vocabulary is not None:
+                # every species of the folder completes in the species dialog
+                for name in species:
+                    if name:
+                        self.vocabulary.code(name)
+            self.dirty = self.dirty or bool(self.storage.pending)
+        return self.unloaded
+
+    def materialize(self, filename):
+        """materialize(self, filename) - lazy mode, make Observations for the rows of filename"""
+        if not self.lazy:
+            return
+        unloaded = self.unloaded
+        if unloaded is not None and filename not in unloaded:
+            # already made (or no marks), no need to wait for a save to let go of the lock
+            return
+        with self.lock:
+            rows = self.read_index().pop(filename, None)
+            if rows:
+                serials = [row.serialize() for row in rows]
+                if rows_to_native(serials, IMAGE_WIDTH, IMAGE_HEIGHT, LEGACY_FIT):
+                    self.dirty = True
+                for serial in serials:
+                    self._insert(self.make_observation(serial))
+                image_registry.save()
+
+    def materialize_all(self):
+        """materialize_all(self) - lazy mode, make Observations for every row"""
+        if self.lazy:
+            for filename in list(self.read_index()):
+                self.materialize(filename)
+
+    @locked
+    def convert_to_native(self):
+        """convert_to_native(self) - convert display space rows to native pixels in one batch
+        loaded observations are converted as they are loaded, this also does the rows
+        lazy mode has not materialized yet.  Returns the number of rows converted.
+        """
+        if self.lazy:
+            serials = []
+            for rows in self.read_index().values():
+                serials.extend(row.serialize() for row in rows)
+            converted = rows_to_native(serials, IMAGE_WIDTH, IMAGE_HEIGHT, LEGACY_FIT)
+            if converted:
+                unloaded = {}
+                for serial in serials:
+                    unloaded.setdefault(serial['fname'], []).append(ObservationRow.from_serial(serial))
+                self.unloaded = unloaded
+                self.dirty = True
+            return converted
+        return 0
+
+    @locked
+    def summarize(self):
+        """summarize(self) - the Summary (species x camera x date x hour counts) of all observations
+        built on first use, then kept up to date by append and remove_at_index
+        """
+        if self.summary is None:
+            from .summary import Summary
+            self.summary = Summary.from_serials(self.iter_canonical())
+        return self.summary
+
+    def count(self):
+        """count(self) - number of observations, including rows not materialized yet"""
+        if self.lazy:
+            self.read_index()
+        if self.unloaded is None:
+            return len(self.items)
+        return len(self.items) + sum(len(rows) for rows in self.unloaded.values())
+
     def serialize(self):
         """serialize(self) - return serialized version of observations
         this equates to the idea of rows of dictionaries (each observation is a dictionary)
         """
         # serialize into rows of dictionaries
-        serials = []
-        for item in self.items:
-            serial = item.serialize()
-            serials.append(serial)
-        return serials
+        return list(self.iter_canonical())
+
+    @locked
+    def snapshot(self):
+        """snapshot(self) - (observations, rows) as they are now, for iter_serialize to write
+        without holding the lock (rows are the lazy mode rows never looked at)
+        """
+        if self.lazy:
+            # stored rows which were never looked at are included too
+            self.read_index()
+        rows = []
+        if self.unloaded:
+            for same_file in self.unloaded.values():
+                rows.extend(same_file)
+        return self.items.copy(), rows
+
+    def iter_serialize(self, snapshot=None):
+        """iter_serialize(self, snapshot=None) - generator version of serialize (one dictionary at a time)
+        of a snapshot() if one is given, otherwise of one taken now
+        """
+        if snapshot is None:
+            snapshot = self.snapshot()
+        items, rows = snapshot
+        for item in items:
+            yield item.serialize()
+        for row in rows:
+            yield row.serialize()
+
+    def iter_canonical(self, snapshot=None):
+        """iter_canonical(self, snapshot=None) - iter_serialize with canonical species names (see vocabulary)"""
+        vocabulary = self.vocabulary
+        for serial in self.iter_serialize(snapshot):
+            if vocabulary is not None and serial['species']:
+                serial['species'] = vocabulary.canonical(serial['species'])
+            yield serial
+
+    def export(self, pathname, fmt=None):
+        """export(self, pathname, fmt=None) - write the observations to Parquet, Arrow, NPZ
+        or COCO JSON (see observations.export), returns (pathname written, rows)
+        """
+        from . import export
+        return export.export(self.iter_canonical(), pathname, fmt)
         
+    @timed('observations.save')
     def save(self, pathname=None):
         """save(self, pathname=None) - save the serialized data to a CSV file
         a complete pathname can override the objects pathname
+        Saving to our own pathname does nothing when there are no changes,
+        and for incremental storage (journal, database) it only syncs (see compact)
+        returns True if anything was written
+        """
+        if pathname is not None and pathname != self.pathname:
+            csvdata.write_csv(self.serialize(), pathname, fieldnames=OBSERVATION_FIELDS)
+            return True
+        with self.save_lock:
+            with self.lock:
+                if not self.dirty:
+                    return False
+                if self.storage.incremental and self.storage.pending < self.storage.compact_after:
+                    descriptor = self.storage.begin_sync()
+                    self.dirty = False
+                else:
+                    descriptor = False
+            if descriptor is False:
+                return self.compact()
+            try:
+                # the fsync is the slow part, lookups and new marks don't wait for it
+                finish_sync(descriptor)
+            except BaseException:
+                self.dirty = True
+                raise
+        image_registry.save()
+        return True
+
+    def compact(self):
+        """compact(self) - write all observations to storage (rewrites annotations.csv)
+        the lock is only held to take a snapshot, the rows are written without it
+        and changes made meanwhile stay in the journal for the next save
+        """
+        with self.save_lock:
+            if self.annotator is not None:
+                # one annotator at a time, with everybody's latest changes
+                with self.storage.lock:
+                    self.refresh()
+                    self._compact()
+            else:
+                self._compact()
+        image_registry.save()
+        return True
+
+    def _compact(self):
+        """_compact(self) - compact() with save_lock (and the shared folder lock) held"""
+        with self.lock:
+            if not self.storage.rewrites:
+                # a database has every change already, committing is quick
+                self.storage.save(())
+                self.dirty = False
+                return
+            snapshot = self.snapshot()
+            cut = self.storage.cut()
+            self.dirty = False
+        try:
+            self.storage.save(self.iter_canonical(snapshot), cut)
+        except BaseException:
+            self.dirty = True
+            raise
+        with self.lock:
+            self.storage.saved(cut)
+
+    def refresh(self):
+        """refresh(self) - shared folders, apply what other annotators changed since the last look
+        only the new part of their logs is read (without the lock).  Returns the set of
+        filenames whose marks changed, or True if everything was loaded again
+        """
+        if self.annotator is None:
+            return set()
+        with self.save_lock:
+            changes = self.storage.refresh()
+            with self.lock:
+                if changes is None:
+                    # a log was emptied into annotations.csv
+                    self.reload()
+                    return True
+                serials = [serial for op, serial in changes]
+                rows_to_native(serials, IMAGE_WIDTH, IMAGE_HEIGHT, LEGACY_FIT)
+                changed = set()
+                for op, serial in changes:
+                    fname = serial['fname']
+                    self.materialize(fname)
+                    existing = self.find_by_id(serial['id'], fname)
+                    if existing is not None:
+                        self._delete(self.index_of(existing))
+                        if self.summary is not None:
+                            self.summary.remove_serial(existing.serialize())
+                    if op == APPEND:
+                        self._insert(self.make_observation(serial))
+                        if self.summary is not None:
+                            self.summary.add_serial(serial)
+                    changed.add(fname)
+                return changed
+
+    @locked
+    def reload(self):
+        """reload(self) - forget the observations in memory and read storage again"""
+        if self.store is not None:
+            self.store = ObservationStore(ObservationProxy, self.vocabulary)
+        self.items = self.new_list()
+        self.positions = self.new_positions()
+        self.by_filename = {}
+        self.grids = {}
+        self.unloaded = None
+        summarized = self.summary is not None
+        self.summary = None
+        if self.lazy:
+            self.read_index()
+        else:
+            self.load()
+        if summarized:
+            self.summarize()
+
+    def checkpoint(self):
+        """checkpoint(self) - compact if anything is only in the journal (or not saved at all)
+        meant to run now and then in the background, returns True if annotations.csv was rewritten
+        """
+        with self.save_lock:
+            if self.dirty or self.storage.pending:
+                return self.compact()
+        return False
+
+    @property
+    def sync_due(self):
+        """True when enough changes wait to be made durable that a save should run soon
+        (appends never fsync themselves, the save on the I/O thread does)
+        """
+        return self.storage.sync_due
+
+    @property
+    def recovered(self):
+        """what storage did to repair a crashed save when loading (None, 'restored', 'repaired')"""
+        return self.storage.recovered
+
+    def close(self):
+        """close(self) - compact outstanding changes and close storage (e.g. on exit)"""
+        with self.save_lock:
+            if self.dirty or self.storage.pending:
+                self.compact()
+            if self.owns_storage:
+                with self.lock:
+                    self.storage.close()
+        
+    def get_by_filename(self, filename):
+        """get_by_filename(self, filename) - return a list of observations on filename
+        cost is O(marks on this image), if NONE are found, return an empty list
         """
-        if pathname is None:
-            pathname = self.pathname
-        serials = self.serialize()
-        csvdata.write_csv(serials, pathname)
+        self.materialize(filename)
+        return list(self.by_filename.get(filename, []))
         
+    def find_by_location(self, filename, x, y, pixel_tolerance=15):
+        """find_by_location(self, filename, x, y, pixel_tolerance=15)
+        returns NEAREST observation on filename within the pixel (distance) tolerance of x,y
+        If NONE are found, returns None
+        """
+        self.materialize(filename)
+        grid = self.grid_for(filename)
+        if grid is None:
+            return None
+        return grid.nearest(x, y, pixel_tolerance)
+
+    def find_by_display_location(self, filename, x, y, pixel_tolerance=15, fit=None):
+        """find_by_display_location(self, filename, x, y, pixel_tolerance=15, fit=None)
+        like find_by_location for a canvas position x,y (e.g. a mouse click),
+        the position and tolerance are converted to the image's native pixels
+        """
+        self.materialize(filename)
+        same_file = self.by_filename.get(filename)
+        if not same_file:
+            return None
+        transform = same_file[0].image.display_transform(fit)
+        native_x, native_y = transform.to_native(x, y)
+        return self.find_by_location(filename, native_x, native_y,
+                                     transform.native_tolerance(pixel_tolerance))
+        
+    def find_in_rect(self, filename, x0, y0, x1, y1):
+        """find_in_rect(self, filename, x0, y0, x1, y1)
+        returns a list of all observations on filename inside the rectangle (e.g. box selection)
+        """
+        self.materialize(filename)
+        grid = self.grid_for(filename)
+        if grid is None:
+            return []
+        return grid.in_rect(x0, y0, x1, y1)
+
+    def grid_for(self, filename):
+        """grid_for(self, filename) - the GridIndex of filename (None if it has no marks)
+        grids are built the first time an image is hit-tested and kept up to date after that
+        """
+        grid = self.grids.get(filename)
+        if grid is None:
+            same_file = self.by_filename.get(filename)
+            if not same_file:
+                return None
+            transform = next(iter(same_file)).image.display_transform()
+            grid = GridIndex(native_cell_size(transform), new_bucket=self.new_list)
+            for observation in same_file:
+                grid.insert(observation)
+            self.grids[filename] = grid
+        return grid
+        
+    def marked_filenames(self):
+        """marked_filenames(self) - set of image filenames with observations (rows not materialized yet too)"""
+        names = {fname for fname, same_file in self.by_filename.items() if len(same_file)}
+        if self.unloaded:
+            names.update(fname for fname, rows in self.unloaded.items() if rows)
+        return names
+
+    def find_by_id(self, observation_id, filename=None):
+        """find_by_id(self, observation_id, filename=None) - the observation with a stable ID
+        (only filename's observations are searched if it is given), None if there is none
+        """
+        if filename is not None:
+            self.materialize(filename)
+            candidates = self.by_filename.get(filename, ())
+        else:
+            self.materialize_all()
+            candidates = self.items
+        for observation in candidates:
+            if observation.id == observation_id:
+                return observation
+        return None
+
     def find_by_filename(self, filename):
         """find_by_filename(self, filename) - find all observation indices
         which match the filename
         if NONE are found, return an empty list
+        cost is O(marks on this image log marks), the indices come from self.positions
         """
-        indices = []
-        for index, item in enumerate(self.items):
-            if item.image.fname == filename:
-                indices.append(index)
-        return indices
+        self.materialize(filename)
+        positions = self.positions
+        return sorted(positions.get(item) for item in self.by_filename.get(filename, ()))
     
     def find_by_filename_location(self, filename, x, y, pixel_tolerance=15):
         """find_by_filename_location(self, filename, x, y, pixel_tolerance=15)
-        returns indices of first observation to match the filename and x,y location within
-        the pixel (distance) tolerance.
+        returns index of the nearest observation on filename to the canvas position x,y
+        (e.g. a mouse click, marks are stored in native pixels) within the pixel (distance) tolerance.
         If NONE are found, returns a -1
         (since this returns an integer, the -1 maintains consistency of type)
         """
-        found_indices = self.find_by_filename(filename)
-        for index in found_indices:
-            current_observation = self.items[index]
-            this_distance = current_observation.distance(x,y)
-            if this_distance <= pixel_tolerance:
-                return index
-        return -1
+        observation = self.find_by_display_location(filename, x, y, pixel_tolerance)
+        if observation is None:
+            return -1
+        return self.index_of(observation)
             
             
     
-    def show_markers_by_filename(self, canvas, filename):
-        """show_markers_by_filename(self, canvas, filename)
-        this streamlines the process of displaying current markers associated with a filename
+    def show_markers_by_filename(self, canvas, filename, display_cache=None):
+        """show_markers_by_filename(self, canvas, filename, display_cache=None)
+        draw the markers of filename on the canvas (over an image already shown)
+        all markers are drawn in one batch, the image is not redrawn
         return True if it succeeds showing markers, False if nothing to show
         """
-        indices = self.find_by_filename(filename)
-        if indices:
-            first = indices[0]
-            # show the image
-            self.items[first].image.show(canvas)
+        self.materialize(filename)
+        found = self.by_filename.get(filename)
+        if found:
             # impose markers from observations
-            for idx in indices:
-                self.items[idx].show_marker(canvas)
+            with recorder.span('markers.draw'):
+                for observation in found:
+                    observation.draw_marker(canvas)
+            canvas.show()
             return True
         else:
             return False
         
-    def show_image_observations_by_filename(self, canvas, filename):
-        """show_image_observations_by_filename(self, canvas, filename)
+    def show_image_observations_by_filename(self, canvas, filename, display_cache=None):
+        """show_image_observations_by_filename(self, canvas, filename, display_cache=None)
         this streamlines the process of displaying the image and current markers associated with a filename
         returns current_image displayed.
         """
-        indices = self.find_by_filename(filename)
-        if indices:
-            # show the current image
-            current_image = self.items[indices[0]].image
-            current_image.show(canvas)
-            self.show_markers_by_filename(canvas, filename)
-        else:
-            # no observations on image!
-            current_image = Image(filename, self.path)
-            current_image.show(canvas)
+        current_image = self.image_for(filename)
+        current_image.show(canvas, display_cache)
+        self.show_markers_by_filename(canvas, filename, display_cache)
         return current_image
+
+    def image_for(self, filename):
+        """image_for(self, filename) - the Image of filename (in this folder)"""
+        self.materialize(filename)
+        found = self.by_filename.get(filename)
+        if found:
+            return found[0].image
+        return image_registry.get(filename, self.path)
                 
     
 if __name__ == '__main__':
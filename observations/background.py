@@ -0,0 +1,108 @@
+import queue
+import threading
+
+# background file I/O for the marker GUI
+#
+# loads, saves and closes run one at a time on a worker thread so the Tk
+# event loop never waits on the disk.  Results come back through poll(),
+# which the GUI calls from its own thread (guizero app.repeat / Tk after),
+# so callbacks can touch widgets safely.  Observations guard themselves with
+# a lock (see locked in observations/__init__.py).
+
+
+class IOWorker:
+    """IOWorker runs I/O tasks in order on one background thread
+
+    submit(function, *args, on_done=None, on_error=None) queues a task,
+    on_done(result) or on_error(exception) is called later by poll().
+    save(observations) is coalesced: while a save of the same observations
+    is waiting to run, more requests are dropped (the waiting save will
+    write everything anyway).
+    """
+    def __init__(self, on_error=None):
+        """__init__(self, on_error=None) - on_error(exception) reports failures without a handler"""
+        self.on_error = on_error
+        self.tasks = queue.Queue()
+        self.results = queue.Queue()
+        self.lock = threading.Lock()
+        # Observations with a save waiting in the queue
+        self.queued_saves = set()
+        self.thread = threading.Thread(target=self.run, name='observations-io', daemon=True)
+        self.thread.start()
+
+    def submit(self, function, *args, on_done=None, on_error=None, **kwargs):
+        """submit(self, function, *args, on_done=None, on_error=None, **kwargs) - queue a task"""
+        self.tasks.put((function, args, kwargs, on_done, on_error))
+
+    def save(self, observations, on_done=None, on_error=None):
+        """save(self, observations, on_done=None, on_error=None) - save in the background
+        returns False if a save of observations was already waiting (coalesced)
+        """
+        with self.lock:
+            if observations in self.queued_saves:
+                return False
+            self.queued_saves.add(observations)
+        self.submit(self._save, observations, on_done=on_done, on_error=on_error)
+        return True
+
+    def _save(self, observations):
+        with self.lock:
+            # changes made from now on need another save
+            self.queued_saves.discard(observations)
+        return observations.save()
+
+    def load(self, observations, on_done=None, on_error=None):
+        """load(self, observations, on_done=None, on_error=None) - read a lazy folder's rows
+        in the background, on_done(observations) when lookups are ready
+        """
+        def read():
+            observations.read_index()
+            return observations
+        self.submit(read, on_done=on_done, on_error=on_error)
+
+    def run(self):
+        """run(self) - the worker thread, runs tasks until shutdown"""
+        while True:
+            task = self.tasks.get()
+            try:
+                if task is None:
+                    return
+                function, args, kwargs, on_done, on_error = task
+                try:
+                    result = function(*args, **kwargs)
+                except Exception as e:
+                    self.results.put((on_error or self.on_error, e))
+                else:
+                    if on_done is not None:
+                        self.results.put((on_done, result))
+            finally:
+                self.tasks.task_done()
+
+    def poll(self):
+        """poll(self) - call callbacks of finished tasks (from the GUI thread)
+        returns the number of callbacks run
+        """
+        count = 0
+        while True:
+            try:
+                callback, value = self.results.get_nowait()
+            except queue.Empty:
+                return count
+            if callback is not None:
+                callback(value)
+            count += 1
+
+    @property
+    def pending(self):
+        """number of tasks queued or running"""
+        return self.tasks.unfinished_tasks
+
+    def wait(self):
+        """wait(self) - block until every queued task has run (then poll() for callbacks)"""
+        self.tasks.join()
+
+    def shutdown(self):
+        """shutdown(self) - run the queued tasks, then stop the thread"""
+        self.tasks.put(None)
+        self.thread.join()
+        self.poll()
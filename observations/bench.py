@@ -0,0 +1,353 @@
+"""bench - benchmarks for the observations hot paths (headless, no Tk)
+
+usage: python -m observations.bench [--rows 1000,10000,100000] [--images 500]
+                                    [--repeat 3] [--output results.json]
+                                    [--compare baseline.json] [--threshold 0.2]
+
+a synthetic camera folder is generated in a temporary directory (--workdir to
+keep it): JPEGs with DateTimeOriginal, image size and a UserComment in the
+"...,ID=CAM01,..." form Image.getEXIF parses, and an annotations.csv for each
+row count.  Every benchmark is run --repeat times and the best time is kept.
+
+results are written as JSON; with --compare the run is checked against an
+earlier results file and the exit status is 1 if any benchmark got slower by
+more than --threshold (0.2 = 20%), so it can gate a commit or a CI job.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+# Pillow is optional, without it images have no pixel data and the
+# decode benchmark is skipped
+try:
+    from PIL import Image as PILImage
+except ImportError:
+    PILImage = None
+
+from . import (Observations, Observation, image_registry, csvdata, OBSERVATION_FIELDS,
+               IMAGE_WIDTH, IMAGE_HEIGHT)
+from .exifcache import ExifCache, read_exif
+from .scanner import FolderScanner
+
+DEFAULT_ROWS = (1000, 10000, 100000)
+DEFAULT_IMAGES = 500
+SPECIES = ['zebra', 'wildebeest', 'impala', 'lion', 'elephant', 'giraffe', 'hyena',
+           'warthog', 'buffalo', 'kudu', 'baboon', 'leopard']
+CAMERAS = ['CAM{:02d}'.format(number) for number in range(1, 9)]
+NATIVE_SIZE = (4000, 3000)
+LOOKUPS = 1000
+
+
+def exif_segment(datetime, width, height, usercomment):
+    """exif_segment(datetime, width, height, usercomment) - bytes of a JPEG APP1 (EXIF) segment
+    IFD0 points to an EXIF IFD with DateTimeOriginal, UserComment and the image size
+    """
+    datetime = datetime.encode('ascii') + b'\0'
+    comment = b'ASCII\0\0\0' + usercomment.encode('ascii')
+    # TIFF header, IFD0 (1 entry) at 8, EXIF IFD (4 entries) at 26, values at 80
+    exif_ifd = 8 + 2 + 12 + 4
+    values = exif_ifd + 2 + 4 * 12 + 4
+    tiff = b'II*\0' + struct.pack('<I', 8)
+    tiff += struct.pack('<H', 1) + struct.pack('<HHII', 0x8769, 4, 1, exif_ifd) + struct.pack('<I', 0)
+    tiff += struct.pack('<H', 4)
+    tiff += struct.pack('<HHII', 0x9003, 2, len(datetime), values)
+    tiff += struct.pack('<HHII', 0x9286, 7, len(comment), values + len(datetime))
+    tiff += struct.pack('<HHII', 0xA002, 4, 1, width)
+    tiff += struct.pack('<HHII', 0xA003, 4, 1, height)
+    tiff += struct.pack('<I', 0)
+    tiff += datetime + comment
+    body = b'Exif\0\0' + tiff
+    return b'\xff\xe1' + struct.pack('>H', len(body) + 2) + body
+
+
+def jpeg_body(width=640, height=480, seed=0):
+    """jpeg_body(width=640, height=480, seed=0) - a JPEG (without its SOI marker) to put
+    after the EXIF segment; only a bare EOI when Pillow is not installed
+    """
+    if PILImage is None:
+        return b'\xff\xd9'
+    rng = random.Random(seed)
+    picture = PILImage.frombytes('RGB', (width, height), rng.randbytes(width * height * 3))
+    data = io.BytesIO()
+    picture.save(data, 'JPEG', quality=85)
+    return data.getvalue()[2:]
+
+
+def make_folder(path, images=DEFAULT_IMAGES, seed=0, size=NATIVE_SIZE):
+    """make_folder(path, images=DEFAULT_IMAGES, seed=0, size=NATIVE_SIZE) - write synthetic
+    camera images (one per minute from 2024:05:01 06:00), returns the list of fnames
+    EXIF reports size as the native resolution, the pixel data is a small 640x480
+    JPEG so a large folder doesn't take gigabytes
+    """
+    os.makedirs(path, exist_ok=True)
+    rng = random.Random(seed)
+    body = jpeg_body(seed=seed)
+    fnames = []
+    for index in range(images):
+        minutes = 6 * 60 + index
+        datetime = '2024:05:{:02d} {:02d}:{:02d}:00'.format(1 + minutes // 1440, minutes // 60 % 24,
+                                                              minutes % 60)
+        camera = rng.choice(CAMERAS)
+        usercomment = 'TEMP={},ID={},BAT=87'.format(rng.randrange(10, 35), camera)
+        fname = 'IMG_{:05d}.JPG'.format(index)
+        with open(os.path.join(path, fname), 'wb') as f:
+            f.write(b'\xff\xd8' + exif_segment(datetime, size[0], size[1], usercomment) + body)
+        fnames.append(fname)
+    return fnames
+
+
+def make_annotations(pathname, path, fnames, rows, seed=0):
+    """make_annotations(pathname, path, fnames, rows, seed=0) - write an annotations CSV
+    with rows observations spread over fnames (EXIF columns from the images)
+    """
+    rng = random.Random(seed)
+    cache = ExifCache(path)
+    serials = []
+    for index in range(rows):
+        fname = fnames[index % len(fnames)]
+        signature, metadata = cache.lookup(fname)
+        serials.append({
+            'species': rng.choice(SPECIES),
+            'x': rng.randrange(metadata['width'] or IMAGE_WIDTH),
+            'y': rng.randrange(metadata['height'] or IMAGE_HEIGHT),
+            'fname': fname,
+            'path': path,
+            'pathname': os.path.join(path, fname),
+            'datetime': metadata['datetime'],
+            'width': metadata['width'],
+            'height': metadata['height'],
+            'camera': metadata['camera_id'],
+            'space': 'native',
+        })
+    cache.save()
+    csvdata.write_csv(serials, pathname, fieldnames=OBSERVATION_FIELDS)
+    return serials
+
+
+def best_time(function, repeat, setup=None):
+    """best_time(function, repeat, setup=None) - fastest of repeat runs in seconds
+    setup() runs untimed before each run
+    """
+    best = None
+    for run in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+class Bench:
+    """Bench runs the benchmarks against one synthetic folder and collects results"""
+    def __init__(self, workdir, images=DEFAULT_IMAGES, repeat=3, seed=0):
+        """__init__(self, workdir, images=DEFAULT_IMAGES, repeat=3, seed=0)"""
+        self.workdir = workdir
+        self.path = os.path.join(workdir, 'camera')
+        self.images = images
+        self.repeat = repeat
+        self.seed = seed
+        self.fnames = []
+        self.results = {}
+
+    def record(self, name, seconds, count=1, **info):
+        """record(self, name, seconds, count=1, **info) - store one result
+        per_item is seconds / count (e.g. per lookup)
+        """
+        result = {'seconds': seconds, 'per_item': seconds / count, 'count': count}
+        result.update(info)
+        self.results[name] = result
+        print("{:<40} {:>10.4f}s  ({:.2f}us each)".format(name, seconds, seconds / count * 1e6))
+
+    def prepare(self):
+        """prepare(self) - generate the image folder"""
+        self.fnames = make_folder(self.path, self.images, self.seed)
+
+    def bench_exif(self):
+        pathnames = [os.path.join(self.path, fname) for fname in self.fnames]
+        seconds = best_time(lambda: [read_exif(pathname) for pathname in pathnames], self.repeat)
+        self.record('exif.read', seconds, len(pathnames))
+        cache = ExifCache(self.path)
+        for fname in self.fnames:
+            cache.lookup(fname)
+        cache.save()
+        def cached():
+            # reopening a folder: read the sidecar, then one stat per image
+            cache = ExifCache(self.path)
+            for fname in self.fnames:
+                cache.lookup(fname)
+        seconds = best_time(cached, self.repeat)
+        self.record('exif.cached_lookup', seconds, len(self.fnames))
+
+    def bench_scan(self):
+        seconds = best_time(lambda: FolderScanner().scan(self.path), self.repeat)
+        self.record('scan.cold', seconds, len(self.fnames))
+        scanner = FolderScanner()
+        scanner.scan(self.path)
+        seconds = best_time(lambda: scanner.scan(self.path), self.repeat)
+        self.record('scan.rescan', seconds, len(self.fnames))
+        seconds = best_time(lambda: FolderScanner(sort='datetime').scan(self.path), self.repeat)
+        self.record('scan.by_datetime', seconds, len(self.fnames))
+
+    def bench_decode(self):
+        if PILImage is None:
+            return
+        from .prefetch import decode_display
+        pathnames = [os.path.join(self.path, fname) for fname in self.fnames[:20]]
+        seconds = best_time(lambda: [decode_display(pathname) for pathname in pathnames], self.repeat)
+        self.record('decode.display', seconds, len(pathnames))
+
+    def bench_rows(self, rows):
+        filename = 'annotations_{}.csv'.format(rows)
+        pathname = os.path.join(self.path, filename)
+        serials = make_annotations(pathname, self.path, self.fnames, rows, self.seed)
+        prefix = 'rows{}.'.format(rows)
+
+        seconds = best_time(lambda: csvdata.read_csv(pathname), self.repeat)
+        self.record(prefix + 'csv.read_csv', seconds, rows)
+        scratch = os.path.join(self.workdir, 'scratch.csv')
+        seconds = best_time(lambda: csvdata.write_csv(serials, scratch, fieldnames=OBSERVATION_FIELDS),
+                            self.repeat)
+        self.record(prefix + 'csv.write_csv', seconds, rows)
+        del serials
+
+        modes = [('load', {}), ('load.columnar', {'columnar': True}),
+                 ('load.lazy', {'lazy': True, 'columnar': True})]
+        for name, options in modes:
+            def load():
+                loaded = Observations(filename, self.path, **options)
+                if loaded.lazy:
+                    loaded.read_index()
+            seconds = best_time(load, self.repeat, image_registry.clear)
+            self.record(prefix + name, seconds, rows)
+
+        observations = Observations(filename, self.path, columnar=True)
+        rng = random.Random(self.seed)
+        queries = []
+        for index in range(LOOKUPS):
+            fname = rng.choice(self.fnames)
+            queries.append((fname, rng.randrange(NATIVE_SIZE[0]), rng.randrange(NATIVE_SIZE[1])))
+        # first lookups build the spatial index for each image
+        seconds = best_time(lambda: [observations.find_by_filename_location(fname, x, y, 200)
+                                     for fname, x, y in queries], self.repeat)
+        self.record(prefix + 'find_by_filename_location', seconds, LOOKUPS)
+        seconds = best_time(lambda: [observations.get_by_filename(fname) for fname, x, y in queries],
+                            self.repeat)
+        self.record(prefix + 'get_by_filename', seconds, LOOKUPS)
+
+        image = image_registry.get(self.fnames[0], self.path)
+
+        def change():
+            observations.append(Observation(image, 'bench', 10, 10, space='native'))
+        seconds = best_time(lambda: observations.save(), self.repeat, change)
+        self.record(prefix + 'save', seconds, rows)
+
+        journal = Observations(filename, self.path, journal=True, columnar=True)
+        seconds = best_time(lambda: journal.save(), self.repeat,
+                            lambda: journal.append(Observation(image, 'bench', 10, 10, space='native')))
+        self.record(prefix + 'save.journal', seconds, 1)
+        journal.close()
+
+    def run(self, row_counts):
+        """run(self, row_counts) - run every benchmark, returns the results dictionary"""
+        self.prepare()
+        self.bench_exif()
+        self.bench_scan()
+        self.bench_decode()
+        for rows in row_counts:
+            self.bench_rows(rows)
+            image_registry.clear()
+        return self.results
+
+
+def git_commit():
+    """git_commit() - the commit being measured, '' outside a git checkout"""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def compare(results, baseline, threshold):
+    """compare(results, baseline, threshold) - list of (name, old, new, ratio) regressions
+    where the time per item grew by more than threshold (a fraction)
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        old = baseline.get(name)
+        if old is None or not old['per_item']:
+            continue
+        ratio = result['per_item'] / old['per_item']
+        marker = ''
+        if ratio > 1 + threshold:
+            regressions.append((name, old['per_item'], result['per_item'], ratio))
+            marker = '  REGRESSION'
+        print("{:<40} {:>7.2f}x{}".format(name, ratio, marker))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m observations.bench',
+                                     description='benchmark the observations package')
+    parser.add_argument('--rows', default=','.join(str(rows) for rows in DEFAULT_ROWS),
+                        help='comma separated annotation row counts (e.g. 1000,1000000)')
+    parser.add_argument('--images', type=int, default=DEFAULT_IMAGES, help='synthetic images')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark (best is kept)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', help='generate data here and keep it (default: a temporary folder)')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare', help='results JSON of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed slowdown per benchmark as a fraction (default 0.2)')
+    args = parser.parse_args(argv)
+    row_counts = [int(rows) for rows in args.rows.split(',') if rows.strip()]
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='observations-bench-')
+    try:
+        results = Bench(workdir, args.images, args.repeat, args.seed).run(row_counts)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'rows': row_counts,
+            'images': args.images,
+            'repeat': args.repeat,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print("compared with {} ({})".format(args.compare, baseline['meta'].get('commit', '')))
+        regressions = compare(results, baseline['results'], args.threshold)
+        if regressions:
+            print("{} benchmark(s) slower than {:.0%} threshold".format(len(regressions), args.threshold))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
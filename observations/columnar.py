@@ -0,0 +1,236 @@
+import os
+from array import array
+
+from .ids import legacy_id, id_number, id_text
+
+# columnar observation storage
+#
+# instead of one Python object (plus __dict__) per observation, values are kept
+# in parallel typed arrays, strings are stored once in code tables and each
+# image's metadata is stored once in an image table.
+# See ObservationProxy in observations/__init__.py for the per-row object.
+
+
+class CodeTable:
+    """CodeTable maps repeated strings to small integer codes and back"""
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def code(self, value):
+        """code(self, value) - return the code for value, adding it if it is new"""
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            self.codes[value] = code
+        return code
+
+    def __getitem__(self, code):
+        return self.values[code]
+
+
+def as_int(value):
+    """as_int(value) - int of a CSV/serial value, 0 if blank"""
+    if value in ('', None):
+        return 0
+    return int(value)
+
+
+class ObservationStore:
+    """ObservationStore holds observations as parallel columns
+
+    observation columns: x, y (array 'i'), species and image codes,
+    space (array 'b', 1 for native image coordinates, 0 for display coordinates),
+    id (array 'Q', see ids.py - odd IDs which aren't 16 hex digits go in odd_ids)
+    image columns: fname, path, camera, datetime codes and width, height
+    rows are never moved, a removed observation just stops being referenced
+    (its row is dropped the next time the folder is loaded).
+    proxy(store, row) is the class used to hand out rows as observations.
+    species_table can be a vocabulary.Vocabulary, then species codes are species IDs.
+    """
+    def __init__(self, proxy, species_table=None):
+        """__init__(self, proxy, species_table=None) - proxy is the row object class (ObservationProxy)"""
+        self.proxy = proxy
+        self.x = array('i')
+        self.y = array('i')
+        self.species = array('i')
+        self.image = array('i')
+        self.space = array('b')
+        self.id = array('Q')
+        # row -> ID text for IDs id_number can't pack
+        self.odd_ids = {}
+        self.species_table = CodeTable() if species_table is None else species_table
+        # one row per image
+        self.image_fname = array('i')
+        self.image_path = array('i')
+        self.image_camera = array('i')
+        self.image_datetime = array('i')
+        self.image_width = array('i')
+        self.image_height = array('i')
+        self.fname_table = CodeTable()
+        self.path_table = CodeTable()
+        self.camera_table = CodeTable()
+        self.datetime_table = CodeTable()
+        # (fname code, path code) -> image row
+        self.image_rows = {}
+        # Image objects are only made when asked for (image row -> Image or None)
+        self.image_objects = []
+
+    def __len__(self):
+        return len(self.x)
+
+    def image_row(self, serial):
+        """image_row(self, serial) - return the image row for a serial, adding it if new"""
+        key = (self.fname_table.code(serial['fname']), self.path_table.code(serial['path']))
+        row = self.image_rows.get(key)
+        if row is None:
+            row = len(self.image_fname)
+            self.image_fname.append(key[0])
+            self.image_path.append(key[1])
+            self.image_camera.append(self.camera_table.code(serial.get('camera') or ''))
+            self.image_datetime.append(self.datetime_table.code(str(serial.get('datetime') or '')))
+            self.image_width.append(as_int(serial.get('width')))
+            self.image_height.append(as_int(serial.get('height')))
+            self.image_objects.append(None)
+            self.image_rows[key] = row
+        return row
+
+    def add(self, serial):
+        """add(self, serial) - add a serialized observation, returns its row"""
+        row = len(self.x)
+        self.x.append(int(serial['x']))
+        self.y.append(int(serial['y']))
+        self.species.append(self.species_table.code(serial['species']))
+        self.image.append(self.image_row(serial))
+        self.space.append(1 if serial.get('space') == 'native' else 0)
+        observation_id = serial.get('id') or legacy_id(serial['fname'], serial['species'],
+                                                       serial['x'], serial['y'])
+        number = id_number(observation_id)
+        if number is None:
+            self.odd_ids[row] = observation_id
+            number = 0
+        self.id.append(number)
+        return row
+
+    def observation_id(self, row):
+        """observation_id(self, row) - the stable ID of a row"""
+        if self.odd_ids:
+            odd = self.odd_ids.get(row)
+            if odd is not None:
+                return odd
+        return id_text(self.id[row])
+
+    def fname(self, row):
+        return self.fname_table[self.image_fname[self.image[row]]]
+
+    def path(self, row):
+        return self.path_table[self.image_path[self.image[row]]]
+
+    def serialize(self, row):
+        """serialize(self, row) - return one observation as a dictionary (CSV row)"""
+        image = self.image[row]
+        fname = self.fname_table[self.image_fname[image]]
+        path = self.path_table[self.image_path[image]]
+        return {
+            'species': self.species_table[self.species[row]],
+            'x': self.x[row],
+            'y': self.y[row],
+            'fname': fname,
+            'path': path,
+            'pathname': os.path.join(path, fname),
+            'datetime': self.datetime_table[self.image_datetime[image]],
+            'width': self.image_width[image],
+            'height': self.image_height[image],
+            'camera': self.camera_table[self.image_camera[image]],
+            'space': 'native' if self.space[row] else 'display',
+            'id': self.observation_id(row),
+        }
+
+
+class RowList:
+    """RowList is a list of observations kept as an array of store rows
+
+    it supports the list operations Observations uses (append, pop, del, index,
+    len, iteration, indexing and item assignment, copy) and makes a proxy for a row only when it is read,
+    so there is no Python object per observation while it sits in a list.
+    """
+    __slots__ = ('store', 'rows')
+
+    def __init__(self, store):
+        self.store = store
+        self.rows = array('i')
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        proxy = self.store.proxy
+        store = self.store
+        for row in self.rows:
+            yield proxy(store, row)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.store.proxy(self.store, row) for row in self.rows[index]]
+        return self.store.proxy(self.store, self.rows[index])
+
+    def __setitem__(self, index, observation):
+        self.rows[index] = observation.row
+
+    def __delitem__(self, index):
+        del self.rows[index]
+
+    def append(self, observation):
+        self.rows.append(observation.row)
+
+    def pop(self, index=-1):
+        return self.store.proxy(self.store, self.rows.pop(index))
+
+    def copy(self):
+        copied = RowList(self.store)
+        copied.rows = array('i', self.rows)
+        return copied
+
+    def index(self, observation):
+        if getattr(observation, 'store', None) is not self.store:
+            raise ValueError("observation is not in this list")
+        return self.rows.index(observation.row)
+
+
+class RowPositions:
+    """RowPositions maps the observations of a store to their index in a list
+
+    the dict-like part Observations uses (get, pop, item assignment), kept as
+    an array indexed by store row (-1 where a row isn't in the list), so it
+    costs 4 bytes per row instead of a dict entry and a proxy.
+    """
+    __slots__ = ('store', 'positions')
+
+    def __init__(self, store):
+        self.store = store
+        self.positions = array('i')
+
+    def __setitem__(self, observation, position):
+        row = observation.row
+        if row >= len(self.positions):
+            self.positions.extend([-1] * (row + 1 - len(self.positions)))
+        self.positions[row] = position
+
+    def get(self, observation, default=None):
+        if getattr(observation, 'store', None) is not self.store:
+            return default
+        row = observation.row
+        if row >= len(self.positions) or self.positions[row] < 0:
+            return default
+        return self.positions[row]
+
+    def pop(self, observation, default=None):
+        position = self.get(observation)
+        if position is None:
+            return default
+        self.positions[observation.row] = -1
+        return position
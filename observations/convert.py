@@ -0,0 +1,38 @@
+"""convert - rewrite folder annotations in native image pixels
+
+usage: python -m observations.convert FOLDER [FOLDER ...]
+
+annotations made before coordinates were stored in native resolution are in
+display (1024x768 canvas) pixels.  Opening them in the marker program converts
+them too, this does whole folders at once without the GUI (see transform.py).
+"""
+import argparse
+import os
+import sys
+
+from . import Observations
+
+
+def convert_folder(path, filename='annotations.csv'):
+    """convert_folder(path, filename='annotations.csv') - convert one folder, returns rows converted"""
+    observations = Observations(filename, path, lazy=True)
+    converted = observations.convert_to_native()
+    observations.close()
+    return converted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m observations.convert',
+                                     description='convert annotations to native image pixels')
+    parser.add_argument('folders', nargs='+', help='camera folder(s) to convert')
+    args = parser.parse_args(argv)
+    for folder in args.folders:
+        if not os.path.isfile(os.path.join(folder, 'annotations.csv')):
+            print("skipping {} (no annotations.csv)".format(folder))
+            continue
+        print("{}: {} observations converted".format(folder, convert_folder(folder)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
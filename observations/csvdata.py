@@ -1,25 +1,107 @@
 import csv
+import os
+import sys
 
 def get_fields(rows):
-    """find the fieldnames in a list of dictionaries"""
-    fieldnames = set()
+    """find the fieldnames in a list of dictionaries
+    (in the order they are first seen, so the column order is stable)"""
+    fieldnames = {}
     for row in rows:
         if isinstance(row, dict):
-            for k,v in row.items():
-                fieldnames.add(k)
-    return fieldnames
+            for k in row:
+                fieldnames.setdefault(k, None)
+    return list(fieldnames)
 
-def write_csv(rows, filename, fieldnames=None):
-    """write the data from the row dictionaries"""
+def write_csv(rows, filename, fieldnames=None, atomic=True):
+    """write the data from the row dictionaries
+    atomic writes go to a temporary file which is fsynced and renamed over filename,
+    so a crash leaves either the old or the new file, never a partial one
+    """
     # if fieldnames is not specified, try to get the fields
     if fieldnames is None:
         fieldnames = get_fields(rows)
-        
-    with open(filename, 'w', newline='') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames, extrasaction='ignore')
-        writer.writeheader()
-        writer.writerows(rows)
-    
+
+    if not atomic:
+        with open(filename, 'w', newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=fieldnames, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(rows)
+        return
+
+    temp = temp_name(filename)
+    try:
+        with open(temp, 'w', newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=fieldnames, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(rows)
+            csvfile.flush()
+            os.fsync(csvfile.fileno())
+        os.replace(temp, filename)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+    fsync_directory(os.path.dirname(filename))
+
+# temporary files of atomic writes are named <filename>.tmp-<pid>
+TEMP_SUFFIX = '.tmp-'
+
+def temp_name(filename):
+    """temp_name(filename) - temporary file name for an atomic write of filename"""
+    return '{}{}{}'.format(filename, TEMP_SUFFIX, os.getpid())
+
+def fsync_directory(path):
+    """make a rename in directory path durable (no-op where directories can't be opened)"""
+    try:
+        fd = os.open(path or '.', os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+# results of csv_state
+OK = 'ok'
+MISSING = 'missing'
+EMPTY = 'empty'
+PARTIAL = 'partial'
+
+def csv_state(filename, tail=65536):
+    """check a CSV file for damage from an interrupted (non-atomic) write
+    returns MISSING, EMPTY (no header), PARTIAL (last row cut off) or OK
+    only the start and the end of the file are read.  A last row without a
+    newline is only PARTIAL if it really is cut off: a quote is left open or it
+    has fewer fields than the header (some editors don't end the last line)
+    """
+    try:
+        with open(filename, 'rb') as f:
+            head = f.readline()
+            if not head.strip():
+                return EMPTY
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - tail))
+            end = f.read()
+    except FileNotFoundError:
+        return MISSING
+    if end.endswith(b'\n'):
+        return OK
+    last = end[end.rfind(b'\n') + 1:]
+    if last.count(b'"') % 2:
+        return PARTIAL
+    try:
+        header = next(csv.reader([head.decode('utf-8')]), [])
+        row = next(csv.reader([last.decode('utf-8')]), [])
+    except (UnicodeDecodeError, csv.Error):
+        # a multibyte character cut in half
+        return PARTIAL
+    if len(row) < len(header):
+        return PARTIAL
+    return OK
+
 def read_csv(filename):
     """read a csvfile into a list of dictionaries (each row is a dictionary)"""
     try:
@@ -28,6 +110,53 @@ def read_csv(filename):
             return list(reader)
     except Exception as e:
         return []
+
+def iter_csv(filename):
+    """generator version of read_csv, yields one row dictionary at a time
+    (nothing is yielded if the file can't be read)"""
+    try:
+        csvfile = open(filename, 'r', newline='')
+    except OSError:
+        return
+    with csvfile:
+        for row in csv.DictReader(csvfile):
+            yield row
+
+def iter_tuples(filename, fieldnames, types=None, interned=()):
+    """generator of compact rows: a tuple of the fieldnames values for each row
+    types is a dictionary of fieldname -> conversion function (e.g. int),
+    interned fieldnames share one string object for repeated values,
+    columns missing from the file come back as ''
+    """
+    if types is None:
+        types = {}
+    try:
+        csvfile = open(filename, 'r', newline='')
+    except OSError:
+        return
+    with csvfile:
+        reader = csv.reader(csvfile)
+        header = next(reader, None)
+        if header is None:
+            return
+        positions = [header.index(field) if field in header else None for field in fieldnames]
+        convert = [types.get(field) for field in fieldnames]
+        share = [field in interned for field in fieldnames]
+        columns = list(zip(positions, convert, share))
+        width = len(header)
+        for record in reader:
+            if len(record) != width:
+                # blank or damaged line
+                continue
+            values = []
+            for position, conversion, shared in columns:
+                value = '' if position is None else record[position]
+                if conversion is not None:
+                    value = conversion(value)
+                elif shared:
+                    value = sys.intern(value)
+                values.append(value)
+            yield tuple(values)
     
 def findrow(rows, item):
     """find a row index that contains the item"""
@@ -0,0 +1,79 @@
+import time
+from collections import deque
+
+from .instrument import recorder
+
+# input event queue for the marker GUI
+#
+# Tk handlers only put events (key presses, clicks) on the queue and return,
+# the queue is drained in order from the Tk event loop.  A handler which can't
+# run an event yet (e.g. the observations are locked by a background save)
+# returns False, the event stays at the front and draining is tried again a
+# little later, so fast bursts of clicks are kept and keep their order.
+# A handler may open a modal dialog, which runs the Tk event loop again:
+# the events after it wait until the handler returns.
+
+
+class EventQueue:
+    """EventQueue buffers input events for a handler on the GUI thread
+
+    put(kind, *args) queues an event (a tuple) and makes sure a drain is
+    scheduled, handler(event) is called for each event in order and returns
+    False to have it retried after retry milliseconds.
+    schedule(milliseconds, function) is e.g. guizero App.after.
+    """
+    def __init__(self, handler, schedule, retry=20):
+        """__init__(self, handler, schedule, retry=20)"""
+        self.handler = handler
+        self.schedule = schedule
+        self.retry = retry
+        # (time put, event)
+        self.events = deque()
+        self.scheduled = False
+        # True while a handler runs (see drain)
+        self.draining = False
+
+    def __len__(self):
+        return len(self.events)
+
+    def put(self, kind, *args):
+        """put(self, kind, *args) - queue the event (kind, *args)"""
+        self.events.append((time.perf_counter(), (kind,) + args))
+        if not self.scheduled:
+            self.scheduled = True
+            self.schedule(0, self.drain)
+
+    def drain(self):
+        """drain(self) - handle the queued events (called from the GUI event loop)"""
+        self.scheduled = False
+        if self.draining:
+            # called from inside a handler's dialog, try again once it is closed
+            self.scheduled = True
+            self.schedule(self.retry, self.drain)
+            return
+        self.draining = True
+        try:
+            while self.events:
+                queued, event = self.events.popleft()
+                try:
+                    handled = self.handler(event)
+                except Exception:
+                    # a failing event is dropped, the rest still run next time
+                    if self.events and not self.scheduled:
+                        self.scheduled = True
+                        self.schedule(self.retry, self.drain)
+                    raise
+                if handled is False:
+                    self.events.appendleft((queued, event))
+                    self.scheduled = True
+                    self.schedule(self.retry, self.drain)
+                    return
+                if recorder.enabled:
+                    # how long input waited to be handled
+                    recorder.record('input.wait', queued, time.perf_counter() - queued)
+        finally:
+            self.draining = False
+
+    def clear(self):
+        """clear(self) - forget queued events"""
+        self.events.clear()
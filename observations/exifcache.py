@@ -0,0 +1,162 @@
+import io
+import os
+import exifread
+
+from . import csvdata
+from .instrument import timed
+
+# sidecar file stored in each image folder (next to annotations.csv)
+CACHE_FILENAME = '.exif_cache.csv'
+CACHE_FIELDS = ['fname', 'mtime', 'size', 'datetime', 'width', 'height', 'camera_id']
+# bytes read from the front of a JPEG, enough for the EXIF (APP1) segment
+HEADER_BYTES = 64 * 1024
+
+
+def parse_camera_id(usercomment):
+    """parse_camera_id(usercomment) - return the camera ID from a UserComment
+    in the form "...,ID=CAM01,..." or '' if there is no ID part
+    """
+    camera_id = ''
+    for part in str(usercomment).split(','):
+        if 'ID=' in part:
+            camera_id = part.replace('ID=', '').strip()
+    return camera_id
+
+
+def read_header(f, limit=HEADER_BYTES):
+    """read_header(f, limit=HEADER_BYTES) - return the leading bytes of a JPEG file
+    which hold the EXIF (APP1) segment, without reading the compressed image data.
+    Returns None if f is not a JPEG.
+    """
+    data = f.read(limit)
+    if data[:2] != b'\xff\xd8':
+        return None
+    position = 2
+    while position + 4 <= len(data) and data[position] == 0xFF:
+        marker = data[position + 1]
+        if marker == 0xDA:
+            # start of the image data, no more header segments
+            break
+        end = position + 2 + int.from_bytes(data[position + 2:position + 4], 'big')
+        if marker == 0xE1:
+            if end > len(data):
+                # very large EXIF segment (maker notes), read the rest of it
+                data += f.read(end - len(data))
+            break
+        position = end
+    return data
+
+
+@timed('exif.read')
+def read_exif(pathname):
+    """read_exif(pathname) - return a metadata dictionary for an image file
+    (datetime, width, height, camera_id)
+    only the header bytes of a JPEG are read (see read_header)
+    """
+    with open(pathname, 'rb') as f:
+        header = read_header(f)
+        if header is None:
+            f.seek(0)
+            tags = exifread.process_file(f)
+        else:
+            tags = exifread.process_file(io.BytesIO(header))
+    return metadata_from_tags(tags)
+
+
+def metadata_from_tags(tags):
+    """metadata_from_tags(tags) - convert exifread tags into a metadata dictionary"""
+    datetime = tags.get('EXIF DateTimeOriginal')
+    return {
+        'datetime': str(datetime) if datetime is not None else '',
+        'width': int(str(tags.get('EXIF ExifImageWidth', '0'))),
+        'height': int(str(tags.get('EXIF ExifImageLength', '0'))),
+        'camera_id': parse_camera_id(tags.get('EXIF UserComment')),
+    }
+
+
+def file_signature(pathname):
+    """file_signature(pathname) - return (mtime, size) of a file, (-1, -1) if missing"""
+    try:
+        st = os.stat(pathname)
+    except OSError:
+        return (-1, -1)
+    return (st.st_mtime_ns, st.st_size)
+
+
+class ExifCache:
+    """ExifCache is the EXIF metadata for one folder of images
+
+    metadata is kept in memory and persisted to a sidecar CSV file, so reopening
+    a folder only parses EXIF for files that are new or changed since the last visit.
+    An entry is valid as long as the file's (mtime, size) signature matches.
+    """
+    def __init__(self, path, filename=CACHE_FILENAME):
+        """__init__(self, path, filename=CACHE_FILENAME) initializes and loads the sidecar if it can"""
+        self.path = path
+        self.pathname = os.path.join(path, filename)
+        self.entries = {}
+        self.dirty = False
+        self.load()
+
+    def load(self, pathname=None):
+        """load(self, pathname=None) - read entries from the sidecar CSV file"""
+        if pathname is None:
+            pathname = self.pathname
+        for row in csvdata.read_csv(pathname):
+            try:
+                signature = (int(row['mtime']), int(row['size']))
+                metadata = {
+                    'datetime': row['datetime'],
+                    'width': int(row['width']),
+                    'height': int(row['height']),
+                    'camera_id': row['camera_id'],
+                }
+            except (KeyError, ValueError):
+                # skip damaged rows, they will be re-read from the image
+                continue
+            self.entries[row['fname']] = (signature, metadata)
+        return self.entries
+
+    def save(self, pathname=None):
+        """save(self, pathname=None) - write the sidecar, only if something changed"""
+        if not self.dirty:
+            return False
+        if pathname is None:
+            pathname = self.pathname
+        rows = []
+        for fname, (signature, metadata) in sorted(self.entries.items()):
+            row = dict(metadata)
+            row['fname'] = fname
+            row['mtime'], row['size'] = signature
+            rows.append(row)
+        try:
+            csvdata.write_csv(rows, pathname, fieldnames=CACHE_FIELDS)
+        except OSError:
+            # read-only folder (e.g. a shared card), cache stays in memory only
+            return False
+        self.dirty = False
+        return True
+
+    def lookup(self, fname, signature=None):
+        """lookup(self, fname, signature=None) - return (signature, metadata) for fname
+        EXIF is only parsed when the file is not cached or has changed.
+        Missing files return empty metadata.
+        """
+        if signature is None:
+            signature = file_signature(os.path.join(self.path, fname))
+        entry = self.entries.get(fname)
+        if entry is not None and entry[0] == signature:
+            return entry
+        if signature == (-1, -1):
+            # file is gone, don't cache anything
+            return signature, {'datetime': '', 'width': 0, 'height': 0, 'camera_id': ''}
+        metadata = read_exif(os.path.join(self.path, fname))
+        entry = (signature, metadata)
+        self.entries[fname] = entry
+        self.dirty = True
+        return entry
+
+    def update(self, fname, signature, metadata):
+        """update(self, fname, signature, metadata) - store metadata read elsewhere"""
+        self.entries[fname] = (signature, metadata)
+        self.dirty = True
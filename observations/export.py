@@ -0,0 +1,304 @@
+"""export - write observations to columnar files for analysis and training
+
+usage: python -m observations.export OUTPUT FOLDER [FOLDER ...]
+       python -m observations.export OUTPUT --project PROJECT.sqlite
+
+the format comes from the OUTPUT extension (or --format):
+  .parquet          Apache Parquet (needs pyarrow)
+  .arrow / .feather Arrow IPC file (needs pyarrow)
+  .npz              NumPy archive of column arrays (needs numpy)
+  .json             COCO style JSON (images, categories, point annotations)
+Parquet and Arrow fall back to NPZ when pyarrow is not installed.
+
+rows are streamed in batches of BATCH_ROWS, so memory depends on the batch
+size (and for NPZ/COCO on the number of distinct strings and images),
+not on the number of observations.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+from array import array
+from itertools import islice
+
+# pyarrow and numpy are optional
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from . import OBSERVATION_FIELDS
+from .columnar import CodeTable
+from .shared import SharedStorage, shared_logs
+from .storage import CSVStorage, SQLiteStorage, INTEGER_FIELDS, to_int
+from .transform import batch_to_native, NATIVE, DISPLAY_WIDTH, DISPLAY_HEIGHT, LEGACY_FIT
+
+# exported columns, in this order, and their types
+SCHEMA = [
+    ('species', 'string'),
+    ('x', 'int32'),
+    ('y', 'int32'),
+    ('fname', 'string'),
+    ('path', 'string'),
+    ('pathname', 'string'),
+    ('datetime', 'string'),
+    ('width', 'int32'),
+    ('height', 'int32'),
+    ('camera', 'string'),
+    ('space', 'string'),
+    ('id', 'string'),
+]
+FIELDS = [field for field, kind in SCHEMA]
+
+BATCH_ROWS = 65536
+
+PARQUET = 'parquet'
+ARROW = 'arrow'
+NPZ = 'npz'
+COCO = 'coco'
+EXTENSIONS = {'.parquet': PARQUET, '.arrow': ARROW, '.feather': ARROW, '.npz': NPZ, '.json': COCO}
+
+
+def format_for(pathname):
+    """format_for(pathname) - export format from a file extension"""
+    extension = os.path.splitext(pathname)[1].lower()
+    if extension not in EXTENSIONS:
+        raise ValueError("unknown export format {} (use {})".format(
+            extension, ', '.join(sorted(EXTENSIONS))))
+    return EXTENSIONS[extension]
+
+
+def batches(serials, size=BATCH_ROWS):
+    """batches(serials, size=BATCH_ROWS) - generator of column dictionaries
+    each batch is {field: list of values} for up to size rows, typed per SCHEMA
+    """
+    serials = iter(serials)
+    while True:
+        rows = list(islice(serials, size))
+        if not rows:
+            return
+        columns = {}
+        for field in FIELDS:
+            values = [row.get(field) for row in rows]
+            if field in INTEGER_FIELDS:
+                values = [value if type(value) is int else to_int(value) for value in values]
+            else:
+                values = [value if type(value) is str else ('' if value is None else str(value))
+                          for value in values]
+            columns[field] = values
+        if not all(columns['pathname']):
+            columns['pathname'] = [pathname or os.path.join(path, fname) for pathname, path, fname
+                                   in zip(columns['pathname'], columns['path'], columns['fname'])]
+        yield columns
+
+
+def arrow_schema():
+    """arrow_schema() - the pyarrow schema of SCHEMA"""
+    return pyarrow.schema([(field, pyarrow.int32() if kind == 'int32' else pyarrow.string())
+                           for field, kind in SCHEMA])
+
+
+def record_batch(columns, schema):
+    return pyarrow.RecordBatch.from_arrays([pyarrow.array(columns[field], type=schema.field(field).type)
+                                            for field in FIELDS], schema=schema)
+
+
+def export_parquet(serials, pathname, batch_rows=BATCH_ROWS):
+    """export_parquet(serials, pathname, batch_rows=BATCH_ROWS) - write a Parquet file, returns rows"""
+    schema = arrow_schema()
+    rows = 0
+    with pyarrow.parquet.ParquetWriter(pathname, schema, compression='zstd') as writer:
+        for columns in batches(serials, batch_rows):
+            writer.write_batch(record_batch(columns, schema))
+            rows += len(columns['x'])
+    return rows
+
+
+def export_arrow(serials, pathname, batch_rows=BATCH_ROWS):
+    """export_arrow(serials, pathname, batch_rows=BATCH_ROWS) - write an Arrow IPC file, returns rows"""
+    schema = arrow_schema()
+    rows = 0
+    with pyarrow.OSFile(pathname, 'wb') as sink:
+        with pyarrow.ipc.new_file(sink, schema) as writer:
+            for columns in batches(serials, batch_rows):
+                writer.write_batch(record_batch(columns, schema))
+                rows += len(columns['x'])
+    return rows
+
+
+def export_npz(serials, pathname, batch_rows=BATCH_ROWS):
+    """export_npz(serials, pathname, batch_rows=BATCH_ROWS) - write a NumPy .npz archive, returns rows
+    integer columns are int32 arrays, string columns are dictionary encoded as
+    <field> (int32 codes) and <field>_values (the strings), e.g. species_values[species]
+    """
+    ints = {field: array('i') for field, kind in SCHEMA if kind == 'int32'}
+    codes = {field: array('i') for field, kind in SCHEMA if kind == 'string'}
+    tables = {field: CodeTable() for field in codes}
+    for columns in batches(serials, batch_rows):
+        for field, values in ints.items():
+            values.extend(columns[field])
+        for field, values in codes.items():
+            code = tables[field].code
+            values.extend(code(value) for value in columns[field])
+    arrays = {}
+    for field, kind in SCHEMA:
+        if kind == 'int32':
+            arrays[field] = numpy.frombuffer(ints[field], dtype=numpy.int32)
+        else:
+            arrays[field] = numpy.frombuffer(codes[field], dtype=numpy.int32)
+            arrays[field + '_values'] = numpy.array(tables[field].values, dtype=str)
+    arrays['fields'] = numpy.array(FIELDS, dtype=str)
+    with open(pathname, 'wb') as f:
+        numpy.savez_compressed(f, **arrays)
+    return len(ints['x'])
+
+
+def native_columns(columns):
+    """native_columns(columns) - (xs, ys, placed) of a batch in native image pixels
+    display space rows are converted in one pass (see transform.batch_to_native),
+    placed[i] is False for display rows of images with unknown size
+    """
+    xs = list(columns['x'])
+    ys = list(columns['y'])
+    placed = [True] * len(xs)
+    convert = [index for index, space in enumerate(columns['space']) if space != NATIVE]
+    if convert:
+        widths = columns['width']
+        heights = columns['height']
+        known = [index for index in convert if widths[index] > 0 and heights[index] > 0]
+        for index in convert:
+            placed[index] = False
+        native_x, native_y = batch_to_native([xs[index] for index in known],
+                                             [ys[index] for index in known],
+                                             [widths[index] for index in known],
+                                             [heights[index] for index in known],
+                                             DISPLAY_WIDTH, DISPLAY_HEIGHT, LEGACY_FIT)
+        for index, x, y in zip(known, native_x, native_y):
+            xs[index] = x
+            ys[index] = y
+            placed[index] = True
+    return xs, ys, placed
+
+
+def export_coco(serials, pathname, batch_rows=BATCH_ROWS, box_size=None):
+    """export_coco(serials, pathname, batch_rows=BATCH_ROWS, box_size=None) - write COCO style JSON
+    each mark is an annotation with a single keypoint in native image pixels,
+    box_size (native pixels) adds a square bbox centred on the mark,
+    observation_id is the mark's stable ID (see ids.py).
+    Display space rows of images with unknown size can't be placed and are skipped.
+    returns the number of annotations written
+    """
+    # pathname -> image id, the image records are spooled to a temporary file
+    images = {}
+    categories = CodeTable()
+    written = 0
+    with open(pathname, 'w') as f, tempfile.TemporaryFile('w+') as image_records:
+        f.write('{"info": {"description": "maddy observations"},\n"annotations": [\n')
+        for columns in batches(serials, batch_rows):
+            xs, ys, placed = native_columns(columns)
+            for index, image_pathname in enumerate(columns['pathname']):
+                if not placed[index]:
+                    continue
+                image_id = images.get(image_pathname)
+                if image_id is None:
+                    image_id = images[image_pathname] = len(images) + 1
+                    image_records.write(('' if image_id == 1 else ',\n') + json.dumps({
+                        'id': image_id,
+                        'file_name': image_pathname,
+                        'width': columns['width'][index],
+                        'height': columns['height'][index],
+                        'date_captured': columns['datetime'][index],
+                        'camera': columns['camera'][index],
+                    }))
+                x = xs[index]
+                y = ys[index]
+                written += 1
+                f.write('{}{{"id": {}, "image_id": {}, "category_id": {}, "keypoints": [{}, {}, 2],'
+                        ' "num_keypoints": 1, "iscrowd": 0, "observation_id": {}'.format(
+                            ',\n' if written > 1 else '', written, image_id,
+                            categories.code(columns['species'][index]) + 1, x, y,
+                            json.dumps(columns['id'][index])))
+                if box_size:
+                    half = box_size / 2.0
+                    f.write(', "bbox": [{}, {}, {}, {}], "area": {}'.format(
+                        x - half, y - half, box_size, box_size, box_size * box_size))
+                f.write('}')
+        f.write('\n],\n"images": [\n')
+        image_records.seek(0)
+        shutil.copyfileobj(image_records, f)
+        f.write('\n],\n"categories": ')
+        json.dump([{'id': code + 1, 'name': name, 'keypoints': ['mark']}
+                   for code, name in enumerate(categories.values)], f)
+        f.write('}\n')
+    return written
+
+
+def export(serials, pathname, fmt=None, batch_rows=BATCH_ROWS):
+    """export(serials, pathname, fmt=None, batch_rows=BATCH_ROWS) - export an iterable of
+    serialized observations (e.g. Observations.iter_serialize() or SQLiteStorage.query())
+    fmt defaults to the pathname extension.  Returns (pathname written, rows) - Parquet
+    and Arrow are written as NPZ next to pathname when pyarrow is not installed.
+    """
+    if fmt is None:
+        fmt = format_for(pathname)
+    if fmt in (PARQUET, ARROW) and pyarrow is None:
+        fmt = NPZ
+        pathname = os.path.splitext(pathname)[0] + '.npz'
+    if fmt == NPZ and numpy is None:
+        raise ValueError("NPZ export needs numpy (or pyarrow for Parquet/Arrow)")
+    writers = {PARQUET: export_parquet, ARROW: export_arrow, NPZ: export_npz, COCO: export_coco}
+    if fmt not in writers:
+        raise ValueError("unknown export format {}".format(fmt))
+    return pathname, writers[fmt](serials, pathname, batch_rows)
+
+
+def iter_folders(folders, filename='annotations.csv'):
+    """iter_folders(folders, filename='annotations.csv') - stream serialized rows of folders
+    (journal and shared folder annotator logs applied) without making Observation objects
+    the folders are only read, a folder damaged by a crash is repaired when it is next marked
+    """
+    for folder in folders:
+        pathname = os.path.join(folder, filename)
+        # storage reads every stored column, the rows are cut down to SCHEMA when written
+        if shared_logs(pathname):
+            storage = SharedStorage(pathname, OBSERVATION_FIELDS, None)
+        else:
+            storage = CSVStorage(pathname, OBSERVATION_FIELDS, read_only=True)
+        for row in storage.iter_compact(folder):
+            yield row.serialize()
+        storage.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m observations.export',
+                                     description='export observations to Parquet, Arrow, NPZ or COCO JSON')
+    parser.add_argument('output', help='file to write, the extension picks the format')
+    parser.add_argument('folders', nargs='*', help='camera folder(s) with annotations.csv')
+    parser.add_argument('--project', help='export a whole SQLite project instead of folders')
+    parser.add_argument('--format', choices=[PARQUET, ARROW, NPZ, COCO], help='override the extension')
+    args = parser.parse_args(argv)
+    if args.project:
+        storage = SQLiteStorage(args.project, OBSERVATION_FIELDS)
+        serials = storage.query()
+    elif args.folders:
+        storage = None
+        serials = iter_folders(args.folders)
+    else:
+        parser.error('give folder(s) or --project')
+    pathname, rows = export(serials, args.output, args.format)
+    if storage is not None:
+        storage.close()
+    print("{}: {} observations".format(pathname, rows))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+from collections import deque
+
+# undo/redo for Observations
+#
+# each change is a small command holding the serialized observation(s) it
+# touched, found again by stable ID (see ids.py), never by list index, so a
+# command still works after other observations were added or removed.
+# Undoing or redoing writes the opposite journal record, the same as any
+# other change, so it never makes Observations rewrite annotations.csv.
+# A command's fnames are the images it changed (to redraw them).
+
+# commands kept for undo
+HISTORY_LIMIT = 1000
+
+
+class Add:
+    """Add is the command for an observation which was added"""
+    def __init__(self, serial):
+        self.serial = serial
+        self.fname = serial['fname']
+        self.fnames = (self.fname,)
+
+    def undo(self, observations):
+        observations.remove_id(self.serial['id'], self.fname)
+
+    def redo(self, observations):
+        observations.add_serial(self.serial)
+
+
+class Remove:
+    """Remove is the command for an observation which was removed"""
+    def __init__(self, serial):
+        self.serial = serial
+        self.fname = serial['fname']
+        self.fnames = (self.fname,)
+
+    def undo(self, observations):
+        observations.add_serial(self.serial)
+
+    def redo(self, observations):
+        observations.remove_id(self.serial['id'], self.fname)
+
+
+class Edit:
+    """Edit is the command for an observation which was changed (species or place)"""
+    def __init__(self, before, after):
+        self.before = before
+        self.after = after
+        self.fname = after['fname']
+        self.fnames = (self.fname,)
+
+    def undo(self, observations):
+        observations.change_id(self.before['id'], self.fname, self.before)
+
+    def redo(self, observations):
+        observations.change_id(self.after['id'], self.fname, self.after)
+
+
+class Batch:
+    """Batch is several commands undone and redone as one (e.g. marks copied across a burst)"""
+    def __init__(self, commands):
+        self.commands = list(commands)
+        self.fnames = tuple(dict.fromkeys(command.fname for command in self.commands))
+        self.fname = self.fnames[0] if self.fnames else None
+
+    def undo(self, observations):
+        for command in reversed(self.commands):
+            command.undo(observations)
+
+    def redo(self, observations):
+        for command in self.commands:
+            command.redo(observations)
+
+
+class History:
+    """History is the undo and redo stacks of commands (Add, Remove, Edit, Batch)
+
+    record(), undo() and redo() are O(1), the oldest commands are forgotten
+    after limit.
+    """
+    def __init__(self, limit=HISTORY_LIMIT):
+        """__init__(self, limit=HISTORY_LIMIT)"""
+        self.done = deque(maxlen=limit)
+        self.undone = []
+
+    def record(self, command):
+        """record(self, command) - remember a change (a new change can't be redone over)"""
+        self.done.append(command)
+        self.undone.clear()
+
+    def undo(self, observations):
+        """undo(self, observations) - undo the last change, returns its command (None if there is none)"""
+        if not self.done:
+            return None
+        command = self.done.pop()
+        command.undo(observations)
+        self.undone.append(command)
+        return command
+
+    def redo(self, observations):
+        """redo(self, observations) - redo the last undone change, returns its command (None if there is none)"""
+        if not self.undone:
+            return None
+        command = self.undone.pop()
+        command.redo(observations)
+        self.done.append(command)
+        return command
+
+    def clear(self):
+        """clear(self) - forget every change"""
+        self.done.clear()
+        self.undone.clear()
@@ -0,0 +1,72 @@
+import hashlib
+import os
+import string
+
+# stable observation IDs
+#
+# every observation gets an ID when it is made (16 hex digits, 64 random
+# bits) which it keeps through saves, loads, storages and merges of other
+# annotators' logs.  Rows saved before there were IDs get one derived from
+# their contents, so everybody reading the same old file agrees on it.
+
+ID_DIGITS = 16
+HEX_DIGITS = frozenset(string.hexdigits)
+
+
+def new_id():
+    """new_id() - a new random observation ID"""
+    return os.urandom(ID_DIGITS // 2).hex()
+
+
+def legacy_id(fname, species, x, y, occurrence=0):
+    """legacy_id(fname, species, x, y, occurrence=0) - the ID of a row saved without one
+    occurrence tells repeated rows (same image, species and place) apart, the
+    path is left out (a shared folder is mounted in different places)
+    """
+    key = '{}\x1f{}\x1f{}\x1f{}'.format(fname, species, int(x or 0), int(y or 0))
+    if occurrence:
+        key += '\x1f{}'.format(occurrence)
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=ID_DIGITS // 2).hexdigest()
+
+
+class LegacyIds:
+    """LegacyIds hands out legacy IDs to the rows of one file, in file order
+
+    the second row with the same image, species and place gets occurrence 1
+    and so on, so duplicated rows keep separate IDs.
+    """
+    def __init__(self):
+        self.seen = {}
+
+    def id(self, fname, species, x, y):
+        """id(self, fname, species, x, y) - the legacy ID of the next row like this"""
+        key = (fname, species, int(x or 0), int(y or 0))
+        occurrence = self.seen.get(key, 0)
+        self.seen[key] = occurrence + 1
+        return legacy_id(fname, species, x, y, occurrence)
+
+
+def ensure_id(serial, legacy=None):
+    """ensure_id(serial, legacy=None) - give a serialized observation its legacy ID if it has none
+    (from a LegacyIds when rows of a whole file are given IDs), returns the ID
+    """
+    observation_id = serial.get('id')
+    if not observation_id:
+        if legacy is not None:
+            observation_id = legacy.id(serial['fname'], serial['species'], serial['x'], serial['y'])
+        else:
+            observation_id = legacy_id(serial['fname'], serial['species'], serial['x'], serial['y'])
+        serial['id'] = observation_id
+    return observation_id
+
+
+def id_number(observation_id):
+    """id_number(observation_id) - the ID as an int (for compact storage), None if it is not one of ours"""
+    if len(observation_id) != ID_DIGITS or not HEX_DIGITS.issuperset(observation_id):
+        return None
+    return int(observation_id, 16)
+
+
+def id_text(number):
+    """id_text(number) - inverse of id_number"""
+    return format(number, '0{}x'.format(ID_DIGITS))
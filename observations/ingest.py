@@ -0,0 +1,102 @@
+"""ingest - headless EXIF pre-extraction for camera folders
+
+usage: python -m observations.ingest [--workers N] [--recursive] [--force] FOLDER [FOLDER ...]
+
+walks the folders, extracts DateTimeOriginal, image size and the camera ID=
+from the UserComment of every new or changed image on all cores, and writes
+the per-folder EXIF sidecar (.exif_cache.csv) which Image/ImageRegistry reads,
+so the marker program never has to parse EXIF itself.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .exifcache import ExifCache, read_exif, file_signature
+from .scanner import FolderScanner
+
+
+def extract(pathname):
+    """extract(pathname) - (signature, metadata) of one image, metadata is None on failure
+    (top level function so it can run in a worker process)
+    """
+    signature = file_signature(pathname)
+    try:
+        metadata = read_exif(pathname)
+    except Exception:
+        metadata = None
+    return signature, metadata
+
+
+def group_by_directory(path, names):
+    """group_by_directory(path, names) - directory -> list of fnames for relative names"""
+    groups = {}
+    for name in names:
+        directory, fname = os.path.split(os.path.join(path, name))
+        groups.setdefault(directory, []).append(fname)
+    return groups
+
+
+def ingest_folder(path, executor, recursive=False, force=False, chunksize=16):
+    """ingest_folder(path, executor, recursive=False, force=False, chunksize=16)
+    extract EXIF for the images of one folder (tree) which are not in its sidecar yet
+    returns (images seen, images extracted, failures)
+    """
+    scanner = FolderScanner(recursive=recursive, exif_cache_for=ExifCache)
+    names = scanner.scan(path)
+    seen = extracted = failed = 0
+    for directory, fnames in group_by_directory(path, names).items():
+        cache = ExifCache(directory)
+        todo = []
+        for fname in fnames:
+            entry = cache.entries.get(fname)
+            if force or entry is None or entry[0] != file_signature(os.path.join(directory, fname)):
+                todo.append(fname)
+        pathnames = [os.path.join(directory, fname) for fname in todo]
+        results = executor.map(extract, pathnames, chunksize=chunksize)
+        for fname, (signature, metadata) in zip(todo, results):
+            if metadata is None:
+                failed += 1
+            else:
+                cache.update(fname, signature, metadata)
+                extracted += 1
+        cache.save()
+        seen += len(fnames)
+    return seen, extracted, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m observations.ingest',
+                                     description='pre-extract EXIF metadata for camera folders')
+    parser.add_argument('folders', nargs='+', help='camera folder(s) to ingest')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes (default: all cores)')
+    parser.add_argument('--recursive', action='store_true', help='include sub folders')
+    parser.add_argument('--force', action='store_true', help='re-read images already in the index')
+    args = parser.parse_args(argv)
+
+    total_seen = total_extracted = total_failed = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for folder in args.folders:
+            if not os.path.isdir(folder):
+                print("skipping {} (not a folder)".format(folder))
+                continue
+            folder_start = time.perf_counter()
+            seen, extracted, failed = ingest_folder(folder, executor, args.recursive, args.force)
+            elapsed = time.perf_counter() - folder_start
+            print("{}: {} images, {} extracted, {} failed, {:.1f} images/s".format(
+                folder, seen, extracted, failed, extracted / elapsed if elapsed else 0.0))
+            total_seen += seen
+            total_extracted += extracted
+            total_failed += failed
+    elapsed = time.perf_counter() - start
+    print("total: {} images, {} extracted, {} failed in {:.1f}s ({:.1f} images/s)".format(
+        total_seen, total_extracted, total_failed, elapsed,
+        total_extracted / elapsed if elapsed else 0.0))
+    return 1 if total_failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
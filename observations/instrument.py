@@ -0,0 +1,238 @@
+import functools
+import itertools
+import json
+import os
+import platform
+import threading
+import time
+from array import array
+
+# opt-in timing of hot paths
+#
+# durations go into a fixed size ring buffer (parallel arrays, no objects per
+# event), so recording is cheap enough to leave on in the field.  With the
+# recorder disabled (the default) a timed function costs one attribute check.
+# Set MADDY_TRACE=1 in the environment (or call recorder.enable()) to turn it on.
+
+RING_SIZE = 8192
+# session traces are written here (Chrome trace event JSON, open in
+# chrome://tracing or ui.perfetto.dev)
+TRACE_DIRNAME = os.path.join(os.path.expanduser('~'), '.maddy_traces')
+
+
+def percentile(values, fraction):
+    """percentile(values, fraction) - nearest rank percentile of a sorted list"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+class Recorder:
+    """Recorder keeps the last capacity timed events in a ring buffer
+
+    each event is (name code, start, duration, thread), start is seconds since
+    the recorder was made.  Safe to record from worker threads (e.g. prefetch).
+    """
+    def __init__(self, capacity=RING_SIZE, enabled=False):
+        """__init__(self, capacity=RING_SIZE, enabled=False)"""
+        self.capacity = capacity
+        self.enabled = enabled
+        self.names = []
+        self.codes = {}
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+        self.wall_origin = time.time()
+        self.reset()
+
+    def reset(self):
+        """reset(self) - forget recorded events"""
+        self.code = array('i', [-1]) * self.capacity
+        self.start = array('d', [0.0]) * self.capacity
+        self.duration = array('d', [0.0]) * self.capacity
+        self.thread = array('q', [0]) * self.capacity
+        self.counter = itertools.count()
+        self.recorded = 0
+
+    def enable(self, enabled=True):
+        """enable(self, enabled=True) - turn recording on (or off)"""
+        self.enabled = enabled
+
+    def name_code(self, name):
+        code = self.codes.get(name)
+        if code is None:
+            with self.lock:
+                code = self.codes.get(name)
+                if code is None:
+                    code = len(self.names)
+                    self.names.append(name)
+                    self.codes[name] = code
+        return code
+
+    def record(self, name, start, duration):
+        """record(self, name, start, duration) - store one event (start from time.perf_counter)"""
+        # next() on itertools.count is atomic, so threads get their own slots
+        number = next(self.counter)
+        slot = number % self.capacity
+        self.code[slot] = self.name_code(name)
+        self.start[slot] = start - self.origin
+        self.duration[slot] = duration
+        self.thread[slot] = threading.get_ident()
+        self.recorded = number + 1
+
+    def span(self, name):
+        """span(self, name) - context manager which times its block as name"""
+        if not self.enabled:
+            return NO_SPAN
+        return Span(self, name)
+
+    def events(self):
+        """events(self) - list of (name, start, duration, thread) oldest first"""
+        count = min(self.recorded, self.capacity)
+        first = self.recorded - count
+        events = []
+        for number in range(first, self.recorded):
+            slot = number % self.capacity
+            code = self.code[slot]
+            if code >= 0:
+                events.append((self.names[code], self.start[slot], self.duration[slot], self.thread[slot]))
+        return events
+
+    def stats(self):
+        """stats(self) - {name: (count, p50, p95, max)} in seconds over the ring"""
+        durations = {}
+        for name, start, duration, thread in self.events():
+            durations.setdefault(name, []).append(duration)
+        stats = {}
+        for name, values in durations.items():
+            values.sort()
+            stats[name] = (len(values), percentile(values, 0.5), percentile(values, 0.95), values[-1])
+        return stats
+
+    def format_stats(self):
+        """format_stats(self) - lines of "name  n  p50  p95" (milliseconds) sorted by name"""
+        lines = []
+        for name, (count, p50, p95, longest) in sorted(self.stats().items()):
+            lines.append('{:<18} {:>5}  p50 {:>7.1f}  p95 {:>7.1f} ms'.format(
+                name, count, p50 * 1000, p95 * 1000))
+        return lines
+
+    def dump(self, pathname=None):
+        """dump(self, pathname=None) - write the ring as a Chrome trace event JSON file
+        default pathname is TRACE_DIRNAME/trace-<date>-<time>-<pid>.json, returns the pathname
+        """
+        if pathname is None:
+            os.makedirs(TRACE_DIRNAME, exist_ok=True)
+            pathname = os.path.join(TRACE_DIRNAME, 'trace-{}-{}.json'.format(
+                time.strftime('%Y%m%d-%H%M%S', time.localtime(self.wall_origin)), os.getpid()))
+        pid = os.getpid()
+        trace = {
+            'traceEvents': [{'name': name, 'ph': 'X', 'pid': pid, 'tid': thread,
+                             'ts': round(start * 1e6, 1), 'dur': round(duration * 1e6, 1)}
+                            for name, start, duration, thread in self.events()],
+            'displayTimeUnit': 'ms',
+            'otherData': {
+                'session_start': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.wall_origin)),
+                'platform': platform.platform(),
+                'python': platform.python_version(),
+                'recorded': self.recorded,
+                'capacity': self.capacity,
+            },
+        }
+        with open(pathname, 'w') as f:
+            json.dump(trace, f)
+        return pathname
+
+
+class Span:
+    """Span times a with block into a Recorder"""
+    __slots__ = ('recorder', 'name', 'begin')
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.begin = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder.record(self.name, self.begin, time.perf_counter() - self.begin)
+        return False
+
+
+class NoSpan:
+    """NoSpan is the do-nothing span handed out while recording is off"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NO_SPAN = NoSpan()
+
+# the shared recorder
+recorder = Recorder(enabled=os.environ.get('MADDY_TRACE', '') not in ('', '0'))
+
+
+def timed(name):
+    """timed(name) - decorator which records the duration of each call as name"""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not recorder.enabled:
+                return function(*args, **kwargs)
+            begin = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                recorder.record(name, begin, time.perf_counter() - begin)
+        return wrapper
+    return decorate
+
+
+class LatencyOverlay:
+    """LatencyOverlay draws p50/p95 per operation in a corner of a guizero Drawing
+
+    draw() deletes the overlay's own canvas items and draws them again, on top of
+    everything else.  MarkerLayer leaves the items alone (it lowers a new image
+    under them), but markers drawn later would cover it, so call draw() after a
+    new image or batch of markers as well as on a timer.  Nothing is drawn while hidden.
+    """
+    def __init__(self, canvas, recorder=recorder, x=8, y=8, line_height=16):
+        """__init__(self, canvas, recorder=recorder, x=8, y=8, line_height=16)"""
+        self.canvas = canvas
+        self.recorder = recorder
+        self.x = x
+        self.y = y
+        self.line_height = line_height
+        self.visible = False
+        self.shapes = []
+
+    def toggle(self):
+        """toggle(self) - show or hide the overlay (showing turns recording on)"""
+        self.visible = not self.visible
+        if self.visible:
+            self.recorder.enable()
+        self.draw()
+        return self.visible
+
+    def erase(self):
+        for shape in self.shapes:
+            self.canvas.delete(shape)
+        self.shapes = []
+
+    def draw(self):
+        """draw(self) - (re)draw the overlay with the current statistics"""
+        self.erase()
+        if not self.visible:
+            return
+        lines = self.recorder.format_stats() or ['no timings yet']
+        height = self.line_height * len(lines) + 8
+        self.shapes.append(self.canvas.rectangle(self.x, self.y, self.x + 430, self.y + height,
+                                                 color="black"))
+        for number, line in enumerate(lines):
+            self.shapes.append(self.canvas.text(self.x + 6, self.y + 4 + number * self.line_height,
+                                                line, color="yellow", font="Courier", size=10))
@@ -0,0 +1,159 @@
+import csv
+import os
+import shutil
+
+# the journal lives next to the annotations file e.g. annotations.csv.journal
+JOURNAL_SUFFIX = '.journal'
+
+# journal operations
+APPEND = '+'
+REMOVE = '-'
+
+
+class Journal:
+    """Journal is an append-only write-ahead log of observation changes
+
+    Each change is one small CSV record: the operation (APPEND or REMOVE)
+    followed by the serialized observation, so the cost of a save depends on
+    the size of the change rather than the size of the dataset.
+    Records are flushed as they are written and fsynced by sync(), which the
+    owner calls off the UI thread (Observations.save on the I/O thread) once
+    sync_every records are due.  compact() in Observations folds the journal
+    back into the annotations file and truncates it.
+    """
+    def __init__(self, pathname, fieldnames, sync_every=20):
+        """__init__(self, pathname, fieldnames, sync_every=20)"""
+        self.pathname = pathname
+        self.fieldnames = list(fieldnames)
+        self.sync_every = sync_every
+        self.pending = 0
+        self.count = 0
+        self.file = None
+        self.writer = None
+
+    def open(self):
+        """open(self) - open the journal for appending"""
+        if self.file is None:
+            self.file = open(self.pathname, 'a', newline='')
+            self.writer = csv.writer(self.file)
+        return self.file
+
+    def record(self, op, serial):
+        """record(self, op, serial) - append one operation record"""
+        self.open()
+        self.writer.writerow([op] + [serial.get(field, '') for field in self.fieldnames])
+        self.file.flush()
+        self.count += 1
+        self.pending += 1
+
+    @property
+    def due(self):
+        """True once sync_every records are waiting for sync()"""
+        return self.pending >= self.sync_every
+
+    def sync(self):
+        """sync(self) - force written records to disk"""
+        if self.file is not None and self.pending:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        self.pending = 0
+
+    def sync_descriptor(self):
+        """sync_descriptor(self) - flush, and return a duplicate file descriptor to fsync
+        later with finish_sync (e.g. after letting go of a lock), None if nothing is pending
+        """
+        descriptor = None
+        if self.file is not None and self.pending:
+            self.file.flush()
+            descriptor = os.dup(self.file.fileno())
+        self.pending = 0
+        return descriptor
+
+    def read(self):
+        """read(self) - return a list of (op, serial) records found on disk
+        a torn (partially written) last record is skipped, records written
+        before a field was added are shorter and get '' for the missing fields
+        """
+        records = []
+        try:
+            with open(self.pathname, 'r', newline='') as f:
+                lines = f.read().splitlines(True)
+        except OSError:
+            lines = []
+        if lines and not lines[-1].endswith('\n'):
+            # the last write did not finish
+            lines.pop()
+        width = len(self.fieldnames) + 1
+        for row in csv.reader(lines):
+            if not row or len(row) > width or row[0] not in (APPEND, REMOVE):
+                continue
+            row = row + [''] * (width - len(row))
+            records.append((row[0], dict(zip(self.fieldnames, row[1:]))))
+        self.count = len(records)
+        return records
+
+    def repair(self):
+        """repair(self) - cut off a torn last record (a crash in the middle of a write),
+        so records appended later start on a line of their own
+        """
+        if self.file is not None:
+            return
+        try:
+            with open(self.pathname, 'rb+') as f:
+                data = f.read()
+                if data and not data.endswith(b'\n'):
+                    f.truncate(data.rfind(b'\n') + 1)
+        except OSError:
+            pass
+
+    def move_to(self, pathname):
+        """move_to(self, pathname) - move the records to another journal file (added at its
+        end if it exists) and start again empty, returns the number of records moved
+        """
+        self.close(sync=False)
+        moved = self.count
+        if os.path.exists(self.pathname):
+            if os.path.exists(pathname):
+                with open(self.pathname, 'rb') as source, open(pathname, 'ab') as target:
+                    shutil.copyfileobj(source, target)
+                os.remove(self.pathname)
+            else:
+                os.replace(self.pathname, pathname)
+        self.count = 0
+        return moved
+
+    def truncate(self):
+        """truncate(self) - empty the journal (after compaction)"""
+        self.close()
+        if os.path.exists(self.pathname):
+            os.remove(self.pathname)
+        self.count = 0
+
+    def close(self, sync=True):
+        """close(self, sync=True) - sync and close the journal file"""
+        if self.file is not None:
+            if sync:
+                self.sync()
+            self.pending = 0
+            self.file.close()
+            self.file = None
+            self.writer = None
+
+
+def finish_sync(descriptor):
+    """finish_sync(descriptor) - fsync and close a descriptor from Journal.sync_descriptor (None is ignored)"""
+    if descriptor is not None:
+        try:
+            os.fsync(descriptor)
+        finally:
+            os.close(descriptor)
+
+
+def sync_file(pathname):
+    """sync_file(pathname) - fsync a file which is not open (nothing happens if it doesn't exist)"""
+    try:
+        f = open(pathname, 'rb+')
+    except FileNotFoundError:
+        return
+    with f:
+        os.fsync(f.fileno())
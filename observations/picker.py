@@ -0,0 +1,107 @@
+import tkinter
+from tkinter import simpledialog
+
+from .vocabulary import clean
+
+# the species dialog of the marker GUI (instead of askstring)
+
+
+class SpeciesDialog(simpledialog.Dialog):
+    """SpeciesDialog asks for the species of a mark, with completion and hotkeys
+
+    pressing a species' hotkey in the empty box picks it straight away.
+    Typing lists the species whose name, alias or a word in it starts with the
+    text, Up/Down move through them and Enter picks the highlighted one (with
+    nothing highlighted Enter adds what was typed as a new species).
+    self.result is the species name, None if cancelled.
+    """
+    def __init__(self, parent, vocabulary, title="Species", limit=10):
+        """__init__(self, parent, vocabulary, title="Species", limit=10) - parent is a tkinter widget (app.tk)"""
+        self.vocabulary = vocabulary
+        self.limit = limit
+        # species IDs listed, in listbox order
+        self.shown = []
+        self.picked = None
+        simpledialog.Dialog.__init__(self, parent, title)
+
+    def body(self, master):
+        keys = ['{} {}'.format(key, self.vocabulary[species_id])
+                for key, species_id in sorted(self.vocabulary.hotkeys.items())]
+        if keys:
+            tkinter.Label(master, text='  '.join(keys), justify='left', wraplength=320).pack(anchor='w')
+        self.entry = tkinter.Entry(master, width=40)
+        self.entry.pack(fill='x')
+        self.choices = tkinter.Listbox(master, height=self.limit, width=40, exportselection=False)
+        self.choices.pack(fill='both', expand=True)
+        self.note = tkinter.Label(master, text='', anchor='w')
+        self.note.pack(fill='x')
+        self.entry.bind('<Key>', self.hotkey)
+        self.entry.bind('<KeyRelease>', self.typed)
+        self.entry.bind('<Down>', lambda event: self.move(1))
+        self.entry.bind('<Up>', lambda event: self.move(-1))
+        self.choices.bind('<Double-Button-1>', self.ok)
+        self.fill()
+        return self.entry
+
+    def hotkey(self, event):
+        """a hotkey pressed in the empty box picks its species"""
+        if event.char and not self.entry.get():
+            species_id = self.vocabulary.by_hotkey(event.char)
+            if species_id is None:
+                # Caps Lock on
+                species_id = self.vocabulary.by_hotkey(event.char.lower())
+            if species_id is not None:
+                self.picked = species_id
+                self.ok()
+                return 'break'
+        return None
+
+    def typed(self, event):
+        if event.keysym not in ('Up', 'Down', 'Return', 'Escape'):
+            self.fill()
+
+    def fill(self):
+        """fill(self) - list the species completing the text, the first one highlighted"""
+        text = self.entry.get()
+        self.shown = self.vocabulary.complete(text, self.limit) if clean(text) else []
+        self.choices.delete(0, 'end')
+        for species_id in self.shown:
+            key = self.vocabulary.hotkey_of(species_id)
+            self.choices.insert('end', '{} {}'.format(key or ' ', self.vocabulary[species_id]))
+        self.select(0 if self.shown else None)
+
+    def select(self, position):
+        self.choices.selection_clear(0, 'end')
+        if position is not None:
+            self.choices.selection_set(position)
+            self.choices.see(position)
+            self.note.config(text='')
+        elif clean(self.entry.get()):
+            self.note.config(text='Enter adds "{}"'.format(clean(self.entry.get())))
+        else:
+            self.note.config(text='')
+
+    def move(self, step):
+        """move(self, step) - highlight the next (1) or previous (-1) species, above the first is none"""
+        selection = self.choices.curselection()
+        position = selection[0] + step if selection else (0 if step > 0 else None)
+        if position is not None and position < 0:
+            position = None
+        elif position is not None and position >= len(self.shown):
+            position = len(self.shown) - 1 if self.shown else None
+        self.select(position)
+        return 'break'
+
+    def apply(self):
+        if self.picked is not None:
+            self.result = self.vocabulary[self.picked]
+            return
+        text = clean(self.entry.get())
+        known = self.vocabulary.lookup(text) if text else None
+        selection = self.choices.curselection()
+        if known is not None:
+            self.result = self.vocabulary[known]
+        elif selection:
+            self.result = self.vocabulary[self.shown[selection[0]]]
+        else:
+            self.result = text or None
@@ -0,0 +1,183 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Pillow is optional (guizero[images] installs it), without it images are
+# shown straight from their pathname as before
+try:
+    from PIL import Image as PILImage
+except ImportError:
+    PILImage = None
+
+from .instrument import timed
+from .transform import DisplayTransform, STRETCH
+
+DISPLAY_WIDTH = 1024
+DISPLAY_HEIGHT = 768
+# memory budget of the decoded image cache
+CACHE_BYTES = 256 * 1024 * 1024
+
+
+def fit_picture(picture, width, height, fit=STRETCH, native_size=None):
+    """fit_picture(picture, width, height, fit=STRETCH, native_size=None) - fit a PIL image
+    to the display, STRETCH fills it, LETTERBOX keeps the aspect ratio of
+    native_size (default picture.size) and centres the image on black
+    """
+    if fit == STRETCH:
+        if picture.size != (width, height):
+            picture = picture.resize((width, height), PILImage.BILINEAR)
+        return picture
+    native_width, native_height = native_size or picture.size
+    left, top, box_width, box_height = DisplayTransform(native_width, native_height,
+                                                        width, height, fit).box()
+    if picture.size != (box_width, box_height):
+        picture = picture.resize((box_width, box_height), PILImage.BILINEAR)
+    if (box_width, box_height) == (width, height):
+        return picture
+    canvas = PILImage.new('RGB', (width, height))
+    canvas.paste(picture, (left, top))
+    return canvas
+
+
+@timed('image.decode')
+def decode_display(pathname, width=DISPLAY_WIDTH, height=DISPLAY_HEIGHT, fit=STRETCH):
+    """decode_display(pathname, width, height, fit=STRETCH) - return a display-ready PIL image
+    JPEGs are decoded at reduced scale (draft mode) before the final resize,
+    which is much cheaper than decoding a 12-20 MP original at full size.
+    """
+    picture = PILImage.open(pathname)
+    native_size = picture.size
+    picture.draft('RGB', (width, height))
+    picture = picture.convert('RGB')
+    return fit_picture(picture, width, height, fit, native_size)
+
+
+class DisplayCache:
+    """DisplayCache is a memory-bounded LRU cache of display-ready images
+
+    keyed by image pathname, the least recently used images are dropped once
+    the decoded size goes over max_bytes.  It is safe to fill from worker threads.
+    loader(pathname, width, height, fit) can replace decoding from the original
+    (e.g. previews.PreviewStore.load_display), decode_display is the fallback.
+    fit is how images are fitted to the display (transform.STRETCH or LETTERBOX).
+    """
+    def __init__(self, max_bytes=CACHE_BYTES, width=DISPLAY_WIDTH, height=DISPLAY_HEIGHT,
+                 fit=STRETCH):
+        """__init__(self, max_bytes=CACHE_BYTES, width=DISPLAY_WIDTH, height=DISPLAY_HEIGHT, fit=STRETCH)"""
+        self.max_bytes = max_bytes
+        self.width = width
+        self.height = height
+        self.fit = fit
+        self.loader = None
+        self.images = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        # pathname -> Future of a decode in progress (see Prefetcher)
+        self.pending = {}
+
+    def __contains__(self, pathname):
+        with self.lock:
+            return pathname in self.images
+
+    def decode(self, pathname):
+        """decode(self, pathname) - decode an image into the cache and return it"""
+        picture = None
+        if self.loader is not None:
+            try:
+                picture = self.loader(pathname, self.width, self.height, self.fit)
+            except Exception:
+                picture = None
+        if picture is None:
+            picture = decode_display(pathname, self.width, self.height, self.fit)
+        self.put(pathname, picture)
+        return picture
+
+    def put(self, pathname, picture):
+        """put(self, pathname, picture) - store a decoded image, evicting old ones"""
+        nbytes = picture.size[0] * picture.size[1] * len(picture.getbands())
+        with self.lock:
+            old = self.images.pop(pathname, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self.images[pathname] = (picture, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes and len(self.images) > 1:
+                _, (_, dropped) = self.images.popitem(last=False)
+                self.nbytes -= dropped
+
+    def get(self, pathname):
+        """get(self, pathname) - return the display image for pathname
+        waits for a prefetch already in flight, decodes on a miss.
+        Returns None if the image can't be decoded (or Pillow is missing)
+        """
+        if PILImage is None:
+            return None
+        with self.lock:
+            entry = self.images.get(pathname)
+            if entry is not None:
+                self.images.move_to_end(pathname)
+                return entry[0]
+            future = self.pending.get(pathname)
+        if future is not None:
+            try:
+                return future.result()
+            except Exception:
+                # cancelled or failed in the worker, try once more here
+                pass
+        try:
+            return self.decode(pathname)
+        except Exception:
+            return None
+
+    def clear(self):
+        """clear(self) - drop all cached images"""
+        with self.lock:
+            self.images.clear()
+            self.nbytes = 0
+
+
+class Prefetcher:
+    """Prefetcher decodes images into a DisplayCache on a thread pool
+
+    prefetch(files, pointer) queues the next and previous `ahead` files so the
+    decode has already happened by the time the user presses an arrow key.
+    """
+    def __init__(self, cache, ahead=3, workers=2):
+        """__init__(self, cache, ahead=3, workers=2)"""
+        self.cache = cache
+        self.ahead = ahead
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def submit(self, pathname):
+        """submit(self, pathname) - decode pathname in the background unless cached or queued"""
+        if PILImage is None or pathname in self.cache:
+            return None
+        with self.cache.lock:
+            future = self.cache.pending.get(pathname)
+            if future is None:
+                future = self.executor.submit(self._decode, pathname)
+                self.cache.pending[pathname] = future
+        return future
+
+    def _decode(self, pathname):
+        try:
+            return self.cache.decode(pathname)
+        finally:
+            with self.cache.lock:
+                self.cache.pending.pop(pathname, None)
+
+    def prefetch(self, pathnames, pointer):
+        """prefetch(self, pathnames, pointer) - queue neighbours of pathnames[pointer]
+        nearest first, alternating forward and backward, wrapping around like the viewer
+        """
+        count = len(pathnames)
+        if count == 0:
+            return
+        for step in range(1, self.ahead + 1):
+            for offset in (step, -step):
+                if abs(offset) < count:
+                    self.submit(pathnames[(pointer + offset) % count])
+
+    def shutdown(self):
+        """shutdown(self) - stop the worker threads (queued decodes are dropped)"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
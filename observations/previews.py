@@ -0,0 +1,175 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Pillow is optional, without it there are no previews and images are
+# decoded from the originals
+try:
+    from PIL import Image as PILImage
+except ImportError:
+    PILImage = None
+
+from .instrument import timed
+from .prefetch import fit_picture
+from .transform import STRETCH
+
+# previews are kept in a hidden folder next to annotations.csv
+PREVIEW_DIRNAME = '.previews'
+DISPLAY = 'display'
+THUMBNAIL = 'thumb'
+# (width, height) for each preview level; display previews are stretched to
+# the canvas size like Image.show, thumbnails keep their aspect ratio
+# (load_display letterboxes from the stretched preview when asked to)
+SIZES = {DISPLAY: (1024, 768), THUMBNAIL: (160, 120)}
+FORMATS = {'JPEG': '.jpg', 'WEBP': '.webp'}
+
+# one pool builds the previews of every PreviewStore, made on first use.
+# Threads, not processes: Pillow decodes and resizes without holding the GIL,
+# and a process pool would import the GUI module again in every worker on
+# platforms which spawn processes (macOS, Windows)
+executor = None
+executor_lock = threading.Lock()
+
+
+def preview_executor(workers=None):
+    """preview_executor(workers=None) - the shared preview pool (workers only counts the first time)"""
+    global executor
+    with executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 2,
+                                          thread_name_prefix='previews')
+        return executor
+
+
+def build_previews(pathname, targets, sizes=SIZES, fmt='JPEG', quality=85):
+    """build_previews(pathname, targets, sizes=SIZES, fmt='JPEG', quality=85)
+    decode pathname once and write one preview per level
+    targets is a dictionary of level -> preview pathname
+    (runs on the preview_executor threads)
+    """
+    picture = PILImage.open(pathname)
+    width, height = sizes[DISPLAY]
+    picture.draft('RGB', (width, height))
+    picture = picture.convert('RGB')
+    display = picture.resize((width, height), PILImage.BILINEAR)
+    for level, target in targets.items():
+        if level == DISPLAY:
+            preview = display
+        else:
+            preview = display.copy()
+            preview.thumbnail(sizes[level])
+        # write next to the target then rename so readers never see half a file
+        temp = '{}.{}-{}.tmp'.format(target, os.getpid(), threading.get_ident())
+        preview.save(temp, fmt, quality=quality)
+        os.replace(temp, target)
+    return pathname
+
+
+class PreviewStore:
+    """PreviewStore is a persistent pyramid of display and thumbnail previews
+
+    previews live in <folder>/.previews/<level>/<fname>.jpg and are rebuilt
+    when the original is newer (mtime) than its preview.  build() fills the
+    store in parallel on the preview_executor, load_display() is a drop-in loader
+    for prefetch.DisplayCache that reads the small preview instead of the original.
+    """
+    def __init__(self, path, sizes=SIZES, fmt='JPEG'):
+        """__init__(self, path, sizes=SIZES, fmt='JPEG')"""
+        self.path = path
+        self.root = os.path.join(path, PREVIEW_DIRNAME)
+        self.sizes = sizes
+        self.fmt = fmt
+        self.extension = FORMATS[fmt]
+        self.thread = None
+
+    def preview_path(self, fname, level=DISPLAY):
+        """preview_path(self, fname, level=DISPLAY) - pathname of a preview (may not exist)"""
+        return os.path.join(self.root, level, fname + self.extension)
+
+    def is_fresh(self, fname, level=DISPLAY):
+        """is_fresh(self, fname, level=DISPLAY) - True if the preview is up to date"""
+        try:
+            original = os.stat(os.path.join(self.path, fname)).st_mtime
+            preview = os.stat(self.preview_path(fname, level)).st_mtime
+        except OSError:
+            return False
+        return preview >= original
+
+    def get(self, fname, level=DISPLAY):
+        """get(self, fname, level=DISPLAY) - pathname of an up to date preview, or None"""
+        if self.is_fresh(fname, level):
+            return self.preview_path(fname, level)
+        return None
+
+    def thumbnail(self, fname):
+        """thumbnail(self, fname) - pathname of an up to date thumbnail, or None"""
+        return self.get(fname, THUMBNAIL)
+
+    def stale(self, fnames):
+        """stale(self, fnames) - list of fnames which need (re)building, in order"""
+        return [fname for fname in fnames
+                if not all(self.is_fresh(fname, level) for level in self.sizes)]
+
+    def targets(self, fname):
+        """targets(self, fname) - level -> preview pathname, creating folders as needed"""
+        targets = {}
+        for level in self.sizes:
+            target = self.preview_path(fname, level)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            targets[level] = target
+        return targets
+
+    def build(self, fnames, workers=None):
+        """build(self, fnames, workers=None) - build missing or stale previews
+        in parallel, in fnames order.  Returns the number of images processed.
+        """
+        if PILImage is None:
+            return 0
+        todo = self.stale(fnames)
+        if not todo:
+            return 0
+        built = 0
+        pool = preview_executor(workers)
+        jobs = []
+        for fname in todo:
+            try:
+                targets = self.targets(fname)
+            except OSError:
+                # e.g. a read-only folder, images are shown from the originals
+                break
+            jobs.append(pool.submit(build_previews, os.path.join(self.path, fname),
+                                    targets, self.sizes, self.fmt))
+        for job in jobs:
+            try:
+                job.result()
+                built += 1
+            except Exception:
+                # unreadable image, it will be shown from the original
+                pass
+        return built
+
+    def build_in_background(self, fnames, workers=None):
+        """build_in_background(self, fnames, workers=None) - run build() on a thread"""
+        self.thread = threading.Thread(target=self.build, args=(list(fnames), workers),
+                                       daemon=True)
+        self.thread.start()
+        return self.thread
+
+    @timed('image.preview')
+    def load_display(self, pathname, width=None, height=None, fit=STRETCH):
+        """load_display(self, pathname, width=None, height=None, fit=STRETCH) - return a display PIL image
+        from the preview if it is fresh, otherwise from the original (writing the preview)
+        """
+        fname = os.path.basename(pathname)
+        if not self.is_fresh(fname, DISPLAY):
+            build_previews(pathname, self.targets(fname), self.sizes, self.fmt)
+        picture = PILImage.open(self.preview_path(fname, DISPLAY))
+        picture.load()
+        width = width or picture.size[0]
+        height = height or picture.size[1]
+        native_size = None
+        if fit != STRETCH:
+            # the preview is stretched, the aspect ratio comes from the original's header
+            with PILImage.open(pathname) as original:
+                native_size = original.size
+        return fit_picture(picture, width, height, fit, native_size)
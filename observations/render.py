@@ -0,0 +1,94 @@
+from . import MARKER_SIZE, MARKER_COLOR
+from .instrument import recorder, timed
+
+# tags of the canvas items MarkerLayer owns
+MARKER_TAG = 'marker'
+PENDING_TAG = 'pending'
+
+
+class MarkerLayer:
+    """MarkerLayer draws an image and its markers on a guizero Drawing
+
+    the image (background) items are only replaced when another image is
+    shown, markers are tagged canvas items on top of it, so adding or removing
+    one marker touches one item instead of clearing and redrawing everything.
+    Other items on the canvas (e.g. the timing overlay) are left alone.
+    """
+    def __init__(self, canvas, size=MARKER_SIZE, color=MARKER_COLOR):
+        """__init__(self, canvas, size=MARKER_SIZE, color=MARKER_COLOR) - canvas is a guizero Drawing"""
+        self.canvas = canvas
+        # the tkinter Canvas under the Drawing, for tags and stacking order
+        self.tk = canvas.tk
+        self.size = size
+        self.color = color
+        self.image = None
+        self.background = []
+        # observation -> canvas item id
+        self.items = {}
+
+    def show(self, observations, filename, display_cache=None):
+        """show(self, observations, filename, display_cache=None) - show filename and its markers
+        returns the Image shown
+        """
+        image = observations.image_for(filename)
+        self.show_image(image, display_cache)
+        self.draw_markers(observations.get_by_filename(filename))
+        return image
+
+    @timed('image.show')
+    def show_image(self, image, display_cache=None):
+        """show_image(self, image, display_cache=None) - replace the background image"""
+        for item in self.background:
+            self.canvas.delete(item)
+        self.background = image.draw(self.canvas, display_cache)
+        # keep the background under the markers (lowest item last)
+        for item in reversed(self.background):
+            self.tk.tag_lower(item)
+        self.image = image
+
+    def draw_markers(self, observations):
+        """draw_markers(self, observations) - replace all markers with these, in one batch"""
+        with recorder.span('markers.draw'):
+            self.clear_markers()
+            for observation in observations:
+                self.add_marker(observation)
+
+    def oval(self, x, y, tag):
+        size = self.size
+        # same shape as Drawing.oval(color=...) - filled, no outline
+        return self.tk.create_oval(x - size, y, x + size, y + size,
+                                   fill=self.color, outline='', width=0, tags=(tag,))
+
+    def add_marker(self, observation):
+        """add_marker(self, observation) - draw the marker of one observation, returns its item id"""
+        self.remove_marker(observation)
+        x, y = observation.display_xy()
+        item = self.oval(x, y, MARKER_TAG)
+        self.items[observation] = item
+        return item
+
+    def remove_marker(self, observation):
+        """remove_marker(self, observation) - delete the marker of one observation
+        returns True if it was drawn
+        """
+        item = self.items.pop(observation, None)
+        if item is None:
+            return False
+        self.tk.delete(item)
+        return True
+
+    def clear_markers(self):
+        """clear_markers(self) - delete every marker (and pending mark)"""
+        self.tk.delete(MARKER_TAG)
+        self.tk.delete(PENDING_TAG)
+        self.items = {}
+
+    def add_pending(self, x, y):
+        """add_pending(self, x, y) - a temporary mark at display x,y (e.g. while asking for
+        the species), returns its item id for remove_item
+        """
+        return self.oval(x, y, PENDING_TAG)
+
+    def remove_item(self, item):
+        """remove_item(self, item) - delete a canvas item (e.g. a pending mark)"""
+        self.tk.delete(item)
@@ -0,0 +1,137 @@
+import os
+import bisect
+
+# image files we can mark (compared lower case)
+IMAGE_SUFFIXES = frozenset(['.jpg', '.jpeg', '.png'])
+
+
+def default_exif_cache(path):
+    """default_exif_cache(path) - the shared ExifCache for a folder (see ImageRegistry)"""
+    from . import image_registry
+    return image_registry.cache_for(path)
+
+
+class FolderScanner:
+    """FolderScanner lists the image files of a folder, fast and in a stable order
+
+    listings are made with os.scandir and cached by directory mtime, so a rescan
+    of an unchanged folder costs one stat, and a rescan after new images arrive
+    only looks at the difference (last_added / last_removed).
+    sort='name' sorts by filename, sort='datetime' by EXIF DateTimeOriginal
+    (from the EXIF cache, so only new files are parsed) then filename.
+    recursive=True includes sub folders, names are then relative to the top folder.
+    """
+    def __init__(self, suffixes=IMAGE_SUFFIXES, recursive=False, sort='name',
+                 exif_cache_for=default_exif_cache):
+        """__init__(self, suffixes=IMAGE_SUFFIXES, recursive=False, sort='name', exif_cache_for=default_exif_cache)"""
+        if sort not in ('name', 'datetime'):
+            raise ValueError("sort must be 'name' or 'datetime'")
+        self.suffixes = frozenset(suffix.lower() for suffix in suffixes)
+        self.recursive = recursive
+        self.sort = sort
+        self.exif_cache_for = exif_cache_for
+        # directory -> (mtime_ns, image names, sub directory names)
+        self.directories = {}
+        # top folder -> sorted listing (list of (key, name))
+        self.listings = {}
+        self.last_added = []
+        self.last_removed = []
+        # set when scan_directory had to read a directory again
+        self.changed = False
+
+    def is_image(self, name):
+        """is_image(self, name) - True if name has one of the image suffixes"""
+        return os.path.splitext(name)[1].lower() in self.suffixes
+
+    def scan_directory(self, directory):
+        """scan_directory(self, directory) - return (image names, sub directory names)
+        of one directory, reusing the cached entry while its mtime is unchanged
+        """
+        mtime = os.stat(directory).st_mtime_ns
+        cached = self.directories.get(directory)
+        if cached is not None and cached[0] == mtime:
+            return cached[1], cached[2]
+        self.changed = True
+        images = []
+        subdirs = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    # skip Mac thumbs and our own sidecars (.previews etc)
+                    continue
+                if entry.is_file() and self.is_image(entry.name):
+                    images.append(entry.name)
+                elif self.recursive and entry.is_dir():
+                    subdirs.append(entry.name)
+        self.directories[directory] = (mtime, images, subdirs)
+        return images, subdirs
+
+    def list_names(self, path):
+        """list_names(self, path) - set of image names under path (relative to path)"""
+        names = set()
+        pending = ['']
+        while pending:
+            relative = pending.pop()
+            images, subdirs = self.scan_directory(os.path.join(path, relative))
+            for name in images:
+                names.add(os.path.join(relative, name) if relative else name)
+            for name in subdirs:
+                pending.append(os.path.join(relative, name) if relative else name)
+        return names
+
+    def sort_key(self, path, name):
+        """sort_key(self, path, name) - sort key of one image"""
+        if self.sort == 'datetime':
+            directory, fname = os.path.split(os.path.join(path, name))
+            signature, metadata = self.exif_cache_for(directory).lookup(fname)
+            # undated images go last
+            return (metadata['datetime'] or '~', name)
+        return (name, name)
+
+    def scan(self, path):
+        """scan(self, path) - return the sorted list of image filenames in path"""
+        self.changed = False
+        names = self.list_names(path)
+        listing = self.listings.get(path)
+        if listing is not None and not self.changed:
+            # nothing was added or removed since the last scan
+            self.last_added = []
+            self.last_removed = []
+            return [name for key, name in listing]
+        if listing is None:
+            previous = set()
+            listing = []
+        else:
+            previous = set(name for key, name in listing)
+        added = sorted(names - previous)
+        removed = previous - names
+        if removed:
+            listing = [(key, name) for key, name in listing if name not in removed]
+        entries = [(self.sort_key(path, name), name) for name in added]
+        if len(entries) > 32:
+            # first scan or a big card dump, one sort is cheaper than many inserts
+            listing = sorted(listing + entries)
+        else:
+            for entry in entries:
+                bisect.insort(listing, entry)
+        if added and self.sort == 'datetime':
+            # remember EXIF parsed for new files
+            directories = set(os.path.dirname(os.path.join(path, name)) for name in added)
+            for directory in directories:
+                self.exif_cache_for(directory).save()
+        self.listings[path] = listing
+        self.last_added = added
+        self.last_removed = sorted(removed)
+        return [name for key, name in listing]
+
+
+# shared scanner so repeated scans of a folder are incremental
+scanner = FolderScanner()
+
+
+def get_image_filenames(imagepath, recursive=False, sort='name'):
+    """get_image_filenames(imagepath, recursive=False, sort='name') - return a sorted list of image filenames"""
+    global scanner
+    if scanner.recursive != recursive or scanner.sort != sort:
+        scanner = FolderScanner(recursive=recursive, sort=sort)
+    return scanner.scan(imagepath)
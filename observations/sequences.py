@@ -0,0 +1,137 @@
+import argparse
+import calendar
+import os
+import sys
+from array import array
+
+from .scanner import default_exif_cache, get_image_filenames
+
+# burst/sequence grouping
+#
+# a camera trap fires a burst of frames per trigger.  With the files sorted by
+# EXIF DateTimeOriginal (get_image_filenames(sort='datetime')), a sequence is a
+# run of frames from one camera no more than gap seconds apart.  Undated frames
+# are a sequence each.  Lookups are O(1): every position knows its sequence and
+# every sequence its first position.
+
+# seconds between two frames of one trigger event
+DEFAULT_GAP = 10
+
+
+def parse_datetime(text):
+    """parse_datetime(text) - seconds of an EXIF "YYYY:MM:DD HH:MM:SS" datetime, None if it isn't one"""
+    try:
+        date, clock = text.strip().split(' ', 1)
+        year, month, day = (int(part) for part in date.split(':'))
+        hour, minute, second = (int(part) for part in clock[:8].split(':'))
+        if not (1 <= month <= 12 and 1 <= day <= 31):
+            # e.g. 0000:00:00 00:00:00 from a camera with no clock set
+            return None
+        return calendar.timegm((year, month, day, hour, minute, second, 0, 0, 0))
+    except (AttributeError, ValueError):
+        return None
+
+
+class Sequences:
+    """Sequences groups a time ordered files list into trigger events
+
+    times[i] is the time (seconds) of files[i], None if it is undated.
+    cameras (optional) is a camera key per file, a new camera starts a new sequence.
+    Positions are indices into the files list (the viewer's file_pointer),
+    next_sequence and previous_sequence wrap around like the arrow keys.
+    """
+    def __init__(self, times, gap=DEFAULT_GAP, cameras=None):
+        """__init__(self, times, gap=DEFAULT_GAP, cameras=None)"""
+        if gap < 0:
+            raise ValueError("gap must not be negative")
+        self.gap = gap
+        # first position of each sequence, and len(times) at the end
+        self.starts = array('i')
+        # sequence number of each position
+        self.index = array('i')
+        previous = None
+        previous_camera = None
+        for position, when in enumerate(times):
+            camera = cameras[position] if cameras is not None else None
+            if when is None or previous is None or camera != previous_camera \
+                    or when < previous or when - previous > gap:
+                self.starts.append(position)
+            self.index.append(len(self.starts) - 1)
+            previous = when
+            previous_camera = camera
+        self.starts.append(len(times))
+
+    @classmethod
+    def for_folder(cls, folder, files=None, gap=DEFAULT_GAP, exif_cache_for=default_exif_cache):
+        """for_folder(cls, folder, files=None, gap=DEFAULT_GAP, exif_cache_for=default_exif_cache)
+        sequences of a folder's images, files is its list sorted by datetime
+        (listed with get_image_filenames(folder, sort='datetime') if None).
+        Datetimes come from the EXIF cache, only new files are parsed.
+        """
+        if files is None:
+            files = get_image_filenames(folder, sort='datetime')
+        times = []
+        cameras = []
+        caches = {}
+        for name in files:
+            directory, fname = os.path.split(os.path.join(folder, name))
+            cache = caches.get(directory)
+            if cache is None:
+                cache = caches[directory] = exif_cache_for(directory)
+            signature, metadata = cache.lookup(fname)
+            times.append(parse_datetime(metadata['datetime']))
+            cameras.append((directory, metadata['camera_id']))
+        for cache in caches.values():
+            cache.save()
+        return cls(times, gap, cameras)
+
+    def __len__(self):
+        return len(self.starts) - 1
+
+    def sequence(self, position):
+        """sequence(self, position) - the sequence number of a position"""
+        return self.index[position]
+
+    def frames(self, position):
+        """frames(self, position) - range of the positions in position's sequence"""
+        sequence = self.index[position]
+        return range(self.starts[sequence], self.starts[sequence + 1])
+
+    def next_sequence(self, position):
+        """next_sequence(self, position) - first position of the sequence after position's"""
+        if len(self.index) == 0:
+            return 0
+        start = self.starts[self.index[position] + 1]
+        return 0 if start == len(self.index) else start
+
+    def previous_sequence(self, position):
+        """previous_sequence(self, position) - first position of the sequence before position's"""
+        if len(self.index) == 0:
+            return 0
+        sequence = self.index[position] - 1
+        if sequence < 0:
+            sequence = len(self) - 1
+        return self.starts[sequence]
+
+    def lengths(self):
+        """lengths(self) - number of frames in each sequence"""
+        return [self.starts[sequence + 1] - self.starts[sequence] for sequence in range(len(self))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m observations.sequences',
+                                     description='group camera trap images into trigger events')
+    parser.add_argument('folders', nargs='+', help='image folder(s)')
+    parser.add_argument('--gap', type=float, default=DEFAULT_GAP,
+                        help='seconds between frames of one event (default {})'.format(DEFAULT_GAP))
+    args = parser.parse_args(argv)
+    for folder in args.folders:
+        sequences = Sequences.for_folder(folder, gap=args.gap)
+        lengths = sequences.lengths()
+        print("{}: {} images in {} sequences (longest {})".format(
+            folder, len(sequences.index), len(sequences), max(lengths) if lengths else 0))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
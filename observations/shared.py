@@ -0,0 +1,409 @@
+import csv
+import glob
+import json
+import os
+import re
+import time
+
+from . import csvdata
+from .ids import ensure_id, new_id
+from .journal import Journal, APPEND, REMOVE
+from .storage import CSVStorage, ObservationRow
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+# shared folders: several annotators mark one folder at the same time
+#
+# every annotator appends to their own log, annotations.csv.<annotator>.log,
+# and nobody else writes to it, so appending needs no lock.  A log starts with
+# a generation line and its records are a journal record plus a time stamp.
+# Loading reads annotations.csv and then every log from where it was last
+# folded in (annotations.csv.merged), and changes are merged by observation
+# ID, the latest change of an ID wins.  Compaction (folding the logs into
+# annotations.csv) holds an advisory lock on annotations.csv.lock.
+# refresh() only reads what was appended to the other logs since last time.
+
+LOG_SUFFIX = '.log'
+LOCK_SUFFIX = '.lock'
+MERGED_SUFFIX = '.merged'
+# first row of a log: GENERATION, <random id> (a new one when the log is emptied)
+GENERATION = 'g'
+# extra column of log records, when the change was made (time.time())
+STAMP = 'stamp'
+# an annotator's own log is emptied at compaction once it is this big (bytes)
+ROTATE_AFTER = 1 << 20
+
+ANNOTATOR_NAME = re.compile(r'^[A-Za-z0-9_-]+$')
+
+
+def log_pathname(pathname, annotator):
+    """log_pathname(pathname, annotator) - the log of annotator for annotations file pathname"""
+    if not ANNOTATOR_NAME.match(annotator or ''):
+        raise ValueError("annotator names can only have letters, digits, - and _ (not {!r})".format(annotator))
+    return '{}.{}{}'.format(pathname, annotator, LOG_SUFFIX)
+
+
+def shared_logs(pathname):
+    """shared_logs(pathname) - the annotator logs of annotations file pathname (sorted)"""
+    return sorted(glob.glob(glob.escape(pathname) + '.*' + LOG_SUFFIX))
+
+
+class FileLock:
+    """FileLock is an advisory lock held on a lock file, use it in a with block
+
+    fcntl.flock where there is fcntl, msvcrt.locking on Windows
+    (locking only waits about 10 seconds there, then raises OSError)
+    """
+    def __init__(self, pathname):
+        """__init__(self, pathname) - pathname of the lock file (made if missing)"""
+        self.pathname = pathname
+        self.file = None
+
+    def acquire(self):
+        """acquire(self) - wait for the lock"""
+        self.file = open(self.pathname, 'a+b')
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+            elif msvcrt is not None:
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+        except BaseException:
+            self.file.close()
+            self.file = None
+            raise
+
+    def release(self):
+        """release(self) - let the next waiter have the lock"""
+        if self.file is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+        return False
+
+
+class AnnotatorLog(Journal):
+    """AnnotatorLog is the Journal of one annotator (records have a STAMP column)
+
+    the file starts with a generation row, so readers can tell when it has
+    been emptied and started again.
+    """
+    def __init__(self, pathname, fieldnames, sync_every=20):
+        """__init__(self, pathname, fieldnames, sync_every=20) - fieldnames without STAMP"""
+        Journal.__init__(self, pathname, list(fieldnames) + [STAMP], sync_every)
+
+    def open(self):
+        """open(self) - open the log for appending, starting it if it is new"""
+        if self.file is None:
+            if not os.path.exists(self.pathname) or os.path.getsize(self.pathname) == 0:
+                self.start()
+            self.file = open(self.pathname, 'a', newline='', encoding='utf-8')
+            self.writer = csv.writer(self.file)
+        return self.file
+
+    def start(self):
+        """start(self) - replace the log by an empty one with a new generation"""
+        self.close()
+        temp = csvdata.temp_name(self.pathname)
+        with open(temp, 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerow([GENERATION, new_id()])
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, self.pathname)
+        csvdata.fsync_directory(os.path.dirname(self.pathname))
+        self.count = 0
+
+    def position(self):
+        """position(self) - (generation, size) of everything written so far, None if nothing was"""
+        if self.file is not None:
+            self.file.flush()
+        try:
+            with open(self.pathname, 'rb') as f:
+                generation = read_generation(f)
+                f.seek(0, os.SEEK_END)
+                return (generation, f.tell())
+        except FileNotFoundError:
+            return None
+
+
+def read_generation(f):
+    """read_generation(f) - the generation of a log open for binary reading, None if it is
+    still being started (f is left after the generation row)
+    """
+    header = f.readline()
+    if not header.endswith(b'\n'):
+        return None
+    row = next(csv.reader([header.decode('utf-8')]), [])
+    return row[1] if len(row) > 1 and row[0] == GENERATION else ''
+
+
+def read_log(pathname, fieldnames, position=None):
+    """read_log(pathname, fieldnames, position=None) - read a log from position
+    position is the (generation, offset) returned by the last read, None reads it all.
+    returns (records, position, restarted): records are (op, serial, stamp) of the
+    whole lines after position, restarted is True if the log was started again
+    since position was read (what was in it is now only in annotations.csv)
+    """
+    try:
+        f = open(pathname, 'rb')
+    except FileNotFoundError:
+        return [], position, False
+    with f:
+        generation = read_generation(f)
+        if generation is None:
+            return [], position, False
+        offset = f.tell()
+        restarted = False
+        if position is not None:
+            if position[0] == generation:
+                offset = max(offset, position[1])
+            else:
+                restarted = True
+        f.seek(offset)
+        data = f.read()
+    # a line being written right now is left for next time
+    end = data.rfind(b'\n') + 1
+    found = []
+    width = len(fieldnames) + 1
+    for row in csv.reader(data[:end].decode('utf-8').splitlines(True)):
+        if not row or len(row) > width or row[0] not in (APPEND, REMOVE):
+            continue
+        row = row + [''] * (width - len(row))
+        serial = dict(zip(fieldnames, row[1:]))
+        stamp = serial.pop(STAMP)
+        try:
+            stamp = float(stamp)
+        except ValueError:
+            stamp = 0.0
+        ensure_id(serial)
+        found.append((row[0], serial, stamp))
+    return found, (generation, offset + end), restarted
+
+
+class SharedStorage:
+    """SharedStorage is a storage backend (see storage.py) for a folder marked by several annotators
+
+    annotations.csv (kept by a CSVStorage, so writes are atomic and crash safe)
+    holds what has been folded in, the annotator's own changes go to their
+    AnnotatorLog.  positions remembers how far each log has been read, stamps
+    the time of the latest change seen for each ID (last writer wins).
+    annotator None only reads the folder (e.g. export), it has no log of its own.
+    """
+    incremental = True
+    rewrites = True
+
+    def __init__(self, pathname, fieldnames, annotator, compact_after=5000, rotate_after=ROTATE_AFTER):
+        """__init__(self, pathname, fieldnames, annotator, compact_after=5000, rotate_after=ROTATE_AFTER)"""
+        self.pathname = pathname
+        self.fieldnames = list(fieldnames)
+        self.annotator = annotator
+        # a single annotator journal left in the folder is folded in too
+        self.base = CSVStorage(pathname, self.fieldnames, journal=True, read_only=annotator is None)
+        self.log = AnnotatorLog(log_pathname(pathname, annotator), self.fieldnames) \
+            if annotator is not None else None
+        self.log_fieldnames = self.fieldnames + [STAMP]
+        self.lock = FileLock(pathname + LOCK_SUFFIX)
+        self.merged_pathname = pathname + MERGED_SUFFIX
+        self.compact_after = compact_after
+        self.rotate_after = rotate_after
+        # log filename -> (generation, offset) read so far
+        self.positions = {}
+        self.stamps = {}
+        # own records not folded into annotations.csv yet
+        self.unfolded = 0
+
+    @property
+    def pending(self):
+        """number of own log records which are not in annotations.csv yet"""
+        return self.unfolded
+
+    @property
+    def sync_due(self):
+        """True when a batch of own log records is waiting to be fsynced"""
+        return self.log is not None and self.log.due
+
+    @property
+    def recovered(self):
+        """what annotations.csv recovery did on the last load (see CSVStorage.recover)"""
+        return self.base.recovered
+
+    def log_pathnames(self):
+        """log_pathnames(self) - the logs of every annotator of the folder (own log first)"""
+        if self.log is None:
+            return shared_logs(self.pathname)
+        others = [pathname for pathname in shared_logs(self.pathname) if pathname != self.log.pathname]
+        return [self.log.pathname] + others
+
+    def other_log_pathnames(self):
+        """other_log_pathnames(self) - the logs of the other annotators"""
+        if self.log is None:
+            return self.log_pathnames()
+        return self.log_pathnames()[1:]
+
+    def read_merged(self):
+        """read_merged(self) - {log filename: (generation, offset)} folded into annotations.csv"""
+        try:
+            with open(self.merged_pathname, 'r', encoding='utf-8') as f:
+                return {name: tuple(position) for name, position in json.load(f).items()}
+        except (OSError, ValueError):
+            return {}
+
+    def write_merged(self, positions=None):
+        """write_merged(self, positions=None) - record positions (self.positions if None)
+        as folded into annotations.csv (atomically)
+        """
+        if positions is None:
+            positions = self.positions
+        temp = csvdata.temp_name(self.merged_pathname)
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(positions, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, self.merged_pathname)
+
+    def newer(self, observation_id, stamp):
+        """newer(self, observation_id, stamp) - True (and remember it) if a change at stamp
+        is the latest one seen for observation_id
+        """
+        if stamp < self.stamps.get(observation_id, 0.0):
+            return False
+        self.stamps[observation_id] = stamp
+        return True
+
+    def load(self, path=None):
+        """load(self, path=None) - return annotations.csv rows merged with every log"""
+        # the merged positions first: if annotations.csv is rewritten in between,
+        # records are applied twice, which changes nothing (merging is by ID)
+        merged = self.read_merged()
+        rows = {}
+        for serial in self.base.load():
+            rows[ensure_id(serial)] = serial
+        self.positions = {}
+        self.stamps = {}
+        self.unfolded = 0
+        for pathname in self.log_pathnames():
+            name = os.path.basename(pathname)
+            records, position, restarted = read_log(pathname, self.log_fieldnames, merged.get(name))
+            if position is not None:
+                self.positions[name] = position
+            if self.log is not None and pathname == self.log.pathname:
+                self.unfolded = len(records)
+            for op, serial, stamp in records:
+                if self.newer(serial['id'], stamp):
+                    if op == APPEND:
+                        rows[serial['id']] = serial
+                    else:
+                        rows.pop(serial['id'], None)
+        if self.log is not None:
+            self.log.count = self.unfolded
+        return list(rows.values())
+
+    def iter_compact(self, path=None):
+        """iter_compact(self, path=None) - the merged rows as ObservationRows"""
+        for serial in self.load(path):
+            yield ObservationRow.from_serial(serial)
+
+    def refresh(self):
+        """refresh(self) - read what other annotators logged since the last load or refresh
+        returns a list of (op, serial) changes to apply, or None if a log was
+        started again and everything has to be loaded again
+        """
+        changes = []
+        for pathname in self.other_log_pathnames():
+            name = os.path.basename(pathname)
+            records, position, restarted = read_log(pathname, self.log_fieldnames, self.positions.get(name))
+            if restarted:
+                return None
+            if position is not None:
+                self.positions[name] = position
+            for op, serial, stamp in records:
+                if self.newer(serial['id'], stamp):
+                    changes.append((op, serial))
+        return changes
+
+    def record(self, op, serial):
+        if self.log is None:
+            raise ValueError("{} is opened read only (no annotator)".format(self.pathname))
+        stamp = time.time()
+        self.stamps[serial['id']] = stamp
+        record = dict(serial)
+        record[STAMP] = repr(stamp)
+        self.log.record(op, record)
+        self.unfolded += 1
+
+    def append(self, serial):
+        """append(self, serial) - log a new observation"""
+        self.record(APPEND, serial)
+
+    def remove(self, serial):
+        """remove(self, serial) - log a deleted observation"""
+        self.record(REMOVE, serial)
+
+    def sync(self):
+        """sync(self) - fsync the own log"""
+        self.log.sync()
+
+    def begin_sync(self):
+        """begin_sync(self) - flush the own log, returns a descriptor for journal.finish_sync"""
+        return self.log.sync_descriptor()
+
+    def cut(self):
+        """cut(self) - what save() folds in: the logs as far as they have been read
+        (call it with the observations locked, see CSVStorage.cut)
+        """
+        return self.base.cut(), self.log.position(), dict(self.positions), self.unfolded
+
+    def save(self, serials, cut=None):
+        """save(self, serials, cut=None) - rewrite annotations.csv with serials, everything read
+        up to cut merged.  Hold self.lock and refresh first (see Observations.compact),
+        so no other annotator's change is lost
+        """
+        if cut is None:
+            cut = self.cut()
+        base_cut, position, positions, unfolded = cut
+        self.base.save(serials, base_cut)
+        if position is not None:
+            positions[os.path.basename(self.log.pathname)] = position
+        self.write_merged(positions)
+
+    def saved(self, cut):
+        """saved(self, cut) - after save(serials, cut), with the observations locked again
+        the own log is started again once it is big and everything in it is folded in
+        """
+        base_cut, position, positions, unfolded = cut
+        self.unfolded -= unfolded
+        if position is None:
+            return
+        name = os.path.basename(self.log.pathname)
+        self.positions[name] = position
+        if position[1] >= self.rotate_after and self.log.position() == position:
+            # nothing was logged during the save
+            self.log.start()
+            self.positions[name] = self.log.position()
+            self.write_merged()
+
+    def close(self):
+        """close(self) - close the own log"""
+        if self.log is not None:
+            self.log.close()
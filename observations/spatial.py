@@ -0,0 +1,107 @@
+# uniform grid spatial index for marker hit-testing on one image
+
+# cell size in display pixels, about twice the default click tolerance (15);
+# marks are stored in native pixels, so grids are made with native_cell_size()
+DEFAULT_CELL_SIZE = 32
+
+
+def native_cell_size(transform, cell_size=DEFAULT_CELL_SIZE):
+    """native_cell_size(transform, cell_size=DEFAULT_CELL_SIZE) - cell_size display pixels
+    in the native pixels of an image (transform is its DisplayTransform), so a click
+    tolerance circle touches about four cells whatever the camera resolution
+    """
+    return max(1, int(round(transform.native_tolerance(cell_size))))
+
+
+class GridIndex:
+    """GridIndex buckets observations into square cells by (x, y)
+
+    nearest() only looks at the cells that the tolerance circle touches, so
+    hit-testing costs O(marks near the click) rather than O(marks on the image).
+    Observations must not move while they are in the index (remove, edit, insert).
+    new_bucket makes the per-cell lists (e.g. columnar.RowList instead of list)
+    """
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE, new_bucket=list):
+        """__init__(self, cell_size=DEFAULT_CELL_SIZE, new_bucket=list) makes an empty grid"""
+        self.cell_size = cell_size
+        self.new_bucket = new_bucket
+        self.cells = {}
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def cell(self, x, y):
+        """cell(self, x, y) - return the (column, row) key of the cell holding x,y"""
+        return (int(x) // self.cell_size, int(y) // self.cell_size)
+
+    def insert(self, observation):
+        """insert(self, observation) - add an observation to the grid"""
+        key = self.cell(observation.x, observation.y)
+        bucket = self.cells.get(key)
+        if bucket is None:
+            bucket = self.new_bucket()
+            self.cells[key] = bucket
+        bucket.append(observation)
+        self.count += 1
+
+    def remove(self, observation):
+        """remove(self, observation) - take an observation out of the grid
+        returns True if it was found
+        """
+        key = self.cell(observation.x, observation.y)
+        bucket = self.cells.get(key)
+        if not bucket:
+            return False
+        for position, item in enumerate(bucket):
+            if item == observation:
+                del bucket[position]
+                if not bucket:
+                    del self.cells[key]
+                self.count -= 1
+                return True
+        return False
+
+    def nearest(self, x, y, tolerance):
+        """nearest(self, x, y, tolerance) - return the observation closest to x,y
+        within tolerance pixels, or None.  Uses squared distances (no sqrt).
+        """
+        limit = tolerance * tolerance
+        best = None
+        best_distance = None
+        col0, row0 = self.cell(x - tolerance, y - tolerance)
+        col1, row1 = self.cell(x + tolerance, y + tolerance)
+        for col in range(col0, col1 + 1):
+            for row in range(row0, row1 + 1):
+                for observation in self.cells.get((col, row), ()):
+                    dx = observation.x - x
+                    dy = observation.y - y
+                    distance = dx*dx + dy*dy
+                    if distance <= limit and (best is None or distance < best_distance):
+                        best = observation
+                        best_distance = distance
+        return best
+
+    def in_rect(self, x0, y0, x1, y1):
+        """in_rect(self, x0, y0, x1, y1) - return all observations inside the rectangle
+        (corners in any order, edges inclusive) e.g. for box selection
+        """
+        if x0 > x1:
+            x0, x1 = x1, x0
+        if y0 > y1:
+            y0, y1 = y1, y0
+        col0, row0 = self.cell(x0, y0)
+        col1, row1 = self.cell(x1, y1)
+        if (col1 - col0 + 1) * (row1 - row0 + 1) <= len(self.cells):
+            keys = [(col, row) for col in range(col0, col1 + 1)
+                               for row in range(row0, row1 + 1)]
+        else:
+            # the rectangle covers more cells than are occupied, walk occupied cells
+            keys = [key for key in self.cells
+                    if col0 <= key[0] <= col1 and row0 <= key[1] <= row1]
+        found = []
+        for key in keys:
+            for observation in self.cells.get(key, ()):
+                if x0 <= observation.x <= x1 and y0 <= observation.y <= y1:
+                    found.append(observation)
+        return found
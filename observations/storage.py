@@ -0,0 +1,570 @@
+import os
+import shutil
+import sqlite3
+import sys
+from collections import namedtuple
+
+from . import csvdata
+from .ids import legacy_id, ensure_id, LegacyIds
+from .journal import Journal, JOURNAL_SUFFIX, APPEND, REMOVE, sync_file
+from .transform import rows_to_native, NATIVE
+
+# storage backends for Observations
+#
+# a backend answers:
+#   load(path)       - rows (serialized observations) for one image folder
+#   append(serial)   - record a new observation (if incremental)
+#   remove(serial)   - record a deleted observation (if incremental)
+#   sync()           - make recorded changes durable
+#   begin_sync()     - sync() in two steps, returns a descriptor for journal.finish_sync (or None)
+#   sync_due         - True when enough changes wait for sync() that a save should run soon
+#   save(serials)    - write a complete set of rows for the folder
+#   close()
+# incremental is True when append/remove persist changes by themselves, then
+# Observations.save() only calls sync() until pending reaches compact_after.
+# rewrites is True when save() writes every row (a file), then Observations
+# calls cut() with the observations locked and save(serials, cut) and saved(cut)
+# around it without the lock, so changes made during the write are kept.
+
+# columns which are stored as integers
+INTEGER_FIELDS = ('x', 'y', 'width', 'height')
+
+# compact (typed) form of an observation row, pathname is rebuilt from path and fname
+COMPACT_FIELDS = ('species', 'x', 'y', 'fname', 'path', 'datetime', 'width', 'height', 'camera',
+                  'space', 'id')
+# repeated strings share one object
+INTERNED_FIELDS = ('species', 'fname', 'path', 'datetime', 'camera', 'space')
+
+
+def to_int(value):
+    """to_int(value) - int of a CSV value, 0 if blank"""
+    return int(value) if value not in ('', None) else 0
+
+
+COMPACT_TYPES = {field: to_int for field in INTEGER_FIELDS}
+
+
+class ObservationRow(namedtuple('ObservationRow', COMPACT_FIELDS)):
+    """ObservationRow is a compact, read-only observation row (no Image, no EXIF)"""
+    __slots__ = ()
+
+    @classmethod
+    def from_serial(cls, serial):
+        """from_serial(cls, serial) - make a compact row from a serialized observation"""
+        values = []
+        for field in COMPACT_FIELDS:
+            value = serial.get(field, '')
+            if field in INTEGER_FIELDS:
+                value = to_int(value)
+            elif value is None:
+                value = ''
+            else:
+                value = sys.intern(str(value))
+            values.append(value)
+        row = cls._make(values)
+        if not row.id:
+            row = row.with_id()
+        return row
+
+    def with_id(self, legacy=None):
+        """with_id(self, legacy=None) - the row with its legacy ID if it was saved without one
+        (legacy is the LegacyIds of the file being read)
+        """
+        if self.id:
+            return self
+        if legacy is not None:
+            return self._replace(id=legacy.id(self.fname, self.species, self.x, self.y))
+        return self._replace(id=legacy_id(self.fname, self.species, self.x, self.y))
+
+    def serialize(self):
+        """serialize(self) - return the row as a serialized observation (dictionary)"""
+        serial = self._asdict()
+        serial['pathname'] = os.path.join(self.path, self.fname)
+        return serial
+
+
+# crash recovery (see CSVStorage.recover)
+BACKUP_SUFFIX = '.bak'
+# the journal records a save is folding in, annotations.csv.journal.compacting
+COMPACTING_SUFFIX = '.compacting'
+DAMAGED_SUFFIX = '.damaged'
+RESTORED = 'restored'
+REPAIRED = 'repaired'
+
+
+def copy_atomic(source, target):
+    """copy_atomic(source, target) - copy a file so target is never seen half written"""
+    temp = csvdata.temp_name(target)
+    shutil.copyfile(source, temp)
+    with open(temp, 'rb+') as f:
+        os.fsync(f.fileno())
+    os.replace(temp, target)
+    csvdata.fsync_directory(os.path.dirname(target))
+
+
+def keep_backup(pathname, backup):
+    """keep_backup(pathname, backup) - make backup the current contents of pathname
+    a hard link when the file system has them (no copying), else a copy
+    """
+    temp = csvdata.temp_name(backup)
+    try:
+        os.link(pathname, temp)
+        os.replace(temp, backup)
+    except OSError:
+        copy_atomic(pathname, backup)
+
+
+def same_observation(row, serial):
+    """same_observation(row, serial) - True if two serialized rows are the same mark
+    (the same ID, or for journals written before IDs the same place and species)
+    """
+    if serial.get('id'):
+        return ensure_id(row) == serial['id']
+    return (row['fname'] == serial['fname'] and row['species'] == serial['species']
+            and int(row['x']) == int(serial['x']) and int(row['y']) == int(serial['y']))
+
+
+class CSVStorage:
+    """CSVStorage is the folder layout: annotations.csv plus an optional journal
+
+    with journal=True changes are appended to "annotations.csv.journal" and
+    folded back into annotations.csv by save() (compaction, a checkpoint).
+    cut() moves the journal aside (annotations.csv.journal.compacting) so new
+    changes can be journaled while save() writes, the moved records are
+    deleted once annotations.csv has them.  Records are applied by ID, the last
+    change of an ID wins, so applying them twice (a crash between the two
+    steps) changes nothing.
+    annotations.csv is replaced atomically and the previous version is kept as
+    "annotations.csv.bak"; recover() repairs the folder after a crash and runs
+    before every load.  read_only=True (e.g. export) never changes the folder,
+    a lost annotations.csv is read from the backup and a cut off row is skipped.
+    """
+    rewrites = True
+
+    def __init__(self, pathname, fieldnames, journal=False, compact_after=5000, read_only=False):
+        """__init__(self, pathname, fieldnames, journal=False, compact_after=5000, read_only=False)"""
+        self.pathname = pathname
+        self.read_only = read_only
+        self.fieldnames = list(fieldnames)
+        self.incremental = journal
+        self.journal = Journal(pathname + JOURNAL_SUFFIX, self.fieldnames)
+        self.compacting = Journal(self.journal.pathname + COMPACTING_SUFFIX, self.fieldnames)
+        self.compact_after = compact_after
+        self.backup = pathname + BACKUP_SUFFIX
+        # what the last recover() did (None, RESTORED or REPAIRED)
+        self.recovered = None
+
+    @property
+    def pending(self):
+        """number of journal records which are not in annotations.csv yet"""
+        return self.journal.count + self.compacting.count
+
+    @property
+    def sync_due(self):
+        """True when a batch of journal records is waiting to be fsynced"""
+        return self.incremental and self.journal.due
+
+    def recover(self):
+        """recover(self) - repair annotations.csv after a crash, returns RESTORED, REPAIRED or None
+        a leftover temporary file is removed, a missing or empty file is restored
+        from the backup, a file with a cut off last row loses that row (the
+        damaged file is kept as annotations.csv.damaged).  Nothing is done read only
+        """
+        self.recovered = None
+        if self.read_only:
+            return None
+        try:
+            # an atomic write that never got renamed, the old file is still whole.  Only
+            # our own (temp names have the pid), another process may be writing its one now
+            os.remove(csvdata.temp_name(self.pathname))
+        except OSError:
+            pass
+        state = csvdata.csv_state(self.pathname)
+        if state in (csvdata.MISSING, csvdata.EMPTY):
+            if csvdata.csv_state(self.backup) == csvdata.OK:
+                copy_atomic(self.backup, self.pathname)
+                self.recovered = RESTORED
+        elif state == csvdata.PARTIAL:
+            shutil.copy2(self.pathname, self.pathname + DAMAGED_SUFFIX)
+            with open(self.pathname, 'rb') as f:
+                data = f.read()
+            temp = csvdata.temp_name(self.pathname)
+            with open(temp, 'wb') as f:
+                f.write(data[:data.rfind(b'\n') + 1])
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp, self.pathname)
+            self.recovered = REPAIRED
+        self.journal.repair()
+        self.compacting.repair()
+        return self.recovered
+
+    def replay(self):
+        """replay(self) - the journal records as ({ID: (op, serial)}, removes)
+        the last change of each ID (in the order of last changes), and the
+        removes of journals written before IDs (matched by place and species)
+        """
+        changes = {}
+        removes = []
+        for op, serial in self.compacting.read() + self.journal.read():
+            if not serial.get('id'):
+                if op == REMOVE:
+                    removes.append(serial)
+                    continue
+                ensure_id(serial)
+            changes.pop(serial['id'], None)
+            changes[serial['id']] = (op, serial)
+        return changes, removes
+
+    def source(self):
+        """source(self) - the file to read rows from: annotations.csv, or the backup
+        when annotations.csv was lost and the folder is only read
+        """
+        if self.read_only and csvdata.csv_state(self.pathname) in (csvdata.MISSING, csvdata.EMPTY) \
+                and csvdata.csv_state(self.backup) == csvdata.OK:
+            return self.backup
+        return self.pathname
+
+    def load(self, path=None):
+        """load(self, path=None) - return rows of annotations.csv with the journal applied"""
+        self.recover()
+        rows = csvdata.read_csv(self.source())
+        if self.read_only:
+            # a cut off last row (recover() drops it from the file)
+            rows = [row for row in rows if None not in row.values()]
+        legacy = LegacyIds()
+        for row in rows:
+            ensure_id(row, legacy)
+        changes, removes = self.replay()
+        if changes:
+            rows = [row for row in rows if row['id'] not in changes]
+            rows.extend(serial for op, serial in changes.values() if op == APPEND)
+        for serial in removes:
+            for index in range(len(rows)):
+                if same_observation(rows[index], serial):
+                    del rows[index]
+                    break
+        return rows
+
+    def iter_compact(self, path=None):
+        """iter_compact(self, path=None) - stream ObservationRows with the journal applied
+        rows are typed and interned as they are read (see csvdata.iter_tuples)
+        """
+        self.recover()
+        changes, removes = self.replay()
+        appended = [ObservationRow.from_serial(serial) for op, serial in changes.values() if op == APPEND]
+        # journals written before IDs remove by place and species
+        removed = {}
+        for serial in removes:
+            row = ObservationRow.from_serial(serial)
+            key = (row.fname, row.species, row.x, row.y)
+            removed[key] = removed.get(key, 0) + 1
+        rows = csvdata.iter_tuples(self.source(), COMPACT_FIELDS, COMPACT_TYPES, INTERNED_FIELDS)
+        legacy = LegacyIds()
+        for values in rows:
+            row = ObservationRow._make(values).with_id(legacy)
+            if row.id in changes:
+                # the journal has the latest version (or removed it)
+                continue
+            if removed and self.is_removed(row, removed):
+                continue
+            yield row
+        for row in appended:
+            if removed and self.is_removed(row, removed):
+                continue
+            yield row
+
+    def is_removed(self, row, removed):
+        """is_removed(self, row, removed) - count row off removed (place key -> count)"""
+        key = (row.fname, row.species, row.x, row.y)
+        if removed.get(key):
+            removed[key] -= 1
+            return True
+        return False
+
+    def append(self, serial):
+        """append(self, serial) - journal a new observation"""
+        if self.incremental:
+            self.journal.record(APPEND, serial)
+
+    def remove(self, serial):
+        """remove(self, serial) - journal a deleted observation"""
+        if self.incremental:
+            self.journal.record(REMOVE, serial)
+
+    def sync(self):
+        """sync(self) - fsync the journal"""
+        self.journal.sync()
+
+    def begin_sync(self):
+        """begin_sync(self) - flush the journal, returns a descriptor for journal.finish_sync"""
+        return self.journal.sync_descriptor()
+
+    def cut(self):
+        """cut(self) - move the journal aside for save(), later changes go to a new journal
+        (call it while nothing is journaled, i.e. with the observations locked)
+        """
+        self.compacting.count += self.journal.move_to(self.compacting.pathname)
+        return self.compacting.pathname
+
+    def save(self, serials, cut=None):
+        """save(self, serials, cut=None) - rewrite annotations.csv (atomically) and delete the
+        journal records it now holds (everything journaled before cut(), all of it if cut is None)
+        """
+        if cut is None:
+            cut = self.cut()
+        # the records being folded in must survive a crash during the write
+        sync_file(cut)
+        if csvdata.csv_state(self.pathname) == csvdata.OK:
+            # keep the previous checkpoint in case the new one is lost
+            keep_backup(self.pathname, self.backup)
+        csvdata.write_csv(serials, self.pathname, fieldnames=self.fieldnames)
+        if os.path.exists(cut):
+            os.remove(cut)
+        self.compacting.count = 0
+
+    def saved(self, cut):
+        """saved(self, cut) - after save(serials, cut), with the observations locked again"""
+
+    def close(self):
+        """close(self) - close the journal"""
+        self.journal.close()
+        self.compacting.close()
+
+
+class SQLiteStorage:
+    """SQLiteStorage keeps the observations of a whole project in one database
+
+    a project spans many camera folders; Observations for one folder only load
+    the rows of that folder (by path).  Changes are written immediately and
+    committed by sync(), and project-wide questions are answered by query()
+    and count() in SQL, without loading observations into Python lists.
+    """
+    incremental = True
+    pending = 0
+    # changes are committed by the saves the GUI makes anyway
+    sync_due = False
+    # the database does its own crash recovery (see CSVStorage.recover)
+    recovered = None
+    compact_after = 0
+    # every change is written as it happens, save() only commits
+    rewrites = False
+
+    def __init__(self, pathname, fieldnames, table='observations'):
+        """__init__(self, pathname, fieldnames, table='observations') opens or creates the database"""
+        self.pathname = pathname
+        self.fieldnames = list(fieldnames)
+        self.table = table
+        # the GUI loads and saves from a background thread (see background.IOWorker)
+        self.connection = sqlite3.connect(pathname, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.create()
+
+    def column_type(self, field):
+        return 'INTEGER' if field in INTEGER_FIELDS else 'TEXT'
+
+    def create(self):
+        """create(self) - create the table and indexes if they don't exist"""
+        columns = ', '.join('{} {}'.format(field, self.column_type(field))
+                            for field in self.fieldnames)
+        cursor = self.connection.cursor()
+        cursor.execute('CREATE TABLE IF NOT EXISTS {} (rowid INTEGER PRIMARY KEY, {})'
+                       .format(self.table, columns))
+        # add columns which appeared since the database was made
+        existing = [row[1] for row in cursor.execute('PRAGMA table_info({})'.format(self.table))]
+        for field in self.fieldnames:
+            if field not in existing:
+                cursor.execute('ALTER TABLE {} ADD COLUMN {} {}'
+                               .format(self.table, field, self.column_type(field)))
+        indexes = {
+            'path_fname': '(path, fname)',
+            'camera_fname': '(camera, fname)',
+            'species': '(species)',
+            'datetime': '(datetime)',
+            # IDs of rows imported before IDs are only unique within a folder (see legacy_id)
+            'path_id': '(path, id)',
+        }
+        for name, columns in indexes.items():
+            cursor.execute('CREATE INDEX IF NOT EXISTS {0}_{1} ON {0} {2}'
+                           .format(self.table, name, columns))
+        cursor.execute('DROP INDEX IF EXISTS {}_id'.format(self.table))
+        # folders whose annotations.csv was brought in (see import_csv)
+        made = cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?",
+                              (self.table + '_imported',)).fetchone() is None
+        cursor.execute('CREATE TABLE IF NOT EXISTS {}_imported (path TEXT PRIMARY KEY)'.format(self.table))
+        if made:
+            # projects made before the table was, folders with rows were imported then
+            cursor.execute('INSERT OR IGNORE INTO {0}_imported SELECT DISTINCT path FROM {0}'
+                           .format(self.table))
+        self.connection.commit()
+
+    def row_values(self, serial):
+        values = []
+        for field in self.fieldnames:
+            value = serial.get(field, '')
+            if field in INTEGER_FIELDS and value not in ('', None):
+                value = int(value)
+            values.append(value)
+        return values
+
+    def upgrade(self, path):
+        """upgrade(self, path) - store IDs and native pixels for the rows of a folder saved
+        without them (e.g. imported from an old annotations.csv), so removing or
+        changing one of those rows later matches what is stored.
+        Returns the number of rows updated
+        """
+        cursor = self.connection.execute(
+            "SELECT rowid, {} FROM {} WHERE path = ? AND (id IS NULL OR id = '' OR space IS NULL"
+            " OR space != ?) ORDER BY rowid".format(', '.join(self.fieldnames), self.table), (path, NATIVE))
+        rows = [dict(row) for row in cursor]
+        if not rows:
+            return 0
+        before = [(row['x'], row['y'], row['space'], row['id']) for row in rows]
+        legacy = LegacyIds()
+        for row in rows:
+            ensure_id(row, legacy)
+        rows_to_native(rows)
+        changes = [(row['x'], row['y'], row['space'], row['id'], row['rowid'])
+                   for row, old in zip(rows, before) if (row['x'], row['y'], row['space'], row['id']) != old]
+        if changes:
+            self.connection.executemany('UPDATE {} SET x = ?, y = ?, space = ?, id = ? WHERE rowid = ?'
+                                        .format(self.table), changes)
+            self.connection.commit()
+        return len(changes)
+
+    def load(self, path):
+        """load(self, path) - return rows (dictionaries) for one image folder"""
+        self.upgrade(path)
+        cursor = self.connection.execute(
+            'SELECT {} FROM {} WHERE path = ? ORDER BY rowid'
+            .format(', '.join(self.fieldnames), self.table), (path,))
+        rows = [dict(row) for row in cursor]
+        legacy = LegacyIds()
+        for row in rows:
+            ensure_id(row, legacy)
+        return rows
+
+    def iter_compact(self, path):
+        """iter_compact(self, path) - stream ObservationRows for one image folder"""
+        self.upgrade(path)
+        cursor = self.connection.execute(
+            'SELECT {} FROM {} WHERE path = ? ORDER BY rowid'
+            .format(', '.join(COMPACT_FIELDS), self.table), (path,))
+        legacy = LegacyIds()
+        for row in cursor:
+            row = dict(row)
+            ensure_id(row, legacy)
+            yield ObservationRow.from_serial(row)
+
+    def append(self, serial):
+        """append(self, serial) - insert an observation (committed by sync)"""
+        self.insert_many([serial])
+
+    def insert_many(self, serials):
+        """insert_many(self, serials) - insert an iterable of serialized observations"""
+        placeholders = ', '.join('?' * len(self.fieldnames))
+        self.connection.executemany(
+            'INSERT INTO {} ({}) VALUES ({})'.format(self.table, ', '.join(self.fieldnames),
+                                                     placeholders),
+            (self.row_values(serial) for serial in serials))
+
+    def remove(self, serial):
+        """remove(self, serial) - delete one matching observation of its folder (committed by sync)"""
+        if serial.get('id'):
+            cursor = self.connection.execute('DELETE FROM {} WHERE path = ? AND id = ?'.format(self.table),
+                                             (serial['path'], serial['id']))
+            if cursor.rowcount:
+                return
+        # rows stored before IDs
+        self.connection.execute(
+            'DELETE FROM {0} WHERE rowid = (SELECT rowid FROM {0} WHERE path = ? AND fname = ?'
+            ' AND species = ? AND x = ? AND y = ? LIMIT 1)'.format(self.table),
+            (serial['path'], serial['fname'], serial['species'], int(serial['x']), int(serial['y'])))
+
+    def sync(self):
+        """sync(self) - commit outstanding changes"""
+        self.connection.commit()
+
+    def begin_sync(self):
+        """begin_sync(self) - commit (the connection is only used with the observations locked)"""
+        self.sync()
+        return None
+
+    def save(self, serials, cut=None):
+        """save(self, serials, cut=None) - changes are already written as they happen, just commit"""
+        self.sync()
+
+    def close(self):
+        """close(self) - commit and close the database"""
+        self.connection.commit()
+        self.connection.close()
+
+    def import_csv(self, pathname, path=None):
+        """import_csv(self, pathname, path=None) - copy the rows of a folder annotations.csv into the project
+        rows are moved to path (default the folder of pathname), so a folder annotated on
+        another machine or mount keeps its marks; the folder is recorded as imported.
+        rows saved before IDs and native pixels get them on the way in, returns the number of rows imported
+        """
+        if path is None:
+            path = os.path.dirname(os.path.abspath(pathname))
+        rows = csvdata.read_csv(pathname)
+        for row in rows:
+            row['path'] = path
+            row['pathname'] = os.path.join(path, row['fname'])
+        legacy = LegacyIds()
+        for row in rows:
+            ensure_id(row, legacy)
+        rows_to_native(rows)
+        self.insert_many(rows)
+        self.connection.execute('INSERT OR IGNORE INTO {}_imported (path) VALUES (?)'.format(self.table),
+                                (path,))
+        self.sync()
+        return len(rows)
+
+    def imported(self, path):
+        """imported(self, path) - True when the annotations.csv of folder path was imported"""
+        cursor = self.connection.execute('SELECT 1 FROM {}_imported WHERE path = ?'.format(self.table),
+                                         (path,))
+        return cursor.fetchone() is not None
+
+    def where(self, **criteria):
+        """where(self, **criteria) - build a WHERE clause from field=value criteria
+        start= and end= select a datetime range (EXIF "YYYY:MM:DD HH:MM:SS" strings)
+        """
+        clauses = []
+        values = []
+        for field, value in criteria.items():
+            if value is None:
+                continue
+            if field == 'start':
+                clauses.append('datetime >= ?')
+            elif field == 'end':
+                clauses.append('datetime < ?')
+            elif field in self.fieldnames:
+                clauses.append('{} = ?'.format(field))
+            else:
+                raise ValueError("unknown field {}".format(field))
+            values.append(value)
+        if not clauses:
+            return '', values
+        return ' WHERE ' + ' AND '.join(clauses), values
+
+    def query(self, **criteria):
+        """query(self, **criteria) - generator of rows matching e.g. species='zebra', camera='CAM01'"""
+        where, values = self.where(**criteria)
+        cursor = self.connection.execute(
+            'SELECT {} FROM {}{} ORDER BY rowid'.format(', '.join(self.fieldnames), self.table, where),
+            values)
+        for row in cursor:
+            yield dict(row)
+
+    def count(self, **criteria):
+        """count(self, **criteria) - number of observations matching the criteria"""
+        where, values = self.where(**criteria)
+        cursor = self.connection.execute('SELECT COUNT(*) FROM {}{}'.format(self.table, where), values)
+        return cursor.fetchone()[0]
+
+    def folders(self):
+        """folders(self) - list of image folders (paths) in the project"""
+        cursor = self.connection.execute('SELECT DISTINCT path FROM {} ORDER BY path'.format(self.table))
+        return [row[0] for row in cursor]
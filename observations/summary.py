@@ -0,0 +1,151 @@
+"""summary - species / camera / date / hour detection counts
+
+usage: python -m observations.summary [--by species,camera] [--species S] [--camera C]
+                                      (FOLDER [FOLDER ...] | --project PROJECT.sqlite)
+
+counts are kept pre-aggregated per (species, camera, date, hour), so a summary
+table is a pass over the distinct combinations, not over the observations,
+and Observations keeps them up to date as marks are added and removed.
+"""
+import argparse
+import sys
+
+# dimensions a summary can be grouped by
+SPECIES = 'species'
+CAMERA = 'camera'
+DATE = 'date'
+HOUR = 'hour'
+DIMENSIONS = (SPECIES, CAMERA, DATE, HOUR)
+# images without EXIF DateTimeOriginal
+UNDATED = ''
+NO_HOUR = -1
+
+
+def date_hour(datetime):
+    """date_hour(datetime) - ('YYYY-MM-DD', hour) of an EXIF "YYYY:MM:DD HH:MM:SS" string"""
+    if not datetime or len(datetime) < 13:
+        return UNDATED, NO_HOUR
+    try:
+        hour = int(datetime[11:13])
+    except ValueError:
+        return UNDATED, NO_HOUR
+    return datetime[:10].replace(':', '-'), hour
+
+
+class Summary:
+    """Summary holds detection counts keyed by (species, camera, date, hour)
+
+    add/remove change one count (constant time), table() rolls the counts up
+    to any of the DIMENSIONS with optional filters, e.g.
+    table(by=('species', 'hour'), camera='CAM01')
+    """
+    def __init__(self):
+        self.counts = {}
+        self.total = 0
+
+    @classmethod
+    def from_serials(cls, serials):
+        """from_serials(cls, serials) - build a Summary from serialized observations"""
+        summary = cls()
+        for serial in serials:
+            summary.add_serial(serial)
+        return summary
+
+    def key(self, species, camera, datetime):
+        date, hour = date_hour(datetime)
+        return (species or '', camera or '', date, hour)
+
+    def add(self, species, camera, datetime, count=1):
+        """add(self, species, camera, datetime, count=1) - count a detection (negative count removes)"""
+        key = self.key(species, camera, datetime)
+        value = self.counts.get(key, 0) + count
+        if value > 0:
+            self.counts[key] = value
+        else:
+            self.counts.pop(key, None)
+        self.total += count
+
+    def remove(self, species, camera, datetime):
+        """remove(self, species, camera, datetime) - uncount a detection"""
+        self.add(species, camera, datetime, -1)
+
+    def add_serial(self, serial, count=1):
+        """add_serial(self, serial, count=1) - count a serialized observation"""
+        self.add(serial.get('species'), serial.get('camera'), str(serial.get('datetime') or ''), count)
+
+    def remove_serial(self, serial):
+        """remove_serial(self, serial) - uncount a serialized observation"""
+        self.add_serial(serial, -1)
+
+    def table(self, by=(SPECIES,), **filters):
+        """table(self, by=('species',), **filters) - list of (key tuple, count) sorted by key
+        filters select one value of a dimension e.g. species='zebra', date='2024-05-01'
+        """
+        positions = []
+        for dimension in by:
+            if dimension not in DIMENSIONS:
+                raise ValueError("unknown dimension {} (use {})".format(dimension, ', '.join(DIMENSIONS)))
+            positions.append(DIMENSIONS.index(dimension))
+        tests = []
+        for dimension, value in filters.items():
+            if value is None:
+                continue
+            if dimension not in DIMENSIONS:
+                raise ValueError("unknown dimension {} (use {})".format(dimension, ', '.join(DIMENSIONS)))
+            tests.append((DIMENSIONS.index(dimension), value))
+        rolled = {}
+        for key, count in self.counts.items():
+            if tests and not all(key[position] == value for position, value in tests):
+                continue
+            group = tuple(key[position] for position in positions)
+            rolled[group] = rolled.get(group, 0) + count
+        return sorted(rolled.items())
+
+    def format_table(self, by=(SPECIES,), **filters):
+        """format_table(self, by=('species',), **filters) - the table as aligned text"""
+        table = self.table(by, **filters)
+        rows = [[str(value) for value in key] + [str(count)] for key, count in table]
+        headers = list(by) + ['count']
+        widths = [max([len(headers[column])] + [len(row[column]) for row in rows])
+                  for column in range(len(headers))]
+        lines = ['  '.join(text.ljust(width) for text, width in zip(headers, widths)).rstrip()]
+        lines.append('  '.join('-' * width for width in widths))
+        for row in rows:
+            lines.append('  '.join(text.ljust(width) for text, width in zip(row, widths)).rstrip())
+        lines.append('total {}'.format(sum(count for key, count in table)))
+        return '\n'.join(lines)
+
+
+def main(argv=None):
+    from . import OBSERVATION_FIELDS
+    from .export import iter_folders
+    from .storage import SQLiteStorage
+    parser = argparse.ArgumentParser(prog='python -m observations.summary',
+                                     description='detection counts by species, camera, date and hour')
+    parser.add_argument('folders', nargs='*', help='camera folder(s) with annotations.csv')
+    parser.add_argument('--project', help='summarize a whole SQLite project instead of folders')
+    parser.add_argument('--by', default=SPECIES,
+                        help='comma separated dimensions from {} (default species)'.format(','.join(DIMENSIONS)))
+    for dimension in (SPECIES, CAMERA, DATE):
+        parser.add_argument('--' + dimension, help='only count this ' + dimension)
+    parser.add_argument('--hour', type=int, help='only count this hour (0-23)')
+    args = parser.parse_args(argv)
+    if args.project:
+        storage = SQLiteStorage(args.project, OBSERVATION_FIELDS)
+        summary = Summary.from_serials(storage.query())
+        storage.close()
+    elif args.folders:
+        summary = Summary.from_serials(iter_folders(args.folders))
+    else:
+        parser.error('give folder(s) or --project')
+    by = [dimension.strip() for dimension in args.by.split(',') if dimension.strip()]
+    try:
+        print(summary.format_table(by, species=args.species, camera=args.camera,
+                                   date=args.date, hour=args.hour))
+    except ValueError as e:
+        parser.error(str(e))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
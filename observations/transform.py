@@ -0,0 +1,146 @@
+# coordinate transforms between display (canvas) space and native image resolution
+
+# Pillow-free, NumPy is optional and only used for batch conversion
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DISPLAY_WIDTH = 1024
+DISPLAY_HEIGHT = 768
+
+# how an image is fitted into the display
+STRETCH = 'stretch'        # scaled to fill the display (aspect ratio not kept)
+LETTERBOX = 'letterbox'    # scaled to fit, aspect ratio kept, centred with bars
+# annotations made before native coordinates were stored used the stretched display
+LEGACY_FIT = STRETCH
+
+# coordinate space of an observation's x, y
+DISPLAY = 'display'
+NATIVE = 'native'
+
+
+def scale_offset(native_width, native_height, display_width=DISPLAY_WIDTH,
+                 display_height=DISPLAY_HEIGHT, fit=STRETCH):
+    """scale_offset(native_width, native_height, display_width, display_height, fit)
+    return (sx, sy, ox, oy) so that display = native * scale + offset
+    images of unknown size (0 or -1 from EXIF) get the identity transform
+    """
+    if native_width <= 0 or native_height <= 0:
+        return 1.0, 1.0, 0.0, 0.0
+    sx = display_width / native_width
+    sy = display_height / native_height
+    if fit == STRETCH:
+        return sx, sy, 0.0, 0.0
+    if fit == LETTERBOX:
+        scale = min(sx, sy)
+        return (scale, scale,
+                (display_width - native_width * scale) / 2.0,
+                (display_height - native_height * scale) / 2.0)
+    raise ValueError("fit must be '{}' or '{}'".format(STRETCH, LETTERBOX))
+
+
+class DisplayTransform:
+    """DisplayTransform converts between display and native pixel coordinates of one image"""
+    def __init__(self, native_width, native_height, display_width=DISPLAY_WIDTH,
+                 display_height=DISPLAY_HEIGHT, fit=STRETCH):
+        """__init__(self, native_width, native_height, display_width, display_height, fit=STRETCH)"""
+        self.native_width = native_width
+        self.native_height = native_height
+        self.display_width = display_width
+        self.display_height = display_height
+        self.fit = fit
+        self.known = native_width > 0 and native_height > 0
+        self.sx, self.sy, self.ox, self.oy = scale_offset(native_width, native_height,
+                                                          display_width, display_height, fit)
+
+    def to_display(self, x, y):
+        """to_display(self, x, y) - native x,y -> display x,y (ints)"""
+        return int(round(x * self.sx + self.ox)), int(round(y * self.sy + self.oy))
+
+    def to_native(self, x, y):
+        """to_native(self, x, y) - display x,y -> native x,y (ints)"""
+        return int(round((x - self.ox) / self.sx)), int(round((y - self.oy) / self.sy))
+
+    def native_tolerance(self, pixels):
+        """native_tolerance(self, pixels) - a display distance in native pixels"""
+        return pixels / min(self.sx, self.sy)
+
+    def box(self):
+        """box(self) - (x, y, width, height) of the display area covered by the image"""
+        if not self.known:
+            return 0, 0, self.display_width, self.display_height
+        return (int(round(self.ox)), int(round(self.oy)),
+                int(round(self.native_width * self.sx)), int(round(self.native_height * self.sy)))
+
+    def contains(self, x, y):
+        """contains(self, x, y) - True if display x,y is on the image (not on a letterbox bar)"""
+        left, top, width, height = self.box()
+        return left <= x < left + width and top <= y < top + height
+
+
+def batch_to_native(xs, ys, widths, heights, display_width=DISPLAY_WIDTH,
+                    display_height=DISPLAY_HEIGHT, fit=LEGACY_FIT):
+    """batch_to_native(xs, ys, widths, heights, ...) - convert many display points at once
+    each point has its own native image size; returns (xs, ys) lists of ints.
+    Uses one vectorized NumPy pass when NumPy is installed.
+    """
+    if numpy is None:
+        native_x = []
+        native_y = []
+        for x, y, width, height in zip(xs, ys, widths, heights):
+            nx, ny = DisplayTransform(width, height, display_width, display_height, fit).to_native(x, y)
+            native_x.append(nx)
+            native_y.append(ny)
+        return native_x, native_y
+    x = numpy.asarray(xs, dtype=numpy.float64)
+    y = numpy.asarray(ys, dtype=numpy.float64)
+    width = numpy.asarray(widths, dtype=numpy.float64)
+    height = numpy.asarray(heights, dtype=numpy.float64)
+    known = (width > 0) & (height > 0)
+    # unknown sizes keep their coordinates (identity transform)
+    width = numpy.where(known, width, display_width)
+    height = numpy.where(known, height, display_height)
+    sx = display_width / width
+    sy = display_height / height
+    if fit == LETTERBOX:
+        sx = sy = numpy.minimum(sx, sy)
+        ox = (display_width - width * sx) / 2.0
+        oy = (display_height - height * sy) / 2.0
+    elif fit == STRETCH:
+        ox = oy = 0.0
+    else:
+        raise ValueError("fit must be '{}' or '{}'".format(STRETCH, LETTERBOX))
+    native_x = numpy.rint((x - ox) / sx).astype(numpy.int64)
+    native_y = numpy.rint((y - oy) / sy).astype(numpy.int64)
+    return native_x.tolist(), native_y.tolist()
+
+
+def rows_to_native(rows, display_width=DISPLAY_WIDTH, display_height=DISPLAY_HEIGHT, fit=LEGACY_FIT):
+    """rows_to_native(rows, ...) - convert serialized observations (dictionaries) in place
+    rows in display space whose image size is known get native x, y and space=NATIVE,
+    other rows are left alone.  Returns the number of rows converted.
+    """
+    convert = []
+    for row in rows:
+        if (row.get('space') or DISPLAY) != DISPLAY:
+            continue
+        try:
+            width = int(row.get('width') or 0)
+            height = int(row.get('height') or 0)
+        except ValueError:
+            continue
+        if width > 0 and height > 0:
+            convert.append((row, width, height))
+    if not convert:
+        return 0
+    xs, ys = batch_to_native([int(row['x']) for row, w, h in convert],
+                             [int(row['y']) for row, w, h in convert],
+                             [w for row, w, h in convert],
+                             [h for row, w, h in convert],
+                             display_width, display_height, fit)
+    for (row, width, height), x, y in zip(convert, xs, ys):
+        row['x'] = x
+        row['y'] = y
+        row['space'] = NATIVE
+    return len(convert)
@@ -0,0 +1,235 @@
+import os
+from array import array
+
+from . import csvdata
+
+# empty frame triage
+#
+# per image flags for a folder's files list: reviewed (somebody has looked at
+# it) and empty (it was reviewed and had no marks).  The flags are bitmaps,
+# saved with the file names in a small sidecar (.triage in the image folder).
+# Navigation is O(1) per step: next unreviewed follows a "skip" array with
+# path compression (a reviewed image points past itself), next with marks
+# reads a table of the next marked position built when the marks change.
+
+TRIAGE_FILENAME = '.triage'
+MAGIC = b'maddy-triage 1\n'
+
+
+class Bitmap:
+    """Bitmap is a fixed number of bits in a bytearray"""
+    __slots__ = ('bits', 'size')
+
+    def __init__(self, size, data=None):
+        """__init__(self, size, data=None) - data is the bytes of a saved bitmap"""
+        self.size = size
+        length = (size + 7) // 8
+        self.bits = bytearray(data[:length]) if data is not None else bytearray(length)
+        if len(self.bits) < length:
+            self.bits.extend(bytes(length - len(self.bits)))
+
+    def __getitem__(self, index):
+        return bool(self.bits[index >> 3] & (1 << (index & 7)))
+
+    def __setitem__(self, index, value):
+        if value:
+            self.bits[index >> 3] |= 1 << (index & 7)
+        else:
+            self.bits[index >> 3] &= ~(1 << (index & 7)) & 0xff
+
+    def count(self):
+        """count(self) - number of bits set"""
+        return sum(bin(byte).count('1') for byte in self.bits)
+
+
+class Triage:
+    """Triage holds the reviewed and empty flags of a files list
+
+    positions are indices into files (the viewer's file_pointer).
+    next_unreviewed and next_marked wrap around like the arrow keys and
+    return None when there is no such image.
+    """
+    def __init__(self, files, pathname=None):
+        """__init__(self, files, pathname=None) - pathname of the sidecar (not saved if None)"""
+        self.files = list(files)
+        self.pathname = pathname
+        self.positions = {fname: position for position, fname in enumerate(self.files)}
+        count = len(self.files)
+        self.reviewed = Bitmap(count)
+        self.empty = Bitmap(count)
+        self.marked = Bitmap(count)
+        # skip[i] leads to the first unreviewed position >= i (count if none)
+        self.skip = array('i', range(count + 1))
+        # next_marked_table[i] is the first marked position >= i, None until needed
+        self.next_marked_table = None
+        self.dirty = False
+
+    @classmethod
+    def load(cls, folder, files):
+        """load(cls, folder, files) - the triage of an image folder, flags from its sidecar if there is one
+        (a damaged sidecar is ignored, the folder starts unreviewed)
+        """
+        triage = cls(files, os.path.join(folder, TRIAGE_FILENAME))
+        try:
+            with open(triage.pathname, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return triage
+        if not data.startswith(MAGIC):
+            return triage
+        try:
+            header, rest = data[len(MAGIC):].split(b'\n', 1)
+            count = int(header)
+            if count < 0:
+                raise ValueError("negative count")
+            names = rest.split(b'\n', count)
+            body = names.pop() if len(names) > count else b''
+            names = [name.decode('utf-8') for name in names]
+        except ValueError:
+            # cut off or garbled (UnicodeDecodeError is a ValueError too)
+            return triage
+        length = (count + 7) // 8
+        reviewed = Bitmap(count, body[:length])
+        empty = Bitmap(count, body[length:2 * length])
+        if names == triage.files:
+            triage.reviewed = reviewed
+            triage.empty = empty
+        else:
+            # the folder changed since, match by name
+            for position, name in enumerate(names):
+                mine = triage.positions.get(name)
+                if mine is not None:
+                    triage.reviewed[mine] = reviewed[position]
+                    triage.empty[mine] = empty[position]
+        triage.rebuild()
+        return triage
+
+    def reorder(self, files):
+        """reorder(self, files) - a Triage of the same images listed in another order
+        (e.g. by datetime once EXIF is read), the flags follow the names
+        """
+        triage = Triage(files, self.pathname)
+        for position, name in enumerate(triage.files):
+            mine = self.positions.get(name)
+            if mine is not None:
+                triage.reviewed[position] = self.reviewed[mine]
+                triage.empty[position] = self.empty[mine]
+                triage.marked[position] = self.marked[mine]
+        triage.dirty = self.dirty
+        triage.rebuild()
+        return triage
+
+    def save(self):
+        """save(self) - write the sidecar (atomically)"""
+        if self.pathname is None:
+            return
+        self.dirty = False
+        names = '\n'.join(self.files).encode('utf-8')
+        temp = csvdata.temp_name(self.pathname)
+        with open(temp, 'wb') as f:
+            f.write(MAGIC)
+            f.write(b'%d\n' % len(self.files))
+            f.write(names + b'\n')
+            f.write(bytes(self.reviewed.bits))
+            f.write(bytes(self.empty.bits))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, self.pathname)
+        csvdata.fsync_directory(os.path.dirname(self.pathname))
+
+    def rebuild(self):
+        """rebuild(self) - remake the skip array from the reviewed flags"""
+        count = len(self.files)
+        skip = array('i', range(count + 1))
+        for position in range(count):
+            if self.reviewed[position]:
+                skip[position] = position + 1
+        self.skip = skip
+
+    def set_reviewed(self, position, empty=False):
+        """set_reviewed(self, position, empty=False) - flag an image as looked at (and empty)"""
+        self.reviewed[position] = True
+        self.empty[position] = empty
+        self.skip[position] = position + 1
+        self.dirty = True
+
+    def clear(self, position):
+        """clear(self, position) - flag an image as not reviewed again"""
+        self.reviewed[position] = False
+        self.empty[position] = False
+        self.dirty = True
+        self.rebuild()
+
+    def set_marked(self, position, marked):
+        """set_marked(self, position, marked) - an image got its first mark or lost its last one"""
+        if self.marked[position] != bool(marked):
+            self.marked[position] = marked
+            self.next_marked_table = None
+        if marked and self.empty[position]:
+            self.empty[position] = False
+            self.dirty = True
+
+    def update_marks(self, filenames):
+        """update_marks(self, filenames) - the images which have marks (e.g. Observations.marked_filenames())"""
+        self.marked = Bitmap(len(self.files))
+        for fname in filenames:
+            position = self.positions.get(fname)
+            if position is not None:
+                self.marked[position] = True
+                if self.empty[position]:
+                    self.empty[position] = False
+                    self.dirty = True
+        self.next_marked_table = None
+
+    def first_unreviewed(self, position):
+        """first_unreviewed(self, position) - first unreviewed position >= position (len(files) if none)"""
+        skip = self.skip
+        while skip[position] != position:
+            # path halving keeps the chains short
+            skip[position] = skip[skip[position]]
+            position = skip[position]
+        return position
+
+    def next_unreviewed(self, position):
+        """next_unreviewed(self, position) - the next unreviewed position after position, None if all are"""
+        count = len(self.files)
+        if count == 0:
+            return None
+        found = self.first_unreviewed(min(position + 1, count))
+        if found == count:
+            found = self.first_unreviewed(0)
+        return None if found == count else found
+
+    def upcoming(self, position, ahead):
+        """upcoming(self, position, ahead) - the next ahead unreviewed positions (e.g. to prefetch)"""
+        found = []
+        count = len(self.files)
+        while len(found) < ahead and position + 1 < count:
+            position = self.first_unreviewed(position + 1)
+            if position == count:
+                break
+            found.append(position)
+        return found
+
+    def next_marked(self, position):
+        """next_marked(self, position) - the next position with marks after position, None if none has"""
+        count = len(self.files)
+        if count == 0:
+            return None
+        table = self.next_marked_table
+        if table is None:
+            table = array('i', [count]) * (count + 1)
+            following = count
+            for index in range(count - 1, -1, -1):
+                if self.marked[index]:
+                    following = index
+                table[index] = following
+            self.next_marked_table = table
+        found = table[min(position + 1, count)]
+        if found == count:
+            found = table[0]
+        return None if found == count else found
+
+    def counts(self):
+        """counts(self) - (reviewed, empty, total) numbers of images"""
+        return self.reviewed.count(), self.empty.count(), len(self.files)
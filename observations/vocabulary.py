@@ -0,0 +1,189 @@
+import bisect
+import os
+import sys
+import threading
+
+from . import csvdata
+from .columnar import CodeTable
+
+# species vocabulary
+#
+# every species has a canonical name and a small integer ID (its row in
+# species.csv), plus aliases (other spellings, typos seen in old data) and an
+# optional one-key hotkey for the species dialog.  Matching ignores case and
+# extra spaces, so "Zebra " and "zebra" are one species.  Completion runs on a
+# sorted index of every name, alias and word start (bisect, no scanning).
+
+SPECIES_FILENAME = 'species.csv'
+SPECIES_FIELDS = ['id', 'name', 'aliases', 'hotkey']
+# separates aliases in the aliases column
+ALIAS_SEPARATOR = '|'
+# hotkeys handed out by assign_hotkeys (keys a species name can't start with)
+DEFAULT_HOTKEYS = '1234567890'
+# ID of a blank species (a mark nobody named), it is never in species.csv
+UNKNOWN = -1
+
+
+def clean(name):
+    """clean(name) - a species name with surrounding and repeated spaces removed"""
+    return ' '.join(str(name).split())
+
+
+def normalize(name):
+    """normalize(name) - the matching key of a name (cleaned and case folded)"""
+    return clean(name).casefold()
+
+
+class Vocabulary(CodeTable):
+    """Vocabulary is the list of species, a CodeTable whose codes are species IDs
+
+    code(name) returns the ID of a name or alias (adding a new species if it is
+    unknown), self[id] is the canonical name, so an ObservationStore can use a
+    Vocabulary as its species table.  A blank name is UNKNOWN (self[UNKNOWN] is ''),
+    so rows with no species load, only add() refuses blank names.
+    """
+    def __init__(self):
+        CodeTable.__init__(self)
+        # self.values[id] is the canonical name, self.codes maps matching keys to IDs
+        self.aliases = []
+        self.hotkeys = {}
+        # sorted (key, id) of names, aliases and the words in them, for complete()
+        self.index = []
+        self.lock = threading.Lock()
+        # True when there are species or aliases which are not saved
+        self.dirty = False
+
+    @classmethod
+    def load(cls, pathname):
+        """load(cls, pathname) - read a species.csv (an empty Vocabulary if there is none)"""
+        vocabulary = cls()
+        rows = csvdata.read_csv(pathname)
+        rows.sort(key=lambda row: int(row.get('id') or 0))
+        for row in rows:
+            if not clean(row.get('name') or ''):
+                # a row emptied by hand in a spreadsheet
+                continue
+            aliases = [alias for alias in (row.get('aliases') or '').split(ALIAS_SEPARATOR) if clean(alias)]
+            vocabulary.add(row.get('name') or '', aliases, row.get('hotkey') or None)
+        vocabulary.dirty = False
+        return vocabulary
+
+    def save(self, pathname):
+        """save(self, pathname) - write species.csv (atomically)"""
+        with self.lock:
+            rows = [{'id': species_id, 'name': name,
+                     'aliases': ALIAS_SEPARATOR.join(self.aliases[species_id]),
+                     'hotkey': self.hotkey_of(species_id) or ''}
+                    for species_id, name in enumerate(self.values)]
+            self.dirty = False
+        csvdata.write_csv(rows, pathname, fieldnames=SPECIES_FIELDS)
+
+    def add(self, name, aliases=(), hotkey=None):
+        """add(self, name, aliases=(), hotkey=None) - add a species (or aliases of a known one)
+        returns its ID
+        """
+        name = clean(name)
+        if not name:
+            raise ValueError("a species needs a name")
+        with self.lock:
+            species_id = self.codes.get(normalize(name))
+            if species_id is None:
+                species_id = len(self.values)
+                self.values.append(sys.intern(name))
+                self.aliases.append([])
+                self.index_key(normalize(name), species_id)
+                self.dirty = True
+            for alias in aliases:
+                self.add_alias(species_id, alias)
+            if hotkey:
+                self.hotkeys[hotkey] = species_id
+                self.dirty = True
+        return species_id
+
+    def add_alias(self, species_id, alias):
+        """add_alias(self, species_id, alias) - another spelling of a species"""
+        alias = clean(alias)
+        key = normalize(alias)
+        if key and key not in self.codes:
+            self.aliases[species_id].append(alias)
+            self.index_key(key, species_id)
+            self.dirty = True
+
+    def index_key(self, key, species_id):
+        self.codes[key] = species_id
+        # every word start completes too ("zeb" finds "plains zebra")
+        words = key.split(' ')
+        for start in range(len(words)):
+            bisect.insort(self.index, (' '.join(words[start:]), species_id))
+
+    def lookup(self, name):
+        """lookup(self, name) - the ID of a name or alias, None if it is unknown"""
+        return self.codes.get(normalize(name))
+
+    def code(self, value):
+        """code(self, value) - the ID of a name or alias, a new species is added
+        (UNKNOWN for a blank name)
+        """
+        key = normalize(value)
+        if not key:
+            return UNKNOWN
+        species_id = self.codes.get(key)
+        if species_id is None:
+            species_id = self.add(value)
+        return species_id
+
+    def __getitem__(self, species_id):
+        if species_id == UNKNOWN:
+            return ''
+        return self.values[species_id]
+
+    def canonical(self, name):
+        """canonical(self, name) - the canonical name of a species (added if it is new, '' if blank)"""
+        return self[self.code(name)]
+
+    def complete(self, prefix, limit=10):
+        """complete(self, prefix, limit=10) - IDs of up to limit species with a name, alias
+        or word in them starting with prefix (in name order)
+        """
+        key = normalize(prefix)
+        found = []
+        position = bisect.bisect_left(self.index, (key, -1))
+        index = self.index
+        while position < len(index) and len(found) < limit:
+            text, species_id = index[position]
+            if not text.startswith(key):
+                break
+            if species_id not in found:
+                found.append(species_id)
+            position += 1
+        return found
+
+    def by_hotkey(self, key):
+        """by_hotkey(self, key) - the ID of the species on a hotkey, None if there is none"""
+        return self.hotkeys.get(key)
+
+    def hotkey_of(self, species_id):
+        """hotkey_of(self, species_id) - the hotkey of a species, None if it has none"""
+        for key, hotkey_id in self.hotkeys.items():
+            if hotkey_id == species_id:
+                return key
+        return None
+
+    def assign_hotkeys(self, species_ids, keys=DEFAULT_HOTKEYS):
+        """assign_hotkeys(self, species_ids, keys=DEFAULT_HOTKEYS) - put species (e.g. the most
+        common ones) on the keys which are not taken yet
+        """
+        free = [key for key in keys if key not in self.hotkeys]
+        for species_id in species_ids:
+            if not free:
+                break
+            if species_id == UNKNOWN:
+                continue
+            if self.hotkey_of(species_id) is None:
+                self.hotkeys[free.pop(0)] = species_id
+                self.dirty = True
+
+
+def vocabulary_pathname(folder):
+    """vocabulary_pathname(folder) - the species.csv of an image folder"""
+    return os.path.join(folder, SPECIES_FILENAME)
@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pytest
+
+# run against the checkout (there is no package install)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from observations import image_registry
+from observations.exifcache import file_signature
+
+
+@pytest.fixture(autouse=True)
+def fresh_registry():
+    """every test starts without shared Images or EXIF caches from other tests"""
+    image_registry.clear()
+    yield
+    image_registry.clear()
+
+
+@pytest.fixture
+def folder(tmp_path):
+    """an empty image folder (a str path, like the GUI passes)"""
+    return str(tmp_path)
+
+
+@pytest.fixture
+def make_image(folder):
+    """make_image(fname, width=4000, height=3000, datetime='', camera_id='') - an image file
+    in folder whose EXIF is already in the folder's cache (no real JPEG needed)
+    """
+    def make(fname, width=4000, height=3000, datetime='', camera_id=''):
+        pathname = os.path.join(folder, fname)
+        with open(pathname, 'wb') as f:
+            f.write(b'not really a jpeg')
+        metadata = {'datetime': datetime, 'width': width, 'height': height, 'camera_id': camera_id}
+        image_registry.cache_for(folder).update(fname, file_signature(pathname), metadata)
+        return image_registry.get(fname, folder)
+    return make
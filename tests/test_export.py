@@ -0,0 +1,67 @@
+import json
+import os
+
+import pytest
+
+from observations import Observations, Observation, OBSERVATION_FIELDS
+from observations.export import iter_folders, export, FIELDS
+from observations.shared import SharedStorage
+
+
+def marks(folder):
+    return sorted((row['species'], row['id']) for row in iter_folders([folder]))
+
+
+def test_journaled_marks_are_exported_with_their_ids(folder, make_image):
+    image = make_image('a.jpg')
+    observations = Observations('annotations.csv', folder, journal=True)
+    zebra = observations.append(Observation(image, 'zebra', 100, 200))
+    observations.compact()
+    kudu = observations.append(Observation(image, 'kudu', 300, 300))
+    observations.save()
+    # kudu is only in the journal
+    assert observations.storage.pending == 1
+    assert marks(folder) == sorted([('kudu', kudu.id), ('zebra', zebra.id)])
+    assert 'id' in FIELDS
+
+
+def test_shared_logs_are_folded_in_last_writer_wins(folder, make_image):
+    image = make_image('a.jpg')
+    ann = Observations('annotations.csv', folder, annotator='ann')
+    zebra = ann.append(Observation(image, 'zebra', 100, 200))
+    eland = ann.append(Observation(image, 'eland', 500, 500))
+    ann.save()
+    bob = Observations('annotations.csv', folder, annotator='bob')
+    bob.edit(bob.find_by_id(zebra.id, 'a.jpg'), species='kudu')
+    bob.remove(bob.find_by_id(eland.id, 'a.jpg'))
+    bob.save()
+    # nothing has been folded into annotations.csv yet
+    assert not os.path.exists(os.path.join(folder, 'annotations.csv'))
+    assert marks(folder) == [('kudu', zebra.id)]
+
+
+def test_reading_a_shared_folder_writes_nothing(folder, make_image):
+    image = make_image('a.jpg')
+    ann = Observations('annotations.csv', folder, annotator='ann')
+    ann.append(Observation(image, 'zebra', 100, 200))
+    ann.save()
+    before = sorted(os.listdir(folder))
+    storage = SharedStorage(os.path.join(folder, 'annotations.csv'), OBSERVATION_FIELDS, None)
+    assert [row['species'] for row in storage.load()] == ['zebra']
+    with pytest.raises(ValueError):
+        storage.append(storage.load()[0])
+    storage.close()
+    assert sorted(os.listdir(folder)) == before
+
+
+def test_coco_annotations_carry_the_observation_id(folder, make_image, tmp_path_factory):
+    image = make_image('a.jpg')
+    observations = Observations('annotations.csv', folder)
+    zebra = observations.append(Observation(image, 'zebra', 100, 200))
+    observations.save()
+    pathname = str(tmp_path_factory.mktemp('out') / 'marks.json')
+    assert export(iter_folders([folder]), pathname) == (pathname, 1)
+    with open(pathname) as f:
+        coco = json.load(f)
+    assert coco['annotations'][0]['observation_id'] == zebra.id
+    assert coco['annotations'][0]['keypoints'][:2] == [zebra.x, zebra.y]
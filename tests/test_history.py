@@ -0,0 +1,99 @@
+import pytest
+
+from observations import Observations, Observation
+from observations.events import EventQueue
+
+OPTIONS = [{}, {'columnar': True}, {'lazy': True, 'columnar': True, 'journal': True}]
+
+
+@pytest.fixture(params=OPTIONS)
+def marked(request, folder, make_image):
+    """Observations of a folder with five marks on a.jpg"""
+    image = make_image('a.jpg')
+    observations = Observations('annotations.csv', folder, **request.param)
+    for position in range(5):
+        observations.append(Observation(image, 'species{}'.format(position), 100 * position, 100))
+    return observations
+
+
+def species_of(observations):
+    return sorted(o.species for o in observations.get_by_filename('a.jpg'))
+
+
+def assert_positions(observations):
+    for index, observation in enumerate(observations.items):
+        assert observations.index_of(observation) == index
+
+
+def test_undo_and_redo_an_added_mark(marked):
+    mark = marked.get_by_filename('a.jpg')[-1]
+    command = marked.undo()
+    assert command.fnames == ('a.jpg',)
+    assert len(species_of(marked)) == 4
+    assert marked.find_by_id(mark.id, 'a.jpg') is None
+    marked.redo()
+    assert marked.find_by_id(mark.id, 'a.jpg').species == mark.species
+    assert marked.redo() is None
+    assert_positions(marked)
+
+
+def test_undo_a_removal_from_the_middle(marked):
+    before = species_of(marked)
+    middle = marked.get_by_filename('a.jpg')[1]
+    assert marked.remove(middle)
+    assert not marked.remove(middle)
+    assert_positions(marked)
+    assert species_of(marked) == [name for name in before if name != middle.species]
+    marked.undo()
+    assert species_of(marked) == before
+    assert_positions(marked)
+    marked.redo()
+    assert len(species_of(marked)) == 4
+    assert_positions(marked)
+
+
+def test_undo_and_redo_an_edit(marked):
+    mark = marked.get_by_filename('a.jpg')[0]
+    marked.edit(mark, species='zebra')
+    assert 'zebra' in species_of(marked)
+    marked.undo()
+    assert 'zebra' not in species_of(marked)
+    marked.redo()
+    assert marked.find_by_id(mark.id, 'a.jpg').species == 'zebra'
+
+
+def test_editing_a_mark_which_is_gone_records_nothing(marked):
+    mark = marked.get_by_filename('a.jpg')[2]
+    marked.remove(mark)
+    assert marked.edit(mark, species='zebra') is None
+    # the last change is still the removal
+    marked.undo()
+    assert marked.find_by_id(mark.id, 'a.jpg') is not None
+
+
+def test_undone_changes_are_saved(marked, folder):
+    marked.remove(marked.get_by_filename('a.jpg')[0])
+    marked.undo()
+    marked.save()
+    marked.close()
+    assert len(species_of(Observations('annotations.csv', folder))) == 5
+
+
+def test_events_after_a_dialog_wait_for_it():
+    handled = []
+    later = []
+
+    def handle(event):
+        if event == ('dialog',):
+            # a modal dialog runs the event loop, which drains again
+            queue.drain()
+        handled.append(event)
+
+    queue = EventQueue(handle, lambda milliseconds, function: later.append(function))
+    queue.put('dialog')
+    queue.put('click')
+    later.pop(0)()
+    assert handled == [('dialog',), ('click',)]
+    # the drain from inside the dialog only scheduled itself again
+    later.pop(0)()
+    assert handled == [('dialog',), ('click',)]
@@ -0,0 +1,31 @@
+import pytest
+
+from observations import Observations, Observation, image_registry
+
+
+@pytest.mark.parametrize('columnar', [False, True])
+def test_find_by_filename_after_deletes(tmp_path, columnar):
+    folder = str(tmp_path)
+    images = [image_registry.get(fname, folder) for fname in ('a.jpg', 'b.jpg', 'c.jpg')]
+    observations = Observations('annotations.csv', folder, columnar=columnar)
+    for position in range(12):
+        observations.append(Observation(images[position % 3], 'zebra', position, position))
+    # deletes move the last observation into the hole
+    observations.remove_at_index(0)
+    observations.remove_at_index(4)
+    for fname in ('a.jpg', 'b.jpg', 'c.jpg'):
+        expected = [index for index, item in enumerate(observations.items) if item.image.fname == fname]
+        assert observations.find_by_filename(fname) == expected
+    assert observations.find_by_filename('missing.jpg') == []
+
+
+def test_by_filename_index_follows_appends_and_removes(tmp_path):
+    folder = str(tmp_path)
+    image = image_registry.get('a.jpg', folder)
+    observations = Observations('annotations.csv', folder)
+    first = observations.append(Observation(image, 'zebra', 1, 1))
+    observations.append(Observation(image, 'kudu', 2, 2))
+    assert [o.species for o in observations.get_by_filename('a.jpg')] == ['zebra', 'kudu']
+    observations.remove(first)
+    assert [o.species for o in observations.get_by_filename('a.jpg')] == ['kudu']
+    assert observations.marked_filenames() == {'a.jpg'}
@@ -0,0 +1,99 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from PIL import Image
+
+from observations import ingest
+from observations.exifcache import ExifCache
+
+@pytest.fixture
+def executor():
+    # the ProcessPoolExecutor of main() only adds pickling, threads keep the tests quick
+    with ThreadPoolExecutor(2) as executor:
+        yield executor
+
+
+def jpeg(folder, fname, datetime):
+    """a small real JPEG with DateTimeOriginal in its EXIF"""
+    exif = Image.Exif()
+    exif.get_ifd(0x8769)[0x9003] = datetime
+    Image.new('RGB', (8, 6)).save(os.path.join(folder, fname), exif=exif)
+
+
+@pytest.fixture
+def extracted(monkeypatch):
+    """names of the images whose EXIF is read"""
+    names = []
+    extract = ingest.extract
+
+    def counting(pathname):
+        names.append(os.path.basename(pathname))
+        return extract(pathname)
+    monkeypatch.setattr(ingest, 'extract', counting)
+    return names
+
+
+def test_writes_the_sidecar(folder, executor):
+    jpeg(folder, 'a.jpg', '2024:01:02 10:00:00')
+    jpeg(folder, 'b.jpg', '2024:01:01 10:00:00')
+    assert ingest.ingest_folder(folder, executor) == (2, 2, 0)
+    entries = ExifCache(folder).entries
+    assert entries['a.jpg'][1]['datetime'] == '2024:01:02 10:00:00'
+    assert entries['b.jpg'][1]['datetime'] == '2024:01:01 10:00:00'
+
+
+def test_second_run_skips_known_images(folder, executor, extracted):
+    jpeg(folder, 'a.jpg', '2024:01:02 10:00:00')
+    ingest.ingest_folder(folder, executor)
+    jpeg(folder, 'b.jpg', '2024:01:01 10:00:00')
+    del extracted[:]
+    assert ingest.ingest_folder(folder, executor) == (2, 1, 0)
+    assert extracted == ['b.jpg']
+
+
+def test_changed_image_is_read_again(folder, executor, extracted):
+    jpeg(folder, 'a.jpg', '2024:01:02 10:00:00')
+    ingest.ingest_folder(folder, executor)
+    jpeg(folder, 'a.jpg', '2025:06:30 12:00:00')
+    # the signature is (mtime, size), make sure it moves on coarse clocks too
+    mtime = os.stat(os.path.join(folder, 'a.jpg')).st_mtime_ns + 2 * 10 ** 9
+    os.utime(os.path.join(folder, 'a.jpg'), ns=(mtime, mtime))
+    del extracted[:]
+    assert ingest.ingest_folder(folder, executor) == (1, 1, 0)
+    assert extracted == ['a.jpg']
+    assert ExifCache(folder).entries['a.jpg'][1]['datetime'] == '2025:06:30 12:00:00'
+
+
+def test_force_reads_everything(folder, executor, extracted):
+    jpeg(folder, 'a.jpg', '2024:01:02 10:00:00')
+    jpeg(folder, 'b.jpg', '2024:01:01 10:00:00')
+    ingest.ingest_folder(folder, executor)
+    del extracted[:]
+    assert ingest.ingest_folder(folder, executor, force=True) == (2, 2, 0)
+    assert sorted(extracted) == ['a.jpg', 'b.jpg']
+
+
+def test_failures_are_counted_and_retried(folder, executor, monkeypatch):
+    jpeg(folder, 'a.jpg', '2024:01:02 10:00:00')
+    jpeg(folder, 'b.jpg', '2024:01:01 10:00:00')
+    read_exif = ingest.read_exif
+
+    def unreadable_b(pathname):
+        if pathname.endswith('b.jpg'):
+            raise OSError("unreadable")
+        return read_exif(pathname)
+    monkeypatch.setattr(ingest, 'read_exif', unreadable_b)
+    assert ingest.ingest_folder(folder, executor) == (2, 1, 1)
+    assert 'b.jpg' not in ExifCache(folder).entries
+    monkeypatch.undo()
+    assert ingest.ingest_folder(folder, executor) == (2, 1, 0)
+
+
+def test_recursive_writes_a_sidecar_per_directory(folder, executor):
+    os.mkdir(os.path.join(folder, 'day1'))
+    jpeg(folder, 'a.jpg', '2024:01:02 10:00:00')
+    jpeg(os.path.join(folder, 'day1'), 'b.jpg', '2024:01:01 10:00:00')
+    assert ingest.ingest_folder(folder, executor, recursive=True) == (2, 2, 0)
+    assert list(ExifCache(folder).entries) == ['a.jpg']
+    assert list(ExifCache(os.path.join(folder, 'day1')).entries) == ['b.jpg']
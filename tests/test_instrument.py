@@ -0,0 +1,130 @@
+import json
+import threading
+
+from observations import instrument
+from observations.instrument import Recorder, LatencyOverlay, percentile, NO_SPAN
+
+
+def test_percentile_is_nearest_rank():
+    values = [float(value) for value in range(1, 101)]
+    assert percentile(values, 0.5) == 51.0
+    assert percentile(values, 0.95) == 95.0
+    assert percentile([], 0.5) == 0.0
+
+
+def test_stats_per_name():
+    recorder = Recorder(enabled=True)
+    for duration in (0.001, 0.002, 0.003, 0.010):
+        recorder.record('image.show', recorder.origin, duration)
+    recorder.record('save', recorder.origin, 0.5)
+    stats = recorder.stats()
+    assert stats['image.show'] == (4, 0.003, 0.010, 0.010)
+    assert stats['save'] == (1, 0.5, 0.5, 0.5)
+    assert [line.split()[0] for line in recorder.format_stats()] == ['image.show', 'save']
+
+
+def test_ring_keeps_the_last_events():
+    recorder = Recorder(capacity=4, enabled=True)
+    for number in range(10):
+        recorder.record('event{}'.format(number), recorder.origin + number, 0.001)
+    assert [name for name, start, duration, thread in recorder.events()] == [
+        'event6', 'event7', 'event8', 'event9']
+    recorder.reset()
+    assert recorder.events() == [] and recorder.stats() == {}
+
+
+def test_spans_only_record_while_enabled():
+    recorder = Recorder()
+    assert recorder.span('markers.draw') is NO_SPAN
+    with recorder.span('markers.draw'):
+        pass
+    assert recorder.events() == []
+    recorder.enable()
+    with recorder.span('markers.draw'):
+        pass
+    assert recorder.stats()['markers.draw'][0] == 1
+
+
+def test_timed_uses_the_shared_recorder(monkeypatch):
+    shared = Recorder()
+    monkeypatch.setattr(instrument, 'recorder', shared)
+
+    @instrument.timed('work')
+    def work(value):
+        return value * 2
+
+    assert work(2) == 4 and shared.events() == []
+    shared.enable()
+    assert work(3) == 6
+    assert shared.stats()['work'][0] == 1
+
+
+def test_threads_get_their_own_slots():
+    recorder = Recorder(enabled=True)
+    # all the threads are alive together, so their idents differ
+    barrier = threading.Barrier(4)
+
+    def record_many():
+        barrier.wait()
+        for number in range(500):
+            recorder.record('prefetch', recorder.origin, 0.001)
+        barrier.wait()
+    workers = [threading.Thread(target=record_many) for number in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    # no slot was written twice
+    assert sum(1 for code in recorder.code if code >= 0) == 2000
+    threads = [recorder.thread[slot] for slot in range(2000)]
+    assert sorted(threads.count(thread) for thread in set(threads)) == [500, 500, 500, 500]
+
+
+def test_dump_writes_chrome_trace_events(tmp_path):
+    recorder = Recorder(enabled=True)
+    recorder.record('save', recorder.origin + 0.25, 0.002)
+    pathname = recorder.dump(str(tmp_path / 'trace.json'))
+    with open(pathname) as f:
+        trace = json.load(f)
+    event, = trace['traceEvents']
+    assert (event['name'], event['ph'], event['ts'], event['dur']) == ('save', 'X', 250000.0, 2000.0)
+    assert trace['otherData']['recorded'] == 1
+
+
+class Canvas:
+    """the few guizero Drawing calls the overlay makes"""
+    def __init__(self):
+        self.items = {}
+        self.next_id = 1
+
+    def add(self, kind, *args):
+        self.items[self.next_id] = (kind,) + args
+        self.next_id += 1
+        return self.next_id - 1
+
+    def rectangle(self, *args, **kwargs):
+        return self.add('rectangle')
+
+    def text(self, x, y, text, **kwargs):
+        return self.add('text', text)
+
+    def delete(self, item):
+        self.items.pop(item, None)
+
+
+def test_overlay_replaces_its_own_items():
+    canvas = Canvas()
+    image = canvas.add('image')
+    recorder = Recorder()
+    overlay = LatencyOverlay(canvas, recorder)
+    overlay.draw()
+    assert list(canvas.items) == [image]
+    assert overlay.toggle() and recorder.enabled
+    assert [item[1] for item in canvas.items.values() if item[0] == 'text'] == ['no timings yet']
+    recorder.record('save', recorder.origin, 0.002)
+    overlay.draw()
+    texts = [item[1] for item in canvas.items.values() if item[0] == 'text']
+    assert len(texts) == 1 and texts[0].startswith('save')
+    assert len(canvas.items) == 3
+    assert not overlay.toggle()
+    assert list(canvas.items) == [image]
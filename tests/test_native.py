@@ -0,0 +1,93 @@
+import os
+
+from observations import Observations, Observation, OBSERVATION_FIELDS, NATIVE, DISPLAY, csvdata
+from observations.transform import DisplayTransform, rows_to_native, STRETCH, LETTERBOX
+
+
+def test_display_native_round_trip():
+    for fit in (STRETCH, LETTERBOX):
+        transform = DisplayTransform(4000, 3000, 1024, 768, fit)
+        for x, y in [(0, 0), (100, 200), (511, 383), (1023, 767)]:
+            assert transform.to_display(*transform.to_native(x, y)) == (x, y)
+
+
+def test_known_click_position():
+    transform = DisplayTransform(4000, 3000, 1024, 768, STRETCH)
+    assert transform.to_native(100, 200) == (391, 781)
+    assert transform.to_display(391, 781) == (100, 200)
+
+
+def test_letterbox_bars_are_not_on_the_image():
+    transform = DisplayTransform(4000, 2000, 1024, 768, LETTERBOX)
+    left, top, width, height = transform.box()
+    assert (left, width) == (0, 1024) and top > 0
+    assert not transform.contains(500, top - 1)
+    assert transform.contains(500, top)
+
+
+def test_unknown_size_is_left_alone():
+    rows = [{'x': '100', 'y': '200', 'width': '0', 'height': '0', 'space': ''},
+            {'x': '10', 'y': '20', 'width': '4000', 'height': '3000', 'space': NATIVE},
+            {'x': '100', 'y': '200', 'width': '4000', 'height': '3000', 'space': DISPLAY}]
+    assert rows_to_native(rows) == 1
+    assert (rows[0]['x'], rows[0]['space']) == ('100', '')
+    assert (rows[1]['x'], rows[1]['y']) == ('10', '20')
+    assert (rows[2]['x'], rows[2]['y'], rows[2]['space']) == (391, 781, NATIVE)
+
+
+def test_click_is_stored_native_and_found_again(folder, make_image):
+    image = make_image('a.jpg')
+    observations = Observations('annotations.csv', folder)
+    stored = observations.append(Observation(image, 'zebra', 100, 200))
+    assert (stored.x, stored.y, stored.space) == (391, 781, NATIVE)
+    assert observations.find_by_display_location('a.jpg', 102, 203) is stored
+    assert observations.find_by_display_location('a.jpg', 150, 250) is None
+
+
+def test_find_by_filename_location_takes_canvas_positions(folder, make_image):
+    # the maddy4 right click: find the index, then remove_at_index
+    image = make_image('a.jpg')
+    observations = Observations('annotations.csv', folder)
+    observations.append(Observation(image, 'kudu', 300, 300))
+    observations.append(Observation(image, 'zebra', 100, 200))
+    index = observations.find_by_filename_location('a.jpg', 100, 200)
+    assert index >= 0 and observations.items[index].species == 'zebra'
+    assert observations.find_by_filename_location('a.jpg', 391, 781) == -1
+    observations.remove_at_index(index)
+    assert [o.species for o in observations.get_by_filename('a.jpg')] == ['kudu']
+
+
+def test_legacy_display_rows_load_native(folder, make_image):
+    make_image('a.jpg')
+    row = {'species': 'zebra', 'x': 100, 'y': 200, 'fname': 'a.jpg', 'path': folder,
+           'pathname': os.path.join(folder, 'a.jpg'), 'datetime': '', 'width': 4000, 'height': 3000,
+           'camera': '', 'space': ''}
+    csvdata.write_csv([row], os.path.join(folder, 'annotations.csv'),
+                      fieldnames=[field for field in OBSERVATION_FIELDS if field != 'id'])
+    for options in ({}, {'lazy': True, 'columnar': True}):
+        observations = Observations('annotations.csv', folder, **options)
+        found = observations.get_by_filename('a.jpg')
+        assert [(o.x, o.y, o.space) for o in found] == [(391, 781, NATIVE)]
+        assert observations.find_by_filename_location('a.jpg', 100, 200) >= 0
+
+
+def test_click_on_an_image_of_unknown_size_stays_display(folder, make_image):
+    image = make_image('a.jpg', width=-1, height=-1)
+    observations = Observations('annotations.csv', folder)
+    stored = observations.append(Observation(image, 'zebra', 100, 200))
+    assert (stored.x, stored.y, stored.space) == (100, 200, DISPLAY)
+    assert observations.find_by_display_location('a.jpg', 102, 203) is stored
+    observations.save()
+    row = csvdata.read_csv(observations.pathname)[0]
+    assert (row['x'], row['y'], row['space']) == ('100', '200', DISPLAY)
+
+
+def test_grid_cells_are_sized_in_native_pixels(folder, make_image):
+    observations = Observations('annotations.csv', folder)
+    for fname, width, height in [('small.jpg', 1024, 768), ('big.jpg', 6000, 4500), ('unknown.jpg', 0, 0)]:
+        observations.append(Observation(make_image(fname, width, height), 'zebra', 100, 200))
+    assert observations.grid_for('small.jpg').cell_size == 32
+    # 32 display pixels are about 188 pixels of a 6000 wide image
+    assert observations.grid_for('big.jpg').cell_size == 188
+    assert observations.grid_for('unknown.jpg').cell_size == 32
+    assert observations.find_by_display_location('big.jpg', 110, 190) is not None
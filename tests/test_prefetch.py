@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+PIL = pytest.importorskip('PIL.Image')
+
+from observations.prefetch import DisplayCache, Prefetcher, decode_display
+from observations.transform import LETTERBOX
+
+
+def picture(size=(10, 10)):
+    return PIL.new('RGB', size)
+
+
+def jpegs(folder, count, size=(400, 300)):
+    pathnames = []
+    for position in range(count):
+        pathname = os.path.join(folder, 'img{}.jpg'.format(position))
+        PIL.new('RGB', size, (position * 20, 0, 0)).save(pathname)
+        pathnames.append(pathname)
+    return pathnames
+
+
+def test_least_recently_used_images_are_dropped():
+    # each 10x10 RGB picture is 300 bytes
+    cache = DisplayCache(max_bytes=900)
+    for name in 'abc':
+        cache.put(name, picture())
+    cache.get('a')
+    cache.put('d', picture())
+    assert 'b' not in cache
+    assert all(name in cache for name in 'acd')
+    assert cache.nbytes == 900
+    # putting the same pathname again replaces it
+    cache.put('d', picture())
+    assert cache.nbytes == 900
+
+
+def test_an_image_bigger_than_the_budget_is_still_kept():
+    cache = DisplayCache(max_bytes=100)
+    cache.put('a', picture())
+    cache.put('b', picture())
+    assert 'a' not in cache and 'b' in cache
+
+
+def test_decode_fits_the_display(tmp_path):
+    pathname, = jpegs(str(tmp_path), 1, size=(800, 400))
+    assert decode_display(pathname, 200, 150).size == (200, 150)
+    # letterboxed images keep the display size, with bars
+    assert decode_display(pathname, 200, 150, LETTERBOX).size == (200, 150)
+
+
+def test_loader_falls_back_to_decoding(tmp_path):
+    pathname, = jpegs(str(tmp_path), 1)
+    cache = DisplayCache(width=100, height=75)
+    cache.loader = lambda pathname, width, height, fit: None
+    assert cache.get(pathname).size == (100, 75)
+    assert cache.get(os.path.join(str(tmp_path), 'missing.jpg')) is None
+
+
+def test_prefetch_decodes_the_neighbours(tmp_path):
+    pathnames = jpegs(str(tmp_path), 6)
+    cache = DisplayCache(width=100, height=75)
+    prefetcher = Prefetcher(cache, ahead=2)
+    prefetcher.prefetch(pathnames, 0)
+    for future in list(cache.pending.values()):
+        future.result()
+    prefetcher.shutdown()
+    # two ahead and two behind, wrapping around
+    assert [pathname in cache for pathname in pathnames] == [False, True, True, False, True, True]
@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+PIL = pytest.importorskip('PIL.Image')
+
+from observations import previews
+from observations.previews import PreviewStore, PREVIEW_DIRNAME, DISPLAY, THUMBNAIL
+
+
+def originals(folder, count=3):
+    fnames = []
+    for position in range(count):
+        fname = 'img{}.jpg'.format(position)
+        PIL.new('RGB', (800, 600)).save(os.path.join(folder, fname))
+        fnames.append(fname)
+    return fnames
+
+
+def test_build_writes_every_level_once(tmp_path):
+    folder = str(tmp_path)
+    fnames = originals(folder)
+    store = PreviewStore(folder)
+    assert store.build(fnames) == 3
+    assert store.stale(fnames) == []
+    with PIL.open(store.get('img0.jpg')) as display:
+        assert display.size == previews.SIZES[DISPLAY]
+    assert store.thumbnail('img0.jpg') is not None
+    # fresh previews are not built again
+    assert store.build(fnames) == 0
+
+
+def test_builds_share_one_pool(tmp_path):
+    folder = str(tmp_path)
+    fnames = originals(folder, 1)
+    PreviewStore(folder).build(fnames)
+    pool = previews.executor
+    os.remove(PreviewStore(folder).preview_path('img0.jpg', THUMBNAIL))
+    assert PreviewStore(folder).build(fnames) == 1
+    assert previews.executor is pool
+
+
+def test_folder_which_cannot_hold_previews(tmp_path):
+    folder = str(tmp_path)
+    fnames = originals(folder)
+    # .previews can't be made (the same as a read-only folder, which root could still write)
+    with open(os.path.join(folder, PREVIEW_DIRNAME), 'w') as f:
+        f.write('in the way')
+    store = PreviewStore(folder)
+    assert store.build(fnames) == 0
+    thread = store.build_in_background(fnames)
+    thread.join(10)
+    assert not thread.is_alive()
@@ -0,0 +1,122 @@
+import os
+
+from observations import Observations, Observation, OBSERVATION_FIELDS, csvdata
+from observations.export import iter_folders
+from observations.storage import CSVStorage, RESTORED, REPAIRED
+
+
+def saved_folder(folder, make_image, species=('zebra', 'kudu')):
+    """annotations.csv of folder with a mark of each species, returns its pathname"""
+    image = make_image('a.jpg')
+    observations = Observations('annotations.csv', folder)
+    for position, name in enumerate(species):
+        observations.append(Observation(image, name, 100 + 50 * position, 200))
+    observations.save()
+    return observations.pathname
+
+
+def cut_end(pathname, keep):
+    """cut the file at pathname after keep(data) bytes, like a crash in the middle of a write"""
+    with open(pathname, 'rb') as f:
+        data = f.read()
+    with open(pathname, 'wb') as f:
+        f.write(data[:keep(data)])
+
+
+def species_of(observations):
+    return sorted(o.species for o in observations.get_by_filename('a.jpg'))
+
+
+def test_last_row_without_a_newline_is_kept(folder, make_image):
+    pathname = saved_folder(folder, make_image)
+    cut_end(pathname, lambda data: len(data.rstrip(b'\r\n')))
+    assert csvdata.csv_state(pathname) == csvdata.OK
+    observations = Observations('annotations.csv', folder)
+    assert observations.recovered is None
+    assert species_of(observations) == ['kudu', 'zebra']
+
+
+def test_cut_off_last_row_is_dropped(folder, make_image):
+    pathname = saved_folder(folder, make_image)
+    cut_end(pathname, lambda data: data.rstrip(b'\r\n').rfind(b',') - 3)
+    assert csvdata.csv_state(pathname) == csvdata.PARTIAL
+    observations = Observations('annotations.csv', folder)
+    assert observations.recovered == REPAIRED
+    assert species_of(observations) == ['zebra']
+    assert os.path.exists(pathname + '.damaged')
+
+
+def test_open_quote_is_partial(folder):
+    pathname = os.path.join(folder, 'annotations.csv')
+    with open(pathname, 'w', newline='') as f:
+        f.write('species,x,y\r\nzebra,1,2\r\n"Burchell\'s, zebra,3')
+    assert csvdata.csv_state(pathname) == csvdata.PARTIAL
+    with open(pathname, 'a', newline='') as f:
+        f.write('",4,5')
+    assert csvdata.csv_state(pathname) == csvdata.OK
+
+
+def test_lost_file_is_restored_from_the_backup(folder, make_image):
+    pathname = saved_folder(folder, make_image)
+    observations = Observations('annotations.csv', folder)
+    observations.append(Observation(make_image('b.jpg'), 'eland', 10, 10))
+    # the second save keeps the first one as annotations.csv.bak
+    observations.save()
+    os.remove(pathname)
+    restored = Observations('annotations.csv', folder)
+    assert restored.recovered == RESTORED
+    assert species_of(restored) == ['kudu', 'zebra']
+
+
+def test_torn_journal_record_is_dropped(folder, make_image):
+    image = make_image('a.jpg')
+    observations = Observations('annotations.csv', folder, journal=True)
+    observations.append(Observation(image, 'zebra', 100, 200))
+    observations.append(Observation(image, 'kudu', 300, 300))
+    observations.save()
+    journal = observations.pathname + '.journal'
+    observations.storage.journal.close()
+    cut_end(journal, lambda data: len(data) - 5)
+    reopened = Observations('annotations.csv', folder, journal=True)
+    assert species_of(reopened) == ['zebra']
+    reopened.append(Observation(image, 'eland', 500, 500))
+    reopened.close()
+    assert sorted(row['species'] for row in csvdata.read_csv(reopened.pathname)) == ['eland', 'zebra']
+
+
+def test_only_our_own_temp_file_is_removed(folder, make_image):
+    pathname = saved_folder(folder, make_image)
+    ours = csvdata.temp_name(pathname)
+    # another process in the middle of a write
+    theirs = pathname + csvdata.TEMP_SUFFIX + str(os.getpid() + 1)
+    for temp in (ours, theirs):
+        with open(temp, 'w') as f:
+            f.write('species,x\r\n')
+    Observations('annotations.csv', folder)
+    assert not os.path.exists(ours)
+    assert os.path.exists(theirs)
+
+
+def test_export_reads_a_damaged_folder_without_repairing_it(folder, make_image):
+    pathname = saved_folder(folder, make_image)
+    cut_end(pathname, lambda data: data.rstrip(b'\r\n').rfind(b',') - 3)
+    with open(pathname, 'rb') as f:
+        damaged = f.read()
+    assert [row['species'] for row in iter_folders([folder])] == ['zebra']
+    for options in ({}, {'journal': True}):
+        storage = CSVStorage(pathname, OBSERVATION_FIELDS, read_only=True, **options)
+        assert [row['species'] for row in storage.load()] == ['zebra']
+        assert storage.recovered is None
+    with open(pathname, 'rb') as f:
+        assert f.read() == damaged
+    assert not os.path.exists(pathname + '.damaged')
+
+
+def test_export_reads_the_backup_of_a_lost_file(folder, make_image):
+    pathname = saved_folder(folder, make_image)
+    observations = Observations('annotations.csv', folder)
+    observations.append(Observation(make_image('b.jpg'), 'eland', 10, 10))
+    observations.save()
+    os.remove(pathname)
+    assert sorted(row['species'] for row in iter_folders([folder])) == ['kudu', 'zebra']
+    assert not os.path.exists(pathname)
@@ -0,0 +1,119 @@
+import pytest
+
+from observations import Observations, Observation
+from observations.render import MarkerLayer, MARKER_TAG, PENDING_TAG
+
+
+class TkCanvas:
+    """the tkinter Canvas calls MarkerLayer makes, items kept in stacking order (bottom first)"""
+    def __init__(self):
+        self.items = []
+        self.kinds = {}
+        self.tags = {}
+        self.coords = {}
+        self.next_id = 1
+
+    def add(self, kind, coords=(), tags=()):
+        item = self.next_id
+        self.next_id += 1
+        self.items.append(item)
+        self.kinds[item] = kind
+        self.tags[item] = tuple(tags)
+        self.coords[item] = coords
+        return item
+
+    def create_oval(self, x0, y0, x1, y1, tags=(), **options):
+        return self.add('oval', (x0, y0, x1, y1), tags)
+
+    def delete(self, item_or_tag):
+        for item in list(self.items):
+            if item == item_or_tag or item_or_tag in self.tags[item]:
+                self.items.remove(item)
+
+    def tag_lower(self, item):
+        self.items.remove(item)
+        self.items.insert(0, item)
+
+    def of_kind(self, kind, tag=None):
+        return [item for item in self.items if self.kinds[item] == kind
+                and (tag is None or tag in self.tags[item])]
+
+
+class Drawing:
+    """the guizero Drawing calls Image.draw and MarkerLayer make"""
+    def __init__(self):
+        self.tk = TkCanvas()
+
+    def image(self, x, y, source, width=None, height=None):
+        return self.tk.add('image', (x, y, width, height))
+
+    def rectangle(self, x0, y0, x1, y1, color=None):
+        return self.tk.add('rectangle', (x0, y0, x1, y1))
+
+    def delete(self, item):
+        self.tk.delete(item)
+
+
+@pytest.fixture
+def marked(folder, make_image):
+    """observations with two marks on a.jpg and one on b.jpg"""
+    observations = Observations('annotations.csv', folder)
+    a = make_image('a.jpg')
+    b = make_image('b.jpg')
+    observations.append(Observation(a, 'zebra', 100, 200))
+    observations.append(Observation(a, 'kudu', 300, 300))
+    observations.append(Observation(b, 'eland', 500, 500))
+    return observations
+
+
+def test_show_draws_image_under_markers(marked):
+    canvas = Drawing()
+    layer = MarkerLayer(canvas, size=5)
+    assert layer.show(marked, 'a.jpg').fname == 'a.jpg'
+    items = canvas.tk.items
+    assert canvas.tk.kinds[items[0]] == 'image'
+    assert len(canvas.tk.of_kind('oval', MARKER_TAG)) == 2
+    zebra = marked.find_by_display_location('a.jpg', 100, 200)
+    assert canvas.tk.coords[layer.items[zebra]] == (95, 200, 105, 205)
+
+
+def test_add_and_remove_touch_one_marker(marked):
+    canvas = Drawing()
+    layer = MarkerLayer(canvas)
+    layer.show(marked, 'a.jpg')
+    untouched = set(canvas.tk.items)
+    eland = marked.append(Observation(marked.image_for('a.jpg'), 'eland', 700, 100))
+    item = layer.add_marker(eland)
+    assert set(canvas.tk.items) == untouched | {item}
+    # drawing it again replaces the item
+    again = layer.add_marker(eland)
+    assert item not in canvas.tk.items and again in canvas.tk.items
+    assert layer.remove_marker(eland)
+    assert set(canvas.tk.items) == untouched
+    assert not layer.remove_marker(eland)
+
+
+def test_next_image_replaces_background_and_markers(marked):
+    canvas = Drawing()
+    layer = MarkerLayer(canvas)
+    layer.show(marked, 'a.jpg')
+    # something else on the canvas, like the timing overlay
+    overlay = canvas.tk.add('text')
+    pending = layer.add_pending(50, 50)
+    layer.show(marked, 'b.jpg')
+    assert overlay in canvas.tk.items and pending not in canvas.tk.items
+    assert len(canvas.tk.of_kind('image')) == 1
+    assert canvas.tk.kinds[canvas.tk.items[0]] == 'image'
+    assert len(canvas.tk.of_kind('oval', MARKER_TAG)) == 1
+    assert [o.species for o in layer.items] == ['eland']
+
+
+def test_pending_mark_is_removed_on_its_own(marked):
+    canvas = Drawing()
+    layer = MarkerLayer(canvas)
+    layer.show(marked, 'a.jpg')
+    pending = layer.add_pending(50, 50)
+    assert canvas.tk.of_kind('oval', PENDING_TAG) == [pending]
+    layer.remove_item(pending)
+    assert canvas.tk.of_kind('oval', PENDING_TAG) == []
+    assert len(canvas.tk.of_kind('oval', MARKER_TAG)) == 2
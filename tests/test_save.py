@@ -0,0 +1,119 @@
+import os
+import shutil
+import threading
+
+import pytest
+
+from observations import Observations, Observation, csvdata
+
+
+def species_in(pathname):
+    return sorted(row['species'] for row in csvdata.read_csv(pathname))
+
+
+def species_of(observations, fname='a.jpg'):
+    return sorted(o.species for o in observations.get_by_filename(fname))
+
+
+def in_other_thread(function, *args):
+    """run function in another thread, fail if it has to wait for the observations lock"""
+    worker = threading.Thread(target=function, args=args)
+    worker.start()
+    worker.join(5)
+    assert not worker.is_alive(), "blocked on the observations lock"
+
+
+@pytest.mark.parametrize('options', [{'journal': True}, {'annotator': 'ann'}])
+def test_marks_made_while_annotations_csv_is_written_are_kept(folder, make_image, monkeypatch, options):
+    image = make_image('a.jpg')
+    observations = Observations('annotations.csv', folder, **options)
+    observations.append(Observation(image, 'zebra', 100, 200))
+    write_csv = csvdata.write_csv
+
+    def write_during_a_mark(rows, *args, **kwargs):
+        in_other_thread(observations.append, Observation(image, 'kudu', 300, 300))
+        in_other_thread(observations.get_by_filename, 'a.jpg')
+        write_csv(rows, *args, **kwargs)
+
+    monkeypatch.setattr(csvdata, 'write_csv', write_during_a_mark)
+    assert observations.compact()
+    monkeypatch.undo()
+    # the mark made during the write is not in the file, it waits in the journal
+    assert species_in(observations.pathname) == ['zebra']
+    assert observations.dirty and observations.storage.pending == 1
+    assert species_of(Observations('annotations.csv', folder, **options)) == ['kudu', 'zebra']
+    observations.close()
+    assert species_in(observations.pathname) == ['kudu', 'zebra']
+    assert observations.storage.pending == 0
+
+
+def test_failed_write_loses_nothing(folder, make_image, monkeypatch):
+    image = make_image('a.jpg')
+    observations = Observations('annotations.csv', folder, journal=True)
+    zebra = observations.append(Observation(image, 'zebra', 100, 200))
+    observations.save()
+
+    def crash(rows, *args, **kwargs):
+        in_other_thread(observations.remove, zebra)
+        raise OSError("disk full")
+
+    monkeypatch.setattr(csvdata, 'write_csv', crash)
+    with pytest.raises(OSError):
+        observations.compact()
+    monkeypatch.undo()
+    assert observations.dirty
+    # the records being folded in and the remove made during the write are replayed
+    assert os.path.exists(observations.pathname + '.journal.compacting')
+    assert species_of(Observations('annotations.csv', folder, journal=True)) == []
+    observations.append(Observation(image, 'kudu', 300, 300))
+    observations.close()
+    assert species_in(observations.pathname) == ['kudu']
+    assert not os.path.exists(observations.pathname + '.journal.compacting')
+
+
+@pytest.mark.parametrize('options', [{}, {'lazy': True, 'columnar': True}])
+def test_replaying_records_already_written_changes_nothing(folder, make_image, options):
+    # a crash after annotations.csv is written but before the journal moved aside is deleted
+    image = make_image('a.jpg')
+    observations = Observations('annotations.csv', folder, journal=True)
+    observations.append(Observation(image, 'zebra', 100, 200))
+    kudu = observations.append(Observation(image, 'kudu', 300, 300))
+    observations.edit(kudu, species='eland')
+    observations.save()
+    journal = observations.pathname + '.journal'
+    shutil.copy(journal, folder + '/journal.copy')
+    observations.close()
+    shutil.copy(folder + '/journal.copy', journal + '.compacting')
+    reopened = Observations('annotations.csv', folder, journal=True, **options)
+    assert species_of(reopened) == ['eland', 'zebra']
+    assert reopened.count() == 2
+
+
+def test_appends_never_fsync_the_save_does(folder, make_image, monkeypatch):
+    image = make_image('a.jpg')
+    observations = Observations('annotations.csv', folder, journal=True)
+    synced = []
+    fsync = os.fsync
+    monkeypatch.setattr(os, 'fsync', lambda descriptor: synced.append(descriptor) or fsync(descriptor))
+    for position in range(observations.storage.journal.sync_every):
+        assert not observations.sync_due
+        observations.append(Observation(image, 'zebra', position, position))
+    assert synced == [] and observations.sync_due
+    observations.save()
+    assert len(synced) == 1 and not observations.sync_due
+
+
+def test_remove_waits_for_the_lock(folder, make_image):
+    # the index is looked up and used under one hold of the lock, another thread can't move it in between
+    image = make_image('a.jpg')
+    observations = Observations('annotations.csv', folder)
+    zebra = observations.append(Observation(image, 'zebra', 100, 200))
+    observations.append(Observation(image, 'kudu', 300, 300))
+    worker = threading.Thread(target=observations.remove, args=(zebra,))
+    with observations.lock:
+        worker.start()
+        worker.join(0.2)
+        assert worker.is_alive()
+        assert observations.index_of(zebra) >= 0
+    worker.join(5)
+    assert species_of(observations) == ['kudu']
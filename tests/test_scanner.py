@@ -0,0 +1,111 @@
+import os
+
+import pytest
+
+from observations import scanner as scanner_module
+from observations.scanner import FolderScanner
+
+
+class DatedCache:
+    """stands in for an ExifCache, counts the lookups a scan makes"""
+    def __init__(self, dates):
+        self.dates = dates
+        self.looked_up = []
+        self.saves = 0
+
+    def lookup(self, fname):
+        self.looked_up.append(fname)
+        return None, {'datetime': self.dates.get(fname, '')}
+
+    def save(self):
+        self.saves += 1
+
+
+def touch(directory, *names):
+    for name in names:
+        with open(os.path.join(directory, name), 'wb') as f:
+            f.write(b'')
+    changed(directory)
+
+
+def changed(directory):
+    # some file systems keep mtimes in whole seconds, move the directory on explicitly
+    mtime = os.stat(directory).st_mtime_ns + 2 * 10 ** 9
+    os.utime(directory, ns=(mtime, mtime))
+
+
+@pytest.fixture
+def count_scandir(monkeypatch):
+    calls = []
+    scandir = os.scandir
+
+    def counting(directory):
+        calls.append(directory)
+        return scandir(directory)
+    monkeypatch.setattr(os, 'scandir', counting)
+    return calls
+
+
+def test_lists_images_only(folder):
+    touch(folder, 'b.JPG', 'a.jpg', 'c.png', 'notes.txt', '._a.jpg', 'annotations.csv')
+    os.mkdir(os.path.join(folder, 'sub.jpg'))
+    assert FolderScanner().scan(folder) == ['a.jpg', 'b.JPG', 'c.png']
+
+
+def test_unchanged_folder_is_not_read_again(folder, count_scandir):
+    touch(folder, 'a.jpg', 'b.jpg')
+    scanner = FolderScanner()
+    assert scanner.scan(folder) == ['a.jpg', 'b.jpg']
+    assert scanner.scan(folder) == ['a.jpg', 'b.jpg']
+    assert len(count_scandir) == 1
+    assert scanner.last_added == [] and scanner.last_removed == []
+
+
+def test_rescan_reports_the_difference(folder):
+    touch(folder, 'a.jpg', 'c.jpg', 'd.jpg')
+    scanner = FolderScanner()
+    scanner.scan(folder)
+    assert scanner.last_added == ['a.jpg', 'c.jpg', 'd.jpg']
+    os.remove(os.path.join(folder, 'd.jpg'))
+    touch(folder, 'b.jpg', 'e.jpg')
+    assert scanner.scan(folder) == ['a.jpg', 'b.jpg', 'c.jpg', 'e.jpg']
+    assert scanner.last_added == ['b.jpg', 'e.jpg']
+    assert scanner.last_removed == ['d.jpg']
+
+
+def test_datetime_order_only_looks_up_new_files(folder):
+    cache = DatedCache({'a.jpg': '2024:01:02 10:00:00', 'b.jpg': '2024:01:01 10:00:00',
+                        'd.jpg': '2024:01:01 09:00:00'})
+    scanner = FolderScanner(sort='datetime', exif_cache_for=lambda directory: cache)
+    touch(folder, 'a.jpg', 'b.jpg', 'c.jpg')
+    # undated images go last
+    assert scanner.scan(folder) == ['b.jpg', 'a.jpg', 'c.jpg']
+    assert sorted(cache.looked_up) == ['a.jpg', 'b.jpg', 'c.jpg'] and cache.saves == 1
+    cache.looked_up = []
+    touch(folder, 'd.jpg')
+    assert scanner.scan(folder) == ['d.jpg', 'b.jpg', 'a.jpg', 'c.jpg']
+    assert cache.looked_up == ['d.jpg'] and cache.saves == 2
+
+
+def test_recursive_rescans_only_changed_directories(folder, count_scandir):
+    os.mkdir(os.path.join(folder, 'day1'))
+    touch(os.path.join(folder, 'day1'), 'a.jpg')
+    touch(folder, 'top.jpg')
+    scanner = FolderScanner(recursive=True)
+    assert scanner.scan(folder) == [os.path.join('day1', 'a.jpg'), 'top.jpg']
+    del count_scandir[:]
+    touch(os.path.join(folder, 'day1'), 'b.jpg')
+    assert scanner.scan(folder) == [os.path.join('day1', 'a.jpg'), os.path.join('day1', 'b.jpg'), 'top.jpg']
+    assert count_scandir == [os.path.join(folder, 'day1')]
+    assert scanner.last_added == [os.path.join('day1', 'b.jpg')]
+
+
+def test_get_image_filenames_keeps_the_scanner(folder, monkeypatch):
+    monkeypatch.setattr(scanner_module, 'scanner', FolderScanner())
+    touch(folder, 'a.jpg')
+    scanner_module.get_image_filenames(folder)
+    kept = scanner_module.scanner
+    scanner_module.get_image_filenames(folder)
+    assert scanner_module.scanner is kept
+    scanner_module.get_image_filenames(folder, recursive=True)
+    assert scanner_module.scanner is not kept and scanner_module.scanner.recursive
@@ -0,0 +1,64 @@
+from observations import Observations, Observation, image_registry, NATIVE
+from observations.sequences import Sequences, parse_datetime
+
+T = parse_datetime('2024:05:01 06:00:00')
+
+
+def test_parse_datetime():
+    assert parse_datetime('2024:05:01 06:00:10') == T + 10
+    assert parse_datetime('0000:00:00 00:00:00') is None
+    assert parse_datetime('') is None
+    assert parse_datetime(None) is None
+
+
+def test_frames_close_in_time_are_one_burst():
+    times = [T, T + 2, T + 4, T + 60, T + 61, None, T + 200, T + 199]
+    sequences = Sequences(times, gap=10)
+    assert sequences.lengths() == [3, 2, 1, 1, 1]
+    assert list(sequences.frames(1)) == [0, 1, 2]
+    assert sequences.sequence(4) == 1
+    # undated and out of order frames are bursts of their own
+    assert list(sequences.frames(5)) == [5]
+    assert list(sequences.frames(7)) == [7]
+
+
+def test_a_new_camera_starts_a_new_burst():
+    sequences = Sequences([T, T + 1, T + 2], gap=10, cameras=['A', 'A', 'B'])
+    assert sequences.lengths() == [2, 1]
+
+
+def test_burst_navigation_wraps_around():
+    sequences = Sequences([T, T + 1, T + 100, T + 101, T + 300])
+    assert sequences.next_sequence(0) == 2
+    assert sequences.next_sequence(3) == 4
+    assert sequences.next_sequence(4) == 0
+    assert sequences.previous_sequence(3) == 0
+    assert sequences.previous_sequence(1) == 4
+    empty = Sequences([])
+    assert len(empty) == 0 and empty.next_sequence(0) == 0
+
+
+def test_for_folder_reads_the_exif_cache(folder, make_image):
+    for fname, when in [('a.jpg', '2024:05:01 06:00:00'), ('b.jpg', '2024:05:01 06:00:03'),
+                        ('c.jpg', '2024:05:01 07:00:00')]:
+        make_image(fname, datetime=when, camera_id='CAM01')
+    sequences = Sequences.for_folder(folder, ['a.jpg', 'b.jpg', 'c.jpg'],
+                                     exif_cache_for=image_registry.cache_for)
+    assert sequences.lengths() == [2, 1]
+
+
+def test_copy_marks_across_a_burst(folder, make_image):
+    burst = ['a.jpg', 'b.jpg', 'c.jpg']
+    images = [make_image(fname) for fname in burst]
+    observations = Observations('annotations.csv', folder)
+    observations.append(Observation(images[0], 'zebra', 100, 200))
+    # c.jpg already has the zebra 40 native pixels (about 10 on screen) away
+    observations.append(Observation(images[2], 'zebra', 431, 781, space=NATIVE))
+    copies = observations.copy_marks('a.jpg', burst)
+    assert [copy.image.fname for copy in copies] == ['b.jpg']
+    assert (copies[0].x, copies[0].y) == (391, 781)
+    assert observations.copy_marks('a.jpg', burst) == []
+    # one undo takes back the whole copy
+    observations.undo()
+    assert observations.get_by_filename('b.jpg') == []
+    assert len(observations.get_by_filename('c.jpg')) == 1
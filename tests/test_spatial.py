@@ -0,0 +1,67 @@
+import random
+
+from observations.spatial import GridIndex
+
+
+class Point:
+    """the part of an observation a GridIndex uses"""
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+def brute_nearest(points, x, y, tolerance):
+    best = None
+    for point in points:
+        distance = (point.x - x) ** 2 + (point.y - y) ** 2
+        if distance <= tolerance * tolerance and (best is None or distance < best[0]):
+            best = (distance, point)
+    return best and best[1]
+
+
+def test_nearest_matches_a_linear_scan():
+    generator = random.Random(3)
+    points = [Point(generator.randrange(4000), generator.randrange(3000)) for _ in range(2000)]
+    grid = GridIndex(cell_size=40)
+    for point in points:
+        grid.insert(point)
+    for _ in range(300):
+        x, y = generator.randrange(4000), generator.randrange(3000)
+        found = grid.nearest(x, y, 60)
+        expected = brute_nearest(points, x, y, 60)
+        if expected is None:
+            assert found is None
+        else:
+            # ties may pick either, the distance is what matters
+            assert (found.x - x) ** 2 + (found.y - y) ** 2 == (expected.x - x) ** 2 + (expected.y - y) ** 2
+
+
+def test_tolerance_edge_and_negative_cells():
+    grid = GridIndex(cell_size=10)
+    point = Point(0, 0)
+    grid.insert(point)
+    assert grid.nearest(-15, 0, 15) is point
+    assert grid.nearest(-16, 0, 15) is None
+    assert grid.nearest(3, 4, 5) is point
+
+
+def test_in_rect_corners_in_any_order():
+    grid = GridIndex(cell_size=10)
+    inside = [Point(5, 5), Point(20, 20), Point(20, 5)]
+    outside = [Point(21, 5), Point(500, 500)]
+    for point in inside + outside:
+        grid.insert(point)
+    assert set(grid.in_rect(20, 20, 5, 5)) == set(inside)
+    # a huge rectangle walks the occupied cells instead
+    assert len(grid.in_rect(-10 ** 6, -10 ** 6, 10 ** 6, 10 ** 6)) == 5
+
+
+def test_remove():
+    grid = GridIndex(cell_size=10)
+    first, second = Point(1, 1), Point(2, 2)
+    grid.insert(first)
+    grid.insert(second)
+    assert grid.remove(first) and len(grid) == 1
+    assert not grid.remove(first)
+    assert grid.nearest(1, 1, 5) is second
+    assert grid.remove(second) and not grid.cells
@@ -0,0 +1,124 @@
+import os
+
+import pytest
+
+from observations import Observations, OBSERVATION_FIELDS, NATIVE, csvdata
+from observations.storage import SQLiteStorage
+
+LEGACY_FIELDS = [field for field in OBSERVATION_FIELDS if field not in ('space', 'id')]
+
+
+@pytest.fixture
+def project(folder, make_image, tmp_path_factory):
+    """a project database with one legacy (display pixels, no IDs) folder imported"""
+    make_image('a.jpg')
+    rows = [{'species': species, 'x': x, 'y': y, 'fname': 'a.jpg', 'path': folder,
+             'pathname': os.path.join(folder, 'a.jpg'), 'datetime': '', 'width': 4000,
+             'height': 3000, 'camera': ''}
+            for species, x, y in [('zebra', 100, 200), ('kudu', 300, 300)]]
+    csv_pathname = os.path.join(folder, 'annotations.csv')
+    csvdata.write_csv(rows, csv_pathname, fieldnames=LEGACY_FIELDS)
+    pathname = str(tmp_path_factory.mktemp('project') / 'project.sqlite')
+    storage = SQLiteStorage(pathname, OBSERVATION_FIELDS)
+    assert storage.import_csv(csv_pathname) == 2
+    storage.close()
+    return pathname
+
+
+def open_folder(pathname, folder, **options):
+    storage = SQLiteStorage(pathname, OBSERVATION_FIELDS)
+    return Observations('annotations.csv', folder, storage=storage, **options), storage
+
+
+def test_import_stores_ids_and_native_pixels(project, folder):
+    storage = SQLiteStorage(project, OBSERVATION_FIELDS)
+    rows = list(storage.query(path=folder))
+    assert all(row['id'] and row['space'] == NATIVE for row in rows)
+    assert (rows[0]['x'], rows[0]['y']) == (391, 781)
+    storage.close()
+
+
+@pytest.mark.parametrize('options', [{}, {'lazy': True, 'columnar': True}])
+def test_remove_imported_mark(project, folder, options):
+    observations, storage = open_folder(project, folder, **options)
+    zebra = [o for o in observations.get_by_filename('a.jpg') if o.species == 'zebra'][0]
+    assert observations.remove(zebra)
+    observations.save()
+    storage.close()
+    observations, storage = open_folder(project, folder, **options)
+    assert [o.species for o in observations.get_by_filename('a.jpg')] == ['kudu']
+    storage.close()
+
+
+def test_edit_imported_mark(project, folder):
+    observations, storage = open_folder(project, folder)
+    kudu = [o for o in observations.get_by_filename('a.jpg') if o.species == 'kudu'][0]
+    observations.edit(kudu, species='eland')
+    observations.save()
+    storage.close()
+    observations, storage = open_folder(project, folder)
+    assert sorted(o.species for o in observations.get_by_filename('a.jpg')) == ['eland', 'zebra']
+    storage.close()
+
+
+def test_rows_added_before_ids_are_upgraded_on_load(folder, make_image, tmp_path_factory):
+    make_image('a.jpg')
+    pathname = str(tmp_path_factory.mktemp('project') / 'project.sqlite')
+    storage = SQLiteStorage(pathname, OBSERVATION_FIELDS)
+    storage.insert_many([{'species': 'zebra', 'x': 100, 'y': 200, 'fname': 'a.jpg', 'path': folder,
+                          'width': 4000, 'height': 3000, 'space': '', 'id': ''}])
+    storage.sync()
+    loaded = storage.load(folder)
+    stored = list(storage.query(path=folder))
+    assert stored[0]['id'] == loaded[0]['id'] != ''
+    assert (stored[0]['x'], stored[0]['y'], stored[0]['space']) == (391, 781, NATIVE)
+    assert storage.upgrade(folder) == 0
+    storage.close()
+
+
+def test_import_moves_rows_to_the_folder(folder, make_image, tmp_path_factory):
+    # annotated on another machine, the CSV names a folder which isn't here
+    make_image('a.jpg')
+    elsewhere = '/media/other/CAM01'
+    rows = [{'species': 'zebra', 'x': 100, 'y': 200, 'fname': 'a.jpg', 'path': elsewhere,
+             'pathname': elsewhere + '/a.jpg', 'datetime': '', 'width': 4000, 'height': 3000,
+             'camera': ''}]
+    csv_pathname = os.path.join(folder, 'annotations.csv')
+    csvdata.write_csv(rows, csv_pathname, fieldnames=LEGACY_FIELDS)
+    storage = SQLiteStorage(str(tmp_path_factory.mktemp('project') / 'project.sqlite'), OBSERVATION_FIELDS)
+    assert not storage.imported(folder)
+    assert storage.import_csv(csv_pathname, folder) == 1
+    assert storage.imported(folder) and not storage.imported(elsewhere)
+    loaded = storage.load(folder)
+    assert [(row['species'], row['pathname']) for row in loaded] == [('zebra', os.path.join(folder, 'a.jpg'))]
+    assert storage.count(path=elsewhere) == 0
+    storage.close()
+
+
+def test_folders_of_older_projects_count_as_imported(project, folder, tmp_path_factory):
+    storage = SQLiteStorage(project, OBSERVATION_FIELDS)
+    storage.connection.execute('DROP TABLE observations_imported')
+    storage.close()
+    storage = SQLiteStorage(project, OBSERVATION_FIELDS)
+    assert storage.imported(folder)
+    assert not storage.imported(str(tmp_path_factory.mktemp('empty')))
+    storage.close()
+
+
+def test_remove_stays_in_its_folder(project, folder, tmp_path_factory):
+    # the same legacy row in a second folder gets the same ID (the path is left out of it)
+    other = str(tmp_path_factory.mktemp('other'))
+    storage = SQLiteStorage(project, OBSERVATION_FIELDS)
+    rows = [dict(row, path=other) for row in storage.query(path=folder)]
+    csv_pathname = os.path.join(other, 'annotations.csv')
+    csvdata.write_csv(rows, csv_pathname, fieldnames=OBSERVATION_FIELDS)
+    storage.import_csv(csv_pathname)
+    assert list(storage.query(path=other))[0]['id'] == list(storage.query(path=folder))[0]['id']
+    storage.close()
+    observations, storage = open_folder(project, folder)
+    zebra = [o for o in observations.get_by_filename('a.jpg') if o.species == 'zebra'][0]
+    observations.remove(zebra)
+    observations.save()
+    assert sorted(row['species'] for row in storage.query(path=other)) == ['kudu', 'zebra']
+    assert [row['species'] for row in storage.query(path=folder)] == ['kudu']
+    storage.close()
@@ -0,0 +1,63 @@
+import pytest
+
+from observations import Observations, Observation
+from observations.summary import Summary, date_hour, UNDATED, NO_HOUR
+
+
+def test_date_hour():
+    assert date_hour('2024:05:01 06:30:00') == ('2024-05-01', 6)
+    assert date_hour('') == (UNDATED, NO_HOUR)
+    assert date_hour('2024:05:01') == (UNDATED, NO_HOUR)
+    assert date_hour('2024:05:01 xx:30:00') == (UNDATED, NO_HOUR)
+
+
+def test_add_and_remove_keep_counts():
+    summary = Summary()
+    summary.add('zebra', 'CAM01', '2024:05:01 06:30:00')
+    summary.add('zebra', 'CAM01', '2024:05:01 06:45:00')
+    summary.add('kudu', 'CAM02', '')
+    assert summary.counts[('zebra', 'CAM01', '2024-05-01', 6)] == 2
+    summary.remove('kudu', 'CAM02', '')
+    # a count which drops to nothing leaves no key behind
+    assert ('kudu', 'CAM02', UNDATED, NO_HOUR) not in summary.counts
+    assert summary.total == 2
+
+
+def test_table_rolls_up_and_filters():
+    summary = Summary.from_serials([
+        {'species': 'zebra', 'camera': 'CAM01', 'datetime': '2024:05:01 06:30:00'},
+        {'species': 'zebra', 'camera': 'CAM02', 'datetime': '2024:05:01 18:00:00'},
+        {'species': 'kudu', 'camera': 'CAM01', 'datetime': '2024:05:02 06:10:00'},
+        {'species': 'kudu', 'camera': None, 'datetime': None},
+    ])
+    assert summary.table() == [(('kudu',), 2), (('zebra',), 2)]
+    assert summary.table(by=('camera', 'hour'), species='zebra') == [(('CAM01', 6), 1), (('CAM02', 18), 1)]
+    assert summary.table(by=('date',), camera='CAM01') == [(('2024-05-01',), 1), (('2024-05-02',), 1)]
+    # None filters are ignored (unset command line options)
+    assert summary.table(camera=None) == summary.table()
+    with pytest.raises(ValueError):
+        summary.table(by=('colour',))
+    with pytest.raises(ValueError):
+        summary.table(colour='red')
+    assert summary.format_table().splitlines()[-1] == 'total 4'
+
+
+@pytest.mark.parametrize('options', [{}, {'lazy': True, 'columnar': True}])
+def test_observations_keep_the_summary_up_to_date(folder, make_image, options):
+    morning = make_image('a.jpg', datetime='2024:05:01 06:30:00', camera_id='CAM01')
+    evening = make_image('b.jpg', datetime='2024:05:01 18:00:00', camera_id='CAM01')
+    observations = Observations('annotations.csv', folder, **options)
+    observations.append(Observation(morning, 'zebra', 100, 200))
+    summary = observations.summarize()
+    kudu = observations.append(Observation(evening, 'kudu', 300, 300))
+    observations.append(Observation(evening, 'zebra', 500, 300))
+    observations.edit(kudu, species='eland')
+    zebra = observations.find_by_display_location('a.jpg', 100, 200)
+    observations.remove(zebra)
+    assert observations.summarize() is summary
+    assert summary.table(by=('species', 'hour')) == [(('eland', 18), 1), (('zebra', 18), 1)]
+    assert summary.counts == Summary.from_serials(observations.iter_canonical()).counts
+    # and after a reopen
+    observations.save()
+    reopened = Observations('annotations.csv', folder, **options)
+    assert reopened.summarize().counts == summary.counts
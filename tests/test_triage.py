@@ -0,0 +1,75 @@
+import os
+
+import pytest
+
+from observations.triage import Triage, TRIAGE_FILENAME, MAGIC
+
+FILES = ['img{}.jpg'.format(position) for position in range(10)]
+
+
+def test_next_unreviewed_skips_reviewed_runs_and_wraps():
+    triage = Triage(FILES)
+    for position in (3, 4, 5, 6, 9):
+        triage.set_reviewed(position)
+    assert triage.next_unreviewed(2) == 7
+    assert triage.next_unreviewed(8) == 0
+    assert triage.upcoming(2, 3) == [7, 8]
+    triage.clear(5)
+    assert triage.next_unreviewed(2) == 5
+    for position in range(10):
+        triage.set_reviewed(position)
+    assert triage.next_unreviewed(0) is None
+
+
+def test_next_marked_follows_the_marks():
+    triage = Triage(FILES)
+    triage.update_marks(['img2.jpg', 'img7.jpg', 'elsewhere.jpg'])
+    assert triage.next_marked(2) == 7
+    assert triage.next_marked(7) == 2
+    triage.set_marked(7, False)
+    assert triage.next_marked(2) == 2
+    triage.set_marked(2, False)
+    assert triage.next_marked(0) is None
+
+
+def test_marks_clear_the_empty_flag():
+    triage = Triage(FILES)
+    triage.set_reviewed(4, empty=True)
+    assert triage.counts() == (1, 1, 10)
+    triage.set_marked(4, True)
+    assert triage.counts() == (1, 0, 10)
+
+
+def test_flags_survive_save_and_a_changed_folder(folder):
+    triage = Triage.load(folder, FILES)
+    triage.set_reviewed(1, empty=True)
+    triage.set_reviewed(8)
+    triage.save()
+    assert Triage.load(folder, FILES).counts() == (2, 1, 10)
+    # img0.jpg was deleted, a new image sorts first
+    changed = ['new.jpg'] + FILES[1:]
+    loaded = Triage.load(folder, changed)
+    assert loaded.reviewed[1] and loaded.empty[1] and loaded.reviewed[8]
+    assert loaded.next_unreviewed(0) == 2
+
+
+@pytest.mark.parametrize('damage', [MAGIC, MAGIC + b'ten\n', MAGIC + b'3\n\xff\xfe\n'])
+def test_damaged_sidecar_starts_fresh(folder, damage):
+    with open(os.path.join(folder, TRIAGE_FILENAME), 'wb') as f:
+        f.write(damage)
+    triage = Triage.load(folder, FILES)
+    assert triage.counts() == (0, 0, 10)
+    assert triage.next_unreviewed(0) == 1
+
+
+def test_reorder_keeps_the_flags_of_each_image():
+    triage = Triage(FILES)
+    triage.set_reviewed(1, empty=True)
+    triage.set_reviewed(2)
+    triage.update_marks(['img2.jpg'])
+    reordered = triage.reorder(list(reversed(FILES)))
+    assert reordered.files[8] == 'img1.jpg' and reordered.reviewed[8] and reordered.empty[8]
+    assert reordered.reviewed[7] and reordered.marked[7] and not reordered.empty[7]
+    assert reordered.dirty
+    assert reordered.next_unreviewed(6) == 9
+    assert reordered.next_marked(0) == 7
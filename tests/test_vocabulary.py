@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+from observations import Observations, Observation, OBSERVATION_FIELDS, csvdata
+from observations.vocabulary import Vocabulary, UNKNOWN
+
+
+@pytest.fixture
+def vocabulary():
+    vocabulary = Vocabulary()
+    vocabulary.add('plains zebra', ['zebra', "Burchell's zebra"], hotkey='1')
+    vocabulary.add('greater kudu', ['kudu'])
+    return vocabulary
+
+
+def test_aliases_resolve_to_the_canonical_name(vocabulary):
+    zebra = vocabulary.lookup('plains zebra')
+    assert vocabulary.code('Zebra ') == vocabulary.code("burchell's  ZEBRA") == zebra
+    assert vocabulary.canonical('kudu') == 'greater kudu'
+    assert vocabulary.complete('zeb') == [zebra]
+    assert vocabulary.by_hotkey('1') == zebra
+    # an unknown name is a new species
+    assert vocabulary.canonical('Eland') == 'Eland' and vocabulary.dirty
+
+
+def test_saved_vocabulary_loads_the_same(vocabulary, folder):
+    pathname = os.path.join(folder, 'species.csv')
+    vocabulary.save(pathname)
+    loaded = Vocabulary.load(pathname)
+    assert loaded.values == vocabulary.values
+    assert loaded.canonical('burchells zebra') == 'burchells zebra'
+    assert loaded.canonical("Burchell's zebra") == 'plains zebra'
+    assert loaded.hotkey_of(loaded.lookup('zebra')) == '1'
+
+
+def test_blank_species_are_unknown(vocabulary):
+    assert vocabulary.code('') == vocabulary.code('   ') == UNKNOWN
+    assert vocabulary.canonical(' ') == ''
+    assert vocabulary[UNKNOWN] == ''
+    with pytest.raises(ValueError):
+        vocabulary.add('  ')
+
+
+def test_blank_rows_in_species_csv_are_skipped(folder):
+    pathname = os.path.join(folder, 'species.csv')
+    csvdata.write_csv([{'id': 0, 'name': 'zebra', 'aliases': '', 'hotkey': ''},
+                       {'id': 1, 'name': ' ', 'aliases': 'nothing', 'hotkey': '2'},
+                       {'id': 2, 'name': 'kudu', 'aliases': '', 'hotkey': ''}],
+                      pathname, fieldnames=['id', 'name', 'aliases', 'hotkey'])
+    assert Vocabulary.load(pathname).values == ['zebra', 'kudu']
+
+
+@pytest.mark.parametrize('options', [{}, {'lazy': True, 'columnar': True}])
+def test_marks_with_blank_or_alias_species_load(vocabulary, folder, make_image, options):
+    make_image('a.jpg')
+    rows = [{'species': species, 'x': 10 * position, 'y': 10, 'fname': 'a.jpg', 'path': folder,
+             'width': 4000, 'height': 3000, 'space': 'native', 'id': ''}
+            for position, species in enumerate(['', '   ', 'Zebra', 'kudu'])]
+    csvdata.write_csv(rows, os.path.join(folder, 'annotations.csv'), fieldnames=OBSERVATION_FIELDS)
+    observations = Observations('annotations.csv', folder, vocabulary=vocabulary, **options)
+    found = observations.get_by_filename('a.jpg')
+    assert sorted(o.species for o in found) == ['', '', 'greater kudu', 'plains zebra']
+    # a blank species typed into the edit prompt doesn't raise either
+    observations.edit(found[-1], species='  ')
+    assert sorted(row['species'] for row in observations.serialize()) == ['', '', '', 'plains zebra']